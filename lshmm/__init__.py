@@ -1,3 +1,22 @@
 """Functions to run forwards, backwards, and Viterbi algorithms on haploid or diploid genotype data."""
 
-from .api import backwards, check_inputs, forwards, path_loglik, viterbi
+from .api import (
+    PreparedPanel,
+    backwards,
+    check_inputs,
+    forwards,
+    forwards_viterbi,
+    log_likelihood,
+    path_loglik,
+    posteriors,
+    prepare_panel,
+    register_emission_model,
+    viterbi,
+)
+from .executor import (
+    forwards_async,
+    submit_forwards,
+    submit_viterbi,
+    viterbi_async,
+)
+from .pool import SharedPanelPool
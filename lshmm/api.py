@@ -1,31 +1,240 @@
 """External API definitions."""
 
+import collections
+import threading
 import warnings
 
+import numba
 import numpy as np
 
+from . import checkpointing
 from . import core
+from . import jit
 from .fb_diploid import (
     backward_ls_dip_loop,
+    backward_ls_dip_loop_batch,
+    backward_ls_dip_loop_parallel,
+    backward_ls_dip_sparse,
+    backward_ls_dip_sparse_batch,
+    backward_ls_dip_unordered,
+    backward_ls_dip_unordered_batch,
     forward_ls_dip_loop,
+    forward_ls_dip_loop_batch,
+    forward_ls_dip_loop_log,
+    forward_ls_dip_loop_log_batch,
+    forward_ls_dip_loop_loglik,
+    forward_ls_dip_loop_loglik_batch,
+    forward_ls_dip_loop_parallel,
+    forward_ls_dip_sparse,
+    forward_ls_dip_sparse_batch,
+    forward_ls_dip_sparse_loglik,
+    forward_ls_dip_sparse_loglik_batch,
+    forward_ls_dip_unordered,
+    forward_ls_dip_unordered_batch,
+    posteriors_ls_dip_loop,
+    posteriors_ls_dip_loop_batch,
 )
 from .fb_haploid import (
     backwards_ls_hap,
+    backwards_ls_hap_batch,
+    backwards_ls_hap_parallel,
+    backwards_ls_hap_sparse,
+    backwards_ls_hap_sparse_batch,
     forwards_ls_hap,
+    forwards_ls_hap_batch,
+    forwards_ls_hap_log,
+    forwards_ls_hap_log_batch,
+    forwards_ls_hap_loglik,
+    forwards_ls_hap_loglik_batch,
+    forwards_ls_hap_parallel,
+    forwards_ls_hap_sparse,
+    forwards_ls_hap_sparse_batch,
+    forwards_ls_hap_sparse_loglik,
+    forwards_ls_hap_sparse_loglik_batch,
+    posteriors_ls_hap,
+    posteriors_ls_hap_batch,
 )
 from .vit_diploid import (
-    backwards_viterbi_dip,
-    forwards_viterbi_dip_low_mem,
+    backwards_viterbi_dip_packed,
+    backwards_viterbi_dip_unordered,
+    forwards_loglik_viterbi_dip,
+    forwards_viterbi_dip_low_mem_packed,
+    forwards_viterbi_dip_low_mem_packed_parallel,
+    forwards_viterbi_dip_unordered,
     get_phased_path,
     path_ll_dip,
+    viterbi_dip_batch,
+    viterbi_dip_unordered_batch,
 )
 from .vit_haploid import (
-    backwards_viterbi_hap,
-    forwards_viterbi_hap_lower_mem_rescaling,
+    backwards_viterbi_hap_compact,
+    backwards_viterbi_hap_sparse,
+    forwards_loglik_viterbi_hap,
+    forwards_viterbi_hap_lower_mem_rescaling_compact,
+    forwards_viterbi_hap_parallel,
+    forwards_viterbi_hap_sparse,
     path_ll_hap,
+    viterbi_hap_batch,
+    viterbi_hap_sparse_batch,
 )
 
 
+class PreparedPanel:
+    """
+    A reference panel that is validated once, and that caches the per-panel data
+    needed to run the HMM algorithms.
+
+    The reference panel is an array of size (m, n), where:
+        m = number of sites.
+        n = number of haplotypes (not individuals) in the reference panel.
+
+    The cached data are the number of copiable entries per site, the set of alleles
+    at each site, and the emission probability matrices, which are keyed by
+    the mutation probabilities, whether to scale the mutation rate, and the number
+    of distinct alleles per site implied by a query. As the number of distinct
+    alleles depends on the query, only the :attr:`max_cached_emission_matrices`
+    most recently used emission matrices are kept. In the diploid case,
+    the number of copiable entries per site is the number of copiable pairs
+    of haplotypes; the reference genotypes are not materialised, but computed
+    from pairs of haplotypes by the kernels as needed. The per-site index of
+    the minor allele carriers, used by the sparse kernels, is computed
+    the first time it is needed.
+
+    A prepared panel can be passed to all the API functions in place of
+    an array of reference haplotypes.
+
+    :param numpy.ndarray reference_panel: A panel of reference haplotypes.
+    :param int ploidy: Ploidy (only 1 or 2 are supported).
+    """
+
+    max_cached_emission_matrices = 8
+
+    def __init__(self, reference_panel, ploidy):
+        # Check ploidy.
+        if not ploidy in [1, 2]:
+            err_msg = "Only ploidy levels 1 and 2 are supported."
+            raise ValueError(err_msg)
+
+        # Check the reference panel.
+        if not len(reference_panel.shape) == 2:
+            err_msg = "Reference panel array has incorrect dimensions."
+            raise ValueError(err_msg)
+
+        if core.has_allele(reference_panel, core.MISSING):
+            err_msg = "Reference panel cannot have any MISSING values."
+            raise ValueError(err_msg)
+
+        if ploidy == 2:
+            allowed_alleles = np.array([0, 1, core.NONCOPY])
+            if not core.has_only_alleles(reference_panel, allowed_alleles):
+                err_msg = "Reference panel has not allowed in diploid mode. "
+                err_msg += "Only 0/1 biallelic encoding is supported."
+                raise ValueError(err_msg)
+
+        self.reference_panel = reference_panel
+        self.ploidy = ploidy
+        self.num_sites, self.num_ref_haps = reference_panel.shape
+
+        if ploidy == 1:
+            self.num_copiable_entries = core.get_num_copiable_entries(reference_panel)
+        else:
+            self.num_copiable_entries = core.get_num_copiable_entries_diploid(
+                reference_panel
+            )
+
+        # Record the alleles at each site as indices into the array of distinct alleles.
+        self._alleles, self._site_alleles = core.get_site_alleles(reference_panel)
+
+        # The panel can be shared by threads, so the cache is guarded by a lock.
+        self._emission_matrices = collections.OrderedDict()
+        self._emission_matrices_lock = threading.Lock()
+        self._minor_allele_index = None
+
+    def get_minor_allele_index(self):
+        """
+        Return the major allele at each site and the minor allele carriers,
+        as returned by :func:`core.get_minor_allele_index`.
+
+        :return: Major alleles, offsets into the minor allele carriers, and the carriers.
+        :rtype: tuple
+        """
+        if self._minor_allele_index is None:
+            self._minor_allele_index = core.get_minor_allele_index(self.reference_panel)
+        return self._minor_allele_index
+
+    def get_num_alleles(self, query):
+        """
+        Return the number of distinct alleles per site in the reference panel
+        and a set of query haplotypes, as returned by :func:`core.get_num_alleles`.
+
+        :param numpy.ndarray query: An array of query haplotypes of size (k, m).
+        :return: An array of counts of distinct alleles at each site.
+        :rtype: numpy.ndarray
+        """
+        if query.shape[1] != self.num_sites:
+            err_msg = "Number of sites in the reference panel and query do not match."
+            raise ValueError(err_msg)
+        return core.get_num_alleles_with_query(self._alleles, self._site_alleles, query)
+
+    def get_emission_matrix(self, prob_mutation, scale_mutation_rate, num_alleles):
+        """
+        Return the emission probability matrix given the mutation probabilities and
+        the number of distinct alleles per site, computing it only if it is not cached.
+
+        :param numpy.ndarray prob_mutation: Mutation probability per site.
+        :param bool scale_mutation_rate: Scale mutation rate or not.
+        :param numpy.ndarray num_alleles: Number of distinct alleles per site.
+        :return: An emission probability matrix.
+        :rtype: numpy.ndarray
+        """
+        key = (
+            prob_mutation.dtype.str,
+            prob_mutation.tobytes(),
+            bool(scale_mutation_rate),
+            num_alleles.tobytes(),
+        )
+        with self._emission_matrices_lock:
+            emission_matrix = self._emission_matrices.get(key)
+            if emission_matrix is not None:
+                self._emission_matrices.move_to_end(key)
+                return emission_matrix
+        if self.ploidy == 1:
+            get_emission_matrix = core.get_emission_matrix_haploid
+        else:
+            get_emission_matrix = core.get_emission_matrix_diploid
+        emission_matrix = get_emission_matrix(
+            mu=prob_mutation,
+            num_sites=self.num_sites,
+            num_alleles=num_alleles,
+            scale_mutation_rate=scale_mutation_rate,
+        )
+        with self._emission_matrices_lock:
+            self._emission_matrices[key] = emission_matrix
+            # Evict the least recently used matrices, so that the cache stays bounded
+            # however many distinct queries are run against the panel.
+            while len(self._emission_matrices) > self.max_cached_emission_matrices:
+                self._emission_matrices.popitem(last=False)
+        return emission_matrix
+
+
+def prepare_panel(reference_panel, ploidy):
+    """
+    Return a prepared reference panel, validating and preparing it
+    unless it is prepared already.
+
+    :param numpy.ndarray/PreparedPanel reference_panel: A panel of reference haplotypes.
+    :param int ploidy: Ploidy (only 1 or 2 are supported).
+    :return: A prepared reference panel.
+    :rtype: PreparedPanel
+    """
+    if isinstance(reference_panel, PreparedPanel):
+        if reference_panel.ploidy != ploidy:
+            err_msg = "Ploidy does not match that of the prepared reference panel."
+            raise ValueError(err_msg)
+        return reference_panel
+    return PreparedPanel(reference_panel, ploidy)
+
+
 def check_inputs(
     reference_panel,
     query,
@@ -49,12 +258,19 @@ def check_inputs(
     In the diploid case queries are unphased genotypes (encoded as allele dosages).
     Currently, only biallelic sites are supported.
 
-    TODO: Support running on multiple queries. Currently, only k = 1 is supported.
+    When there are multiple queries (k > 1), the number of distinct alleles per site
+    is computed separately for each query, so that the emission probabilities are
+    the same as when running each query on its own. The emission probability matrices
+    of the queries are then stacked into an array of size (k, m, 2) in the haploid case
+    and (k, m, 8) in the diploid case.
 
     The mutation rate can be scaled according to the set of alleles
     that can be mutated to based on the number of distinct alleles at each site.
 
-    :param numpy.ndarray reference_panel: A panel of reference haplotypes.
+    The reference panel can also be passed as a :class:`PreparedPanel`,
+    in which case it is not checked again.
+
+    :param numpy.ndarray/PreparedPanel reference_panel: A panel of reference haplotypes.
     :param numpy.ndarray query: A query (a haplotype or a sequence of allelic dosages).
     :param numpy.ndarray ploidy: Ploidy (only 1 or 2 are supported).
     :param numpy.ndarray prob_recombination: Recombination probability.
@@ -63,43 +279,27 @@ def check_inputs(
     :return: Num. ref. hap., num. sites, checked ref. panel, checked query, emission prob. matrix.
     :rtype: tuple
     """
-    # Check ploidy.
-    if not ploidy in [1, 2]:
-        err_msg = "Only ploidy levels 1 and 2 are supported."
-        raise ValueError(err_msg)
-
-    # Check the reference panel.
-    if not len(reference_panel.shape) == 2:
-        err_msg = "Reference panel array has incorrect dimensions."
-        raise ValueError(err_msg)
-
-    if np.any(reference_panel == core.MISSING):
-        err_msg = "Reference panel cannot have any MISSING values."
-        raise ValueError(err_msg)
-
-    if ploidy == 2:
-        if not np.all(np.isin(reference_panel, [0, 1, core.NONCOPY])):
-            err_msg = "Reference panel has not allowed in diploid mode. "
-            err_msg += "Only 0/1 biallelic encoding is supported."
-            raise ValueError(err_msg)
-
-    num_sites, num_ref_haps = reference_panel.shape
+    # Check the reference panel, unless it is prepared already.
+    panel = prepare_panel(reference_panel, ploidy)
+    num_sites, num_ref_haps = panel.num_sites, panel.num_ref_haps
 
     # Check the queries.
-    if query.shape[0] != 1:
+    if not len(query.shape) == 2 or query.shape[0] < 1:
         err_msg = "Query array has incorrect dimensions."
         raise ValueError(err_msg)
 
+    num_queries = query.shape[0]
+
     if query.shape[1] != num_sites:
         err_msg = "Number of sites in the query and reference panel don't match."
         raise ValueError(err_msg)
 
-    if np.any(query == core.NONCOPY):
+    if core.has_allele(query, core.NONCOPY):
         err_msg = "Query cannot have any NONCOPY values."
         raise ValueError(err_msg)
 
     if ploidy == 2:
-        if not np.all(np.isin(query, [0, 1, 2, core.MISSING])):
+        if not core.has_only_alleles(query, np.array([0, 1, 2, core.MISSING])):
             err_msg = "Query has states not allowed in diploid mode. "
             err_msg += "Only 0/1/2 allele dosage encoding is supported."
             raise ValueError(err_msg)
@@ -143,58 +343,158 @@ def check_inputs(
 
     # Get the number of distinct alleles per site.
     if ploidy == 1:
-        num_alleles = core.get_num_alleles(reference_panel, query)
+        query_alleles = query[:, np.newaxis, :]
     else:
         # TODO: This is a hack, because the ref. panel and query have different encodings.
         # This needs to be overhauled when or before we deal with multiallelic sites.
         # Also, this only works if we work with only biallelic sites.
-        query_unraveled = np.zeros((2, num_sites), dtype=np.int8) - np.inf
-        for i in range(num_sites):
-            if query[0, i] == 0:
-                query_unraveled[:, i] = np.array([0, 0])
-            elif query[0, i] == 1:
-                query_unraveled[:, i] = np.array([0, 1])
-            elif query[0, i] == 2:
-                query_unraveled[:, i] = np.array([1, 1])
-            else:
-                query_unraveled[:, i] = np.array([core.MISSING, core.MISSING])
-        num_alleles = core.get_num_alleles(reference_panel, query_unraveled)
+        query_alleles = np.zeros((num_queries, 2, num_sites), dtype=np.int8)
+        query_alleles[:, 0, :] = query == 2
+        query_alleles[:, 1, :] = query >= 1
+        is_missing = np.repeat(query[:, np.newaxis, :] == core.MISSING, 2, axis=1)
+        query_alleles[is_missing] = core.MISSING
+    num_alleles = [panel.get_num_alleles(query_alleles[i]) for i in range(num_queries)]
 
     # Calculate the emission probability matrix.
-    if ploidy == 1:
-        emission_matrix = core.get_emission_matrix_haploid(
-            mu=prob_mutation,
-            num_sites=num_sites,
-            num_alleles=num_alleles,
-            scale_mutation_rate=scale_mutation_rate,
-        )
-    else:
-        emission_matrix = core.get_emission_matrix_diploid(
-            mu=prob_mutation,
-            num_sites=num_sites,
-            num_alleles=num_alleles,
-            scale_mutation_rate=scale_mutation_rate,
-        )
+    emission_matrix = np.array(
+        [
+            panel.get_emission_matrix(
+                prob_mutation=prob_mutation,
+                scale_mutation_rate=scale_mutation_rate,
+                num_alleles=num_alleles[i],
+            )
+            for i in range(num_queries)
+        ]
+    )
+    if num_queries == 1:
+        emission_matrix = emission_matrix[0]
 
-    if ploidy == 1:
-        return (
-            num_ref_haps,
-            num_sites,
-            reference_panel,
-            query,
-            emission_matrix,
-        )
-    else:
-        ref_panel_genotypes = core.convert_haplotypes_to_phased_genotypes(
-            reference_panel
-        )
-        return (
-            num_ref_haps,
-            num_sites,
-            ref_panel_genotypes,  # Only ref. panel is converted
-            query,
-            emission_matrix,
+    # In the diploid case, the kernels compute the reference genotypes on the fly.
+    ref_panel_checked = panel.reference_panel
+
+    return (
+        num_ref_haps,
+        num_sites,
+        ref_panel_checked,
+        query,
+        emission_matrix,
+    )
+
+
+# Emission functions for the haploid case, which can be used by name via the API
+# instead of looking up the emission probabilities from a table.
+_emission_models = {}
+
+
+def register_emission_model(name, emission_func):
+    """
+    Register an emission function for the haploid case under a name, so that it can
+    be passed as `emission_model` to the API functions.
+
+    The emission function must have the same signature as
+    `core.get_emission_probability_haploid`, and is called with the emission
+    probability matrix of size (m, 2) for every state at every site. It is called
+    from the compiled kernels, so it must be compiled with Numba, unless Numba
+    is disabled.
+
+    :param str name: Name of the emission model.
+    :param function emission_func: Emission function.
+    """
+    if not isinstance(name, str):
+        err_msg = "Name of the emission model must be a string."
+        raise ValueError(err_msg)
+    if not callable(emission_func):
+        err_msg = "Emission function is not callable."
+        raise ValueError(err_msg)
+    if jit.ENABLE_NUMBA and not isinstance(
+        emission_func, numba.core.dispatcher.Dispatcher
+    ):
+        err_msg = "Emission function must be compiled with Numba."
+        raise ValueError(err_msg)
+    _emission_models[name] = emission_func
+
+
+def get_emission_model(emission_model, ploidy, emission_matrix):
+    """
+    Return the emission function and the emission probabilities to pass to the kernels.
+
+    By default, there is no emission function, and in the haploid case, the emission
+    probability matrix is extended to a lookup table. Otherwise, the emission function
+    registered under the name `emission_model` is returned with the emission
+    probability matrix.
+    """
+    if emission_model is None:
+        if ploidy == 1:
+            emission_matrix = core.get_emission_lookup_haploid(emission_matrix)
+        return None, emission_matrix
+    if ploidy != 1:
+        err_msg = "Emission models are only supported with ploidy 1."
+        raise ValueError(err_msg)
+    if emission_model not in _emission_models:
+        err_msg = f"Emission model '{emission_model}' is not registered."
+        raise ValueError(err_msg)
+    return _emission_models[emission_model], emission_matrix
+
+
+def check_single_query(query, feature=None):
+    if query.shape[0] != 1:
+        err_msg = "Multiple queries are not supported"
+        if feature is not None:
+            err_msg += f" with {feature}"
+        raise ValueError(err_msg + ".")
+
+
+def check_dtype(dtype):
+    if dtype is None:
+        return np.float64
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        err_msg = "Only float32 and float64 are supported."
+        raise ValueError(err_msg)
+    return dtype.type
+
+
+def get_rescale_threshold(lazy_rescaling, dtype):
+    """
+    Return the value below which the sum (or maximum) of the probabilities at a site
+    triggers rescaling, which is at every site unless `lazy_rescaling` is True.
+    """
+    if not lazy_rescaling:
+        return np.inf
+    # Leave as much room below the threshold as above it.
+    return np.sqrt(np.finfo(dtype).tiny)
+
+
+def check_unordered_pairs(unordered_pairs, ploidy):
+    if unordered_pairs is None:
+        return False
+    if unordered_pairs and ploidy != 2:
+        err_msg = "Unordered pairs are only supported with ploidy 2."
+        raise ValueError(err_msg)
+    return unordered_pairs
+
+
+def check_num_threads(num_threads):
+    if num_threads is None:
+        return None
+    if not isinstance(num_threads, (int, np.integer)) or num_threads < 1:
+        err_msg = "Number of threads must be a positive integer."
+        raise ValueError(err_msg)
+    return num_threads
+
+
+def check_sparse(sparse, ploidy, unordered_pairs=False, viterbi=False):
+    if sparse is None:
+        return False
+    if sparse and viterbi and ploidy != 1:
+        err_msg = (
+            "Sparse updates are only supported with ploidy 1 in the Viterbi algorithm."
         )
+        raise ValueError(err_msg)
+    if sparse and unordered_pairs:
+        err_msg = "Sparse updates are not supported with unordered pairs."
+        raise ValueError(err_msg)
+    return sparse
 
 
 def forwards(
@@ -206,14 +506,109 @@ def forwards(
     prob_mutation=None,
     scale_mutation_rate=None,
     normalise=None,
+    checkpoint=None,
+    checkpoint_interval=None,
+    dtype=None,
+    log_space=None,
+    unordered_pairs=None,
+    sparse=None,
+    lazy_rescaling=None,
+    emission_model=None,
+    num_threads=None,
 ):
-    """Run the forwards algorithm on haploid or diploid genotype data."""
+    """
+    Run the forwards algorithm on haploid or diploid genotype data.
+
+    If there are multiple queries, i.e. the query array is of size (k, m) with k > 1,
+    then the forward probabilities, normalisation factors, and log-likelihoods
+    are returned as arrays of size (k, m, n), (k, m), and (k,), respectively,
+    in the haploid case. In the diploid case, the forward probabilities are
+    returned as an array of size (k, m, n, n).
+
+    If `checkpoint` is True, the forward probabilities are stored only every
+    `checkpoint_interval` sites (by default, about sqrt(m) sites), and are returned
+    as a `CheckpointedArray`, whose rows are recomputed from the checkpoints on access.
+
+    The forward probabilities are computed and stored as `dtype`, which is either
+    float64 (default) or float32, which halves the memory needed. The normalisation
+    factors and log-likelihoods are always accumulated in float64.
+
+    If `log_space` is True, the unnormalised forward probabilities are computed
+    in log space (base 10), which avoids underflow for long queries. In this case,
+    the forward probabilities cannot be normalised, and the normalisation factors
+    are all ones.
+
+    If `unordered_pairs` is True (diploid only), the forward probabilities are stored
+    only for the unordered pairs of reference haplotypes, i.e. the pairs (j1, j2)
+    with j1 <= j2, as an array of size (m, n(n + 1) / 2) or (k, m, n(n + 1) / 2).
+    This halves the memory and arithmetic, since the forward probabilities
+    are symmetric in j1 and j2. Use `core.unpack_unordered_pairs` to expand them
+    to ordered pairs.
+
+    If `sparse` is True, the forward probabilities are held as a scaled and shifted
+    copy, and only the haplotypes not carrying the major allele at a site
+    are updated explicitly (in the diploid case, the rows and columns of the pairs
+    of haplotypes including them). This is much faster when the minor alleles
+    are rare, but requires normalised forward probabilities.
+
+    If `lazy_rescaling` is True, the forward probabilities at a site are only
+    normalised if their sum is close to underflowing, and at the last site, which
+    saves a pass over them at the other sites. The normalisation factors are ones
+    at the sites that are not normalised. The log-likelihood is unchanged, as are
+    the products of the forward probabilities and the backward probabilities
+    computed from these normalisation factors.
+
+    If `emission_model` is given (haploid only), the emission probabilities are
+    computed by the emission function registered under that name with
+    `register_emission_model`, instead of being looked up from a table
+    of the emission probabilities at each site.
+
+    If `num_threads` is given, the forward probabilities of a single query
+    are computed in parallel over blocks of reference haplotypes (in the diploid case,
+    blocks of rows of pairs of them) at each site, using at most `num_threads` threads.
+    The results do not depend on the number of threads. Threads are not supported
+    for multiple queries, or with checkpointing, log space, unordered pairs, or
+    sparse updates, for which a ValueError is raised.
+    """
+    if log_space is None:
+        log_space = False
     if normalise is None:
-        normalise = True
+        normalise = not log_space
+    if checkpoint is None:
+        checkpoint = False
+    if log_space and normalise:
+        err_msg = "Forward probabilities in log space cannot be normalised."
+        raise ValueError(err_msg)
+    unordered_pairs = check_unordered_pairs(unordered_pairs, ploidy)
+    if unordered_pairs and (checkpoint or log_space):
+        err_msg = "Unordered pairs are not supported with checkpointing or log space."
+        raise ValueError(err_msg)
+    sparse = check_sparse(sparse, ploidy, unordered_pairs)
+    if sparse and (checkpoint or log_space or not normalise):
+        err_msg = "Sparse updates are only supported with normalised forward "
+        err_msg += "probabilities, without checkpointing or log space."
+        raise ValueError(err_msg)
+    if lazy_rescaling and (
+        checkpoint or log_space or not normalise or unordered_pairs or sparse
+    ):
+        err_msg = "Lazy rescaling is only supported with normalised forward "
+        err_msg += "probabilities, without checkpointing, log space, unordered pairs, "
+        err_msg += "or sparse updates."
+        raise ValueError(err_msg)
 
+    num_threads = check_num_threads(num_threads)
+    if num_threads is not None and (
+        checkpoint or log_space or unordered_pairs or sparse
+    ):
+        err_msg = "Multiple threads are not supported with checkpointing, log space, "
+        err_msg += "unordered pairs, or sparse updates."
+        raise ValueError(err_msg)
+    dtype = check_dtype(dtype)
+    rescale_threshold = get_rescale_threshold(lazy_rescaling, dtype)
+    panel = prepare_panel(reference_panel, ploidy)
     num_ref_haps, num_sites, ref_panel_checked, query_checked, emission_matrix = (
         check_inputs(
-            reference_panel=reference_panel,
+            reference_panel=panel,
             query=query,
             ploidy=ploidy,
             prob_recombination=prob_recombination,
@@ -221,28 +616,146 @@ def forwards(
             scale_mutation_rate=scale_mutation_rate,
         )
     )
+    if num_threads is not None:
+        check_single_query(query_checked, "multiple threads")
+    emission_func, emission_matrix = get_emission_model(
+        emission_model, ploidy, emission_matrix
+    )
 
-    if ploidy == 1:
+    if checkpoint:
+        if not normalise:
+            err_msg = "Checkpointing requires normalised forward probabilities."
+            raise ValueError(err_msg)
+        check_single_query(query_checked, "checkpointing")
+        return checkpointing.forwards_checkpointed(
+            num_ref_haps,
+            num_sites,
+            ref_panel_checked,
+            query_checked,
+            emission_matrix,
+            prob_recombination,
+            ploidy=ploidy,
+            interval=checkpointing.check_checkpoint_interval(
+                checkpoint_interval, num_sites
+            ),
+            num_copiable_entries=panel.num_copiable_entries,
+            emission_func=emission_func,
+            dtype=dtype,
+        )
+
+    if log_space:
+        if ploidy == 1:
+            forwards_func = forwards_ls_hap_log
+            if query_checked.shape[0] > 1:
+                forwards_func = forwards_ls_hap_log_batch
+            forward_array, log_lik = forwards_func(
+                num_ref_haps,
+                num_sites,
+                ref_panel_checked,
+                query_checked,
+                emission_matrix,
+                prob_recombination,
+                emission_func=emission_func,
+                num_copiable_entries=panel.num_copiable_entries,
+                dtype=dtype,
+            )
+        else:
+            forwards_func = forward_ls_dip_loop_log
+            if query_checked.shape[0] > 1:
+                forwards_func = forward_ls_dip_loop_log_batch
+            forward_array, log_lik = forwards_func(
+                num_ref_haps,
+                num_sites,
+                ref_panel_checked,
+                query_checked,
+                emission_matrix,
+                prob_recombination,
+                num_copiable_entries=panel.num_copiable_entries,
+                dtype=dtype,
+            )
+        normalisation_factor_from_forward = np.ones(
+            forward_array.shape[: forward_array.ndim - ploidy]
+        )
+        return forward_array, normalisation_factor_from_forward, log_lik
+
+    if sparse and ploidy == 1:
+        forwards_func = forwards_ls_hap_sparse
+        if query_checked.shape[0] > 1:
+            forwards_func = forwards_ls_hap_sparse_batch
+        major_alleles, minor_offsets, minor_haps = panel.get_minor_allele_index()
         (
             forward_array,
             normalisation_factor_from_forward,
             log_lik,
-        ) = forwards_ls_hap(
+        ) = forwards_func(
             num_ref_haps,
             num_sites,
             ref_panel_checked,
             query_checked,
             emission_matrix,
             prob_recombination,
-            norm=normalise,
-            emission_func=core.get_emission_probability_haploid,
+            emission_func=emission_func,
+            major_alleles=major_alleles,
+            minor_offsets=minor_offsets,
+            minor_haps=minor_haps,
+            num_copiable_entries=panel.num_copiable_entries,
+            dtype=dtype,
         )
-    else:
+    elif sparse:
+        forwards_func = forward_ls_dip_sparse
+        if query_checked.shape[0] > 1:
+            forwards_func = forward_ls_dip_sparse_batch
+        major_alleles, minor_offsets, minor_haps = panel.get_minor_allele_index()
         (
             forward_array,
             normalisation_factor_from_forward,
             log_lik,
-        ) = forward_ls_dip_loop(
+        ) = forwards_func(
+            num_ref_haps,
+            num_sites,
+            ref_panel_checked,
+            query_checked,
+            emission_matrix,
+            prob_recombination,
+            major_alleles=major_alleles,
+            minor_offsets=minor_offsets,
+            minor_haps=minor_haps,
+            num_copiable_entries=panel.num_copiable_entries,
+            dtype=dtype,
+        )
+    elif ploidy == 1:
+        forwards_func = forwards_ls_hap
+        if query_checked.shape[0] > 1:
+            forwards_func = forwards_ls_hap_batch
+        elif num_threads is not None:
+            forwards_func = forwards_ls_hap_parallel
+        with jit.limit_num_threads(num_threads):
+            (
+                forward_array,
+                normalisation_factor_from_forward,
+                log_lik,
+            ) = forwards_func(
+                num_ref_haps,
+                num_sites,
+                ref_panel_checked,
+                query_checked,
+                emission_matrix,
+                prob_recombination,
+                norm=normalise,
+                emission_func=emission_func,
+                num_copiable_entries=panel.num_copiable_entries,
+                dtype=dtype,
+                rescale_threshold=rescale_threshold,
+            )
+    elif unordered_pairs:
+        forwards_func = forward_ls_dip_unordered
+        if query_checked.shape[0] > 1:
+            forwards_func = forward_ls_dip_unordered_batch
+        (
+            forward_array,
+            normalisation_factor_from_forward,
+            log_lik,
+        ) = forwards_func(
             num_ref_haps,
             num_sites,
             ref_panel_checked,
@@ -250,11 +763,160 @@ def forwards(
             emission_matrix,
             prob_recombination,
             norm=normalise,
+            num_copiable_entries=panel.num_copiable_entries,
+            dtype=dtype,
         )
+    else:
+        forwards_func = forward_ls_dip_loop
+        if query_checked.shape[0] > 1:
+            forwards_func = forward_ls_dip_loop_batch
+        elif num_threads is not None:
+            forwards_func = forward_ls_dip_loop_parallel
+        with jit.limit_num_threads(num_threads):
+            (
+                forward_array,
+                normalisation_factor_from_forward,
+                log_lik,
+            ) = forwards_func(
+                num_ref_haps,
+                num_sites,
+                ref_panel_checked,
+                query_checked,
+                emission_matrix,
+                prob_recombination,
+                norm=normalise,
+                num_copiable_entries=panel.num_copiable_entries,
+                dtype=dtype,
+                rescale_threshold=rescale_threshold,
+            )
 
     return forward_array, normalisation_factor_from_forward, log_lik
 
 
+def log_likelihood(
+    reference_panel,
+    query,
+    ploidy,
+    prob_recombination,
+    *,
+    prob_mutation=None,
+    scale_mutation_rate=None,
+    return_normalisation_factor=None,
+    dtype=None,
+    sparse=None,
+    emission_model=None,
+):
+    """
+    Compute the log-likelihood of a query given a reference panel using the forwards algorithm.
+
+    The forward probabilities are not returned, and only those at the current site
+    (and the previous site in the diploid case) are held in memory.
+
+    If there are multiple queries, the log-likelihoods are returned as an array of size (k,).
+    If `return_normalisation_factor` is True, the normalisation factors are also returned,
+    as an array of size (m,), or (k, m) if there are multiple queries.
+
+    The forward probabilities are computed as `dtype`, as in `forwards`.
+
+    If `sparse` is True, only the haplotypes not carrying the major allele at a site
+    are updated, as in `forwards`, so that the cost per site is proportional to
+    the number of minor allele carriers (times n in the diploid case). The forward
+    probabilities are then always computed in float64.
+
+    If `emission_model` is given (haploid only), the emission probabilities are
+    computed by a registered emission function, as in `forwards`.
+    """
+    if return_normalisation_factor is None:
+        return_normalisation_factor = False
+    sparse = check_sparse(sparse, ploidy)
+
+    dtype = check_dtype(dtype)
+    panel = prepare_panel(reference_panel, ploidy)
+    num_ref_haps, num_sites, ref_panel_checked, query_checked, emission_matrix = (
+        check_inputs(
+            reference_panel=panel,
+            query=query,
+            ploidy=ploidy,
+            prob_recombination=prob_recombination,
+            prob_mutation=prob_mutation,
+            scale_mutation_rate=scale_mutation_rate,
+        )
+    )
+    emission_func, emission_matrix = get_emission_model(
+        emission_model, ploidy, emission_matrix
+    )
+
+    if sparse and ploidy == 1:
+        loglik_func = forwards_ls_hap_sparse_loglik
+        if query_checked.shape[0] > 1:
+            loglik_func = forwards_ls_hap_sparse_loglik_batch
+        major_alleles, minor_offsets, minor_haps = panel.get_minor_allele_index()
+        normalisation_factor, log_lik = loglik_func(
+            num_ref_haps,
+            num_sites,
+            ref_panel_checked,
+            query_checked,
+            emission_matrix,
+            prob_recombination,
+            emission_func=emission_func,
+            major_alleles=major_alleles,
+            minor_offsets=minor_offsets,
+            minor_haps=minor_haps,
+            num_copiable_entries=panel.num_copiable_entries,
+        )
+    elif sparse:
+        loglik_func = forward_ls_dip_sparse_loglik
+        if query_checked.shape[0] > 1:
+            loglik_func = forward_ls_dip_sparse_loglik_batch
+        major_alleles, minor_offsets, minor_haps = panel.get_minor_allele_index()
+        normalisation_factor, log_lik = loglik_func(
+            num_ref_haps,
+            num_sites,
+            ref_panel_checked,
+            query_checked,
+            emission_matrix,
+            prob_recombination,
+            major_alleles=major_alleles,
+            minor_offsets=minor_offsets,
+            minor_haps=minor_haps,
+            num_copiable_entries=panel.num_copiable_entries,
+        )
+    elif ploidy == 1:
+        loglik_func = forwards_ls_hap_loglik
+        if query_checked.shape[0] > 1:
+            loglik_func = forwards_ls_hap_loglik_batch
+        normalisation_factor, log_lik = loglik_func(
+            num_ref_haps,
+            num_sites,
+            ref_panel_checked,
+            query_checked,
+            emission_matrix,
+            prob_recombination,
+            emission_func=emission_func,
+            num_copiable_entries=panel.num_copiable_entries,
+            dtype=dtype,
+        )
+    else:
+        loglik_func = forward_ls_dip_loop_loglik
+        if query_checked.shape[0] > 1:
+            loglik_func = forward_ls_dip_loop_loglik_batch
+        normalisation_factor, log_lik = loglik_func(
+            num_ref_haps,
+            num_sites,
+            ref_panel_checked,
+            query_checked,
+            emission_matrix,
+            prob_recombination,
+            num_copiable_entries=panel.num_copiable_entries,
+            dtype=dtype,
+        )
+
+    if return_normalisation_factor:
+        return log_lik, normalisation_factor
+
+    return log_lik
+
+
 def backwards(
     reference_panel,
     query,
@@ -264,11 +926,61 @@ def backwards(
     *,
     prob_mutation=None,
     scale_mutation_rate=None,
+    checkpoint=None,
+    checkpoint_interval=None,
+    dtype=None,
+    unordered_pairs=None,
+    sparse=None,
+    emission_model=None,
+    num_threads=None,
 ):
-    """Run the backwards algorithm on haploid or diploid genotype data."""
+    """
+    Run the backwards algorithm on haploid or diploid genotype data.
+
+    If there are multiple queries, then the normalisation factors from the forwards
+    pass must be an array of size (k, m), and the backward probabilities are returned
+    as an array of size (k, m, n) in the haploid case or (k, m, n, n) in the diploid case.
+
+    If `checkpoint` is True, the backward probabilities are returned
+    as a `CheckpointedArray`, as in `forwards`.
+
+    The backward probabilities are computed and stored as `dtype`, as in `forwards`.
+
+    If `unordered_pairs` is True (diploid only), the backward probabilities are stored
+    only for the unordered pairs of reference haplotypes, as in `forwards`.
+
+    If `sparse` is True, only the haplotypes not carrying the major allele at a site
+    are updated explicitly, as in `forwards`.
+
+    If `emission_model` is given (haploid only), the emission probabilities are
+    computed by a registered emission function, as in `forwards`.
+
+    If `num_threads` is given, the backward probabilities of a single query
+    are computed in parallel, as in `forwards`. Threads are not supported
+    for multiple queries, or with checkpointing, unordered pairs, or sparse updates,
+    for which a ValueError is raised.
+    """
+    if checkpoint is None:
+        checkpoint = False
+    unordered_pairs = check_unordered_pairs(unordered_pairs, ploidy)
+    if unordered_pairs and checkpoint:
+        err_msg = "Unordered pairs are not supported with checkpointing."
+        raise ValueError(err_msg)
+    sparse = check_sparse(sparse, ploidy, unordered_pairs)
+    if sparse and checkpoint:
+        err_msg = "Sparse updates are not supported with checkpointing."
+        raise ValueError(err_msg)
+
+    num_threads = check_num_threads(num_threads)
+    if num_threads is not None and (checkpoint or unordered_pairs or sparse):
+        err_msg = "Multiple threads are not supported with checkpointing, "
+        err_msg += "unordered pairs, or sparse updates."
+        raise ValueError(err_msg)
+    dtype = check_dtype(dtype)
+    panel = prepare_panel(reference_panel, ploidy)
     num_ref_haps, num_sites, ref_panel_checked, query_checked, emission_matrix = (
         check_inputs(
-            reference_panel=reference_panel,
+            reference_panel=panel,
             query=query,
             ploidy=ploidy,
             prob_recombination=prob_recombination,
@@ -276,9 +988,15 @@ def backwards(
             scale_mutation_rate=scale_mutation_rate,
         )
     )
+    if num_threads is not None:
+        check_single_query(query_checked, "multiple threads")
+    emission_func, emission_matrix = get_emission_model(
+        emission_model, ploidy, emission_matrix
+    )
 
-    if ploidy == 1:
-        backwards_array = backwards_ls_hap(
+    if checkpoint:
+        check_single_query(query_checked, "checkpointing")
+        return checkpointing.backwards_checkpointed(
             num_ref_haps,
             num_sites,
             ref_panel_checked,
@@ -286,10 +1004,41 @@ def backwards(
             emission_matrix,
             normalisation_factor_from_forward,
             prob_recombination,
-            emission_func=core.get_emission_probability_haploid,
+            ploidy=ploidy,
+            interval=checkpointing.check_checkpoint_interval(
+                checkpoint_interval, num_sites
+            ),
+            num_copiable_entries=panel.num_copiable_entries,
+            emission_func=emission_func,
+            dtype=dtype,
         )
-    else:
-        backwards_array = backward_ls_dip_loop(
+
+    if sparse and ploidy == 1:
+        backwards_func = backwards_ls_hap_sparse
+        if query_checked.shape[0] > 1:
+            backwards_func = backwards_ls_hap_sparse_batch
+        major_alleles, minor_offsets, minor_haps = panel.get_minor_allele_index()
+        backwards_array = backwards_func(
+            num_ref_haps,
+            num_sites,
+            ref_panel_checked,
+            query_checked,
+            emission_matrix,
+            normalisation_factor_from_forward,
+            prob_recombination,
+            emission_func=emission_func,
+            major_alleles=major_alleles,
+            minor_offsets=minor_offsets,
+            minor_haps=minor_haps,
+            num_copiable_entries=panel.num_copiable_entries,
+            dtype=dtype,
+        )
+    elif sparse:
+        backwards_func = backward_ls_dip_sparse
+        if query_checked.shape[0] > 1:
+            backwards_func = backward_ls_dip_sparse_batch
+        major_alleles, minor_offsets, minor_haps = panel.get_minor_allele_index()
+        backwards_array = backwards_func(
             num_ref_haps,
             num_sites,
             ref_panel_checked,
@@ -297,12 +1046,59 @@ def backwards(
             emission_matrix,
             normalisation_factor_from_forward,
             prob_recombination,
+            major_alleles=major_alleles,
+            minor_offsets=minor_offsets,
+            minor_haps=minor_haps,
+            num_copiable_entries=panel.num_copiable_entries,
+            dtype=dtype,
         )
+    elif ploidy == 1:
+        backwards_func = backwards_ls_hap
+        if query_checked.shape[0] > 1:
+            backwards_func = backwards_ls_hap_batch
+        elif num_threads is not None:
+            backwards_func = backwards_ls_hap_parallel
+        with jit.limit_num_threads(num_threads):
+            backwards_array = backwards_func(
+                num_ref_haps,
+                num_sites,
+                ref_panel_checked,
+                query_checked,
+                emission_matrix,
+                normalisation_factor_from_forward,
+                prob_recombination,
+                emission_func=emission_func,
+                num_copiable_entries=panel.num_copiable_entries,
+                dtype=dtype,
+            )
+    else:
+        if unordered_pairs:
+            backwards_func = backward_ls_dip_unordered
+            if query_checked.shape[0] > 1:
+                backwards_func = backward_ls_dip_unordered_batch
+        else:
+            backwards_func = backward_ls_dip_loop
+            if query_checked.shape[0] > 1:
+                backwards_func = backward_ls_dip_loop_batch
+            elif num_threads is not None:
+                backwards_func = backward_ls_dip_loop_parallel
+        with jit.limit_num_threads(num_threads):
+            backwards_array = backwards_func(
+                num_ref_haps,
+                num_sites,
+                ref_panel_checked,
+                query_checked,
+                emission_matrix,
+                normalisation_factor_from_forward,
+                prob_recombination,
+                num_copiable_entries=panel.num_copiable_entries,
+                dtype=dtype,
+            )
 
     return backwards_array
 
 
-def viterbi(
+def posteriors(
     reference_panel,
     query,
     ploidy,
@@ -310,11 +1106,44 @@ def viterbi(
     *,
     prob_mutation=None,
     scale_mutation_rate=None,
+    return_path=None,
+    checkpoint=None,
+    checkpoint_interval=None,
+    dtype=None,
+    emission_model=None,
 ):
-    """Run the Viterbi algorithm on haploid or diploid genotype data."""
+    """
+    Compute the posterior probabilities of the copying states on haploid or diploid genotype data.
+
+    The inputs are validated once, and the posterior probabilities are computed directly,
+    without holding both the full forward and backward matrices in memory.
+
+    The posterior probabilities are returned as an array of size (m, n) in the haploid case
+    or (m, n, n) in the diploid case, together with the log-likelihood. If there are multiple
+    queries, an extra leading dimension of size k is added to both.
+
+    If `return_path` is True, the maximum posterior path is also returned. In the diploid case,
+    it is returned as a tuple of two arrays, one per haplotype, as in `viterbi`.
+
+    If `checkpoint` is True, the posterior probabilities are returned as a `PosteriorArray`,
+    whose rows are computed on access from checkpointed forward and backward probabilities
+    (see `forwards`). This needs memory for about sqrt(m) rows rather than m rows.
+
+    The posterior probabilities are computed and stored as `dtype`, as in `forwards`.
+
+    If `emission_model` is given (haploid only), the emission probabilities are
+    computed by a registered emission function, as in `forwards`.
+    """
+    if return_path is None:
+        return_path = False
+    if checkpoint is None:
+        checkpoint = False
+
+    dtype = check_dtype(dtype)
+    panel = prepare_panel(reference_panel, ploidy)
     num_ref_haps, num_sites, ref_panel_checked, query_checked, emission_matrix = (
         check_inputs(
-            reference_panel=reference_panel,
+            reference_panel=panel,
             query=query,
             ploidy=ploidy,
             prob_recombination=prob_recombination,
@@ -322,33 +1151,466 @@ def viterbi(
             scale_mutation_rate=scale_mutation_rate,
         )
     )
+    emission_func, emission_matrix = get_emission_model(
+        emission_model, ploidy, emission_matrix
+    )
+    num_queries = query_checked.shape[0]
+
+    if checkpoint:
+        check_single_query(query_checked, "checkpointing")
+        interval = checkpointing.check_checkpoint_interval(
+            checkpoint_interval, num_sites
+        )
+        forward_array, c, log_lik = checkpointing.forwards_checkpointed(
+            num_ref_haps,
+            num_sites,
+            ref_panel_checked,
+            query_checked,
+            emission_matrix,
+            prob_recombination,
+            ploidy=ploidy,
+            interval=interval,
+            num_copiable_entries=panel.num_copiable_entries,
+            emission_func=emission_func,
+            dtype=dtype,
+        )
+        backward_array = checkpointing.backwards_checkpointed(
+            num_ref_haps,
+            num_sites,
+            ref_panel_checked,
+            query_checked,
+            emission_matrix,
+            c,
+            prob_recombination,
+            ploidy=ploidy,
+            interval=interval,
+            num_copiable_entries=panel.num_copiable_entries,
+            emission_func=emission_func,
+            dtype=dtype,
+        )
+        posterior_array = checkpointing.PosteriorArray(forward_array, backward_array)
+        if not return_path:
+            return posterior_array, log_lik
+        # Sweep backwards, so that each backward segment is computed once.
+        unphased_path = np.zeros(num_sites, dtype=np.int64)
+        for l in range(num_sites - 1, -1, -1):
+            unphased_path[l] = np.argmax(posterior_array[l])
+        if ploidy == 1:
+            best_path = unphased_path
+        else:
+            best_path = get_phased_path(num_ref_haps, unphased_path)
+        return posterior_array, log_lik, best_path
 
     if ploidy == 1:
-        V, P, log_lik = forwards_viterbi_hap_lower_mem_rescaling(
+        posteriors_func = posteriors_ls_hap
+        if num_queries > 1:
+            posteriors_func = posteriors_ls_hap_batch
+        posterior_array, log_lik = posteriors_func(
             num_ref_haps,
             num_sites,
             ref_panel_checked,
             query_checked,
             emission_matrix,
             prob_recombination,
-            emission_func=core.get_emission_probability_haploid,
+            emission_func=emission_func,
+            num_copiable_entries=panel.num_copiable_entries,
+            dtype=dtype,
         )
-        best_path = backwards_viterbi_hap(num_sites, V, P)
     else:
-        V, P, log_lik = forwards_viterbi_dip_low_mem(
+        posteriors_func = posteriors_ls_dip_loop
+        if num_queries > 1:
+            posteriors_func = posteriors_ls_dip_loop_batch
+        posterior_array, log_lik = posteriors_func(
             num_ref_haps,
             num_sites,
             ref_panel_checked,
             query_checked,
             emission_matrix,
             prob_recombination,
+            num_copiable_entries=panel.num_copiable_entries,
+            dtype=dtype,
+        )
+
+    if not return_path:
+        return posterior_array, log_lik
+
+    if ploidy == 1:
+        best_path = np.argmax(posterior_array, axis=-1)
+    else:
+        flat_shape = posterior_array.shape[:-2] + (num_ref_haps**2,)
+        unphased_path = np.argmax(posterior_array.reshape(flat_shape), axis=-1)
+        best_path = get_phased_path(num_ref_haps, unphased_path)
+
+    return posterior_array, log_lik, best_path
+
+
+def viterbi(
+    reference_panel,
+    query,
+    ploidy,
+    prob_recombination,
+    *,
+    prob_mutation=None,
+    scale_mutation_rate=None,
+    dtype=None,
+    unordered_pairs=None,
+    checkpoint=None,
+    checkpoint_interval=None,
+    max_memory=None,
+    sparse=None,
+    lazy_rescaling=None,
+    emission_model=None,
+    num_threads=None,
+):
+    """
+    Run the Viterbi algorithm on haploid or diploid genotype data.
+
+    If there are multiple queries, i.e. the query array is of size (k, m) with k > 1,
+    then the queries are run in parallel, and the best paths and log-likelihoods
+    are returned as arrays of size (k, m) and (k,), respectively. In the diploid case,
+    the best paths are returned as a tuple of two such arrays, one per haplotype.
+
+    The Viterbi probabilities are computed and stored as `dtype`, as in `forwards`.
+    With float32, ties between paths may be broken differently.
+
+    If `unordered_pairs` is True (diploid only), the Viterbi probabilities and pointers
+    are stored only for the unordered pairs of reference haplotypes, as in `forwards`.
+    The best path is expanded into a pair of paths by orienting the pair at each site
+    to have the fewest switches from the previous site.
+
+    If `checkpoint` is True, the Viterbi probabilities are stored only every
+    `checkpoint_interval` sites, and the segments between checkpoints are replayed
+    backwards to trace the best path, so the memory needed does not grow with
+    the number of sites as fast. By default, the interval minimises the memory needed.
+    If `max_memory` (in bytes) is given, a ValueError is raised if the checkpoints and
+    the pointers of one segment would need more memory.
+
+    If `sparse` is True (haploid only), only the templates that carry a minor allele
+    or that have not recombined to the same Viterbi probability as the others
+    are updated at each site. The best paths and log-likelihoods are the same.
+
+    If `lazy_rescaling` is True, the Viterbi probabilities at a site are only
+    rescaled if their maximum is close to underflowing, as in `forwards`.
+    The best paths are the same, up to ties.
+
+    If `emission_model` is given (haploid only), the emission probabilities are
+    computed by a registered emission function, as in `forwards`.
+
+    If `num_threads` is given, the Viterbi probabilities of a single query
+    are computed in parallel over blocks of reference haplotypes (or pairs of them)
+    at each site, as in `forwards`, and batches of queries are run with at most
+    `num_threads` threads. The best paths are the same as without threads.
+    Threads are not supported with checkpointing, or for a single query with
+    unordered pairs or sparse updates, for which a ValueError is raised.
+    """
+    if checkpoint is None:
+        checkpoint = False
+    unordered_pairs = check_unordered_pairs(unordered_pairs, ploidy)
+    if unordered_pairs and checkpoint:
+        err_msg = "Unordered pairs are not supported with checkpointing."
+        raise ValueError(err_msg)
+    sparse = check_sparse(sparse, ploidy, viterbi=True)
+    if sparse and checkpoint:
+        err_msg = "Sparse updates are not supported with checkpointing."
+        raise ValueError(err_msg)
+    if lazy_rescaling and (checkpoint or unordered_pairs or sparse):
+        err_msg = "Lazy rescaling is not supported with checkpointing, "
+        err_msg += "unordered pairs, or sparse updates."
+        raise ValueError(err_msg)
+    num_threads = check_num_threads(num_threads)
+    if num_threads is not None and checkpoint:
+        err_msg = "Multiple threads are not supported with checkpointing."
+        raise ValueError(err_msg)
+    dtype = check_dtype(dtype)
+    rescale_threshold = get_rescale_threshold(lazy_rescaling, dtype)
+    panel = prepare_panel(reference_panel, ploidy)
+    num_ref_haps, num_sites, ref_panel_checked, query_checked, emission_matrix = (
+        check_inputs(
+            reference_panel=panel,
+            query=query,
+            ploidy=ploidy,
+            prob_recombination=prob_recombination,
+            prob_mutation=prob_mutation,
+            scale_mutation_rate=scale_mutation_rate,
+        )
+    )
+    if num_threads is not None and query_checked.shape[0] == 1:
+        if sparse or unordered_pairs:
+            err_msg = "Multiple threads are not supported for a single query "
+            err_msg += "with unordered pairs or sparse updates."
+            raise ValueError(err_msg)
+    emission_func, emission_matrix = get_emission_model(
+        emission_model, ploidy, emission_matrix
+    )
+
+    if checkpoint:
+        check_single_query(query_checked, "checkpointing")
+        if checkpoint_interval is None:
+            interval = checkpointing.get_viterbi_checkpoint_interval(
+                num_sites, num_ref_haps, ploidy, dtype, max_memory=max_memory
+            )
+        else:
+            interval = checkpointing.check_checkpoint_interval(
+                checkpoint_interval, num_sites
+            )
+            interval = min(interval, num_sites)
+            checkpointing.check_viterbi_memory(
+                num_sites, num_ref_haps, ploidy, interval, dtype, max_memory=max_memory
+            )
+        best_path, log_lik = checkpointing.viterbi_checkpointed(
+            num_ref_haps,
+            num_sites,
+            ref_panel_checked,
+            query_checked,
+            emission_matrix,
+            prob_recombination,
+            ploidy=ploidy,
+            interval=interval,
+            num_copiable_entries=panel.num_copiable_entries,
+            emission_func=emission_func,
+            dtype=dtype,
+        )
+        if ploidy == 2:
+            best_path = get_phased_path(num_ref_haps, best_path)
+    elif sparse and query_checked.shape[0] > 1:
+        major_alleles, minor_offsets, minor_haps = panel.get_minor_allele_index()
+        with jit.limit_num_threads(num_threads):
+            best_path, log_lik = viterbi_hap_sparse_batch(
+                num_ref_haps,
+                num_sites,
+                ref_panel_checked,
+                query_checked,
+                emission_matrix,
+                prob_recombination,
+                emission_func=emission_func,
+                major_alleles=major_alleles,
+                minor_offsets=minor_offsets,
+                minor_haps=minor_haps,
+                num_copiable_entries=panel.num_copiable_entries,
+                dtype=dtype,
+            )
+    elif sparse:
+        major_alleles, minor_offsets, minor_haps = panel.get_minor_allele_index()
+        V, V_argmaxes, floor_recombs, switch_offsets, switch_haps, log_lik = (
+            forwards_viterbi_hap_sparse(
+                num_ref_haps,
+                num_sites,
+                ref_panel_checked,
+                query_checked,
+                emission_matrix,
+                prob_recombination,
+                emission_func=emission_func,
+                major_alleles=major_alleles,
+                minor_offsets=minor_offsets,
+                minor_haps=minor_haps,
+                num_copiable_entries=panel.num_copiable_entries,
+                dtype=dtype,
+            )
+        )
+        best_path = backwards_viterbi_hap_sparse(
+            num_sites, V, V_argmaxes, floor_recombs, switch_offsets, switch_haps
+        )
+    elif ploidy == 1 and query_checked.shape[0] > 1:
+        with jit.limit_num_threads(num_threads):
+            best_path, log_lik = viterbi_hap_batch(
+                num_ref_haps,
+                num_sites,
+                ref_panel_checked,
+                query_checked,
+                emission_matrix,
+                prob_recombination,
+                emission_func=emission_func,
+                num_copiable_entries=panel.num_copiable_entries,
+                dtype=dtype,
+                rescale_threshold=rescale_threshold,
+            )
+    elif ploidy == 1:
+        forwards_func = forwards_viterbi_hap_lower_mem_rescaling_compact
+        if num_threads is not None:
+            forwards_func = forwards_viterbi_hap_parallel
+        with jit.limit_num_threads(num_threads):
+            V, V_argmaxes, recomb_offsets, recomb_haps, log_lik = forwards_func(
+                num_ref_haps,
+                num_sites,
+                ref_panel_checked,
+                query_checked,
+                emission_matrix,
+                prob_recombination,
+                emission_func=emission_func,
+                num_copiable_entries=panel.num_copiable_entries,
+                dtype=dtype,
+                rescale_threshold=rescale_threshold,
+            )
+        best_path = backwards_viterbi_hap_compact(
+            num_sites, V, V_argmaxes, recomb_offsets, recomb_haps
+        )
+    elif query_checked.shape[0] > 1 and unordered_pairs:
+        with jit.limit_num_threads(num_threads):
+            unphased_path, log_lik = viterbi_dip_unordered_batch(
+                num_ref_haps,
+                num_sites,
+                ref_panel_checked,
+                query_checked,
+                emission_matrix,
+                prob_recombination,
+                num_copiable_entries=panel.num_copiable_entries,
+                dtype=dtype,
+            )
+        best_path = get_phased_path(num_ref_haps, unphased_path, unordered_pairs=True)
+    elif query_checked.shape[0] > 1:
+        with jit.limit_num_threads(num_threads):
+            unphased_path, log_lik = viterbi_dip_batch(
+                num_ref_haps,
+                num_sites,
+                ref_panel_checked,
+                query_checked,
+                emission_matrix,
+                prob_recombination,
+                num_copiable_entries=panel.num_copiable_entries,
+                dtype=dtype,
+                rescale_threshold=rescale_threshold,
+            )
+        best_path = get_phased_path(num_ref_haps, unphased_path)
+    elif unordered_pairs:
+        V, P, log_lik = forwards_viterbi_dip_unordered(
+            num_ref_haps,
+            num_sites,
+            ref_panel_checked,
+            query_checked,
+            emission_matrix,
+            prob_recombination,
+            num_copiable_entries=panel.num_copiable_entries,
+            dtype=dtype,
+        )
+        unphased_path = backwards_viterbi_dip_unordered(num_sites, V, P)
+        best_path = get_phased_path(num_ref_haps, unphased_path, unordered_pairs=True)
+    else:
+        forwards_func = forwards_viterbi_dip_low_mem_packed
+        if num_threads is not None:
+            forwards_func = forwards_viterbi_dip_low_mem_packed_parallel
+        with jit.limit_num_threads(num_threads):
+            V, P_packed, V_argmaxes, V_rowcol_argmaxes, log_lik = forwards_func(
+                num_ref_haps,
+                num_sites,
+                ref_panel_checked,
+                query_checked,
+                emission_matrix,
+                prob_recombination,
+                num_copiable_entries=panel.num_copiable_entries,
+                dtype=dtype,
+                rescale_threshold=rescale_threshold,
+            )
+        unphased_path = backwards_viterbi_dip_packed(
+            num_sites, V, P_packed, V_argmaxes, V_rowcol_argmaxes
         )
-        unphased_path = backwards_viterbi_dip(num_sites, V, P)
         best_path = get_phased_path(num_ref_haps, unphased_path)
 
     return best_path, log_lik
 
 
+def forwards_viterbi(
+    reference_panel,
+    query,
+    ploidy,
+    prob_recombination,
+    *,
+    prob_mutation=None,
+    scale_mutation_rate=None,
+    dtype=None,
+    emission_model=None,
+):
+    """
+    Run the forwards and Viterbi algorithms together on haploid or diploid genotype data.
+
+    This is equivalent to calling `log_likelihood`, `viterbi`, and `path_loglik`,
+    but the inputs are validated once, and the forwards algorithm and the forwards pass
+    of the Viterbi algorithm are run in a single sweep over the reference panel.
+
+    Return the log-likelihood of the query, the best path, and the log-likelihood
+    of the best path. In the diploid case, the best path is returned as a tuple of
+    two arrays, one per haplotype.
+
+    The probabilities are computed and stored as `dtype`, as in `forwards`.
+
+    If `emission_model` is given (haploid only), the emission probabilities are
+    computed by a registered emission function, as in `forwards`.
+    """
+    dtype = check_dtype(dtype)
+    panel = prepare_panel(reference_panel, ploidy)
+    num_ref_haps, num_sites, ref_panel_checked, query_checked, emission_matrix = (
+        check_inputs(
+            reference_panel=panel,
+            query=query,
+            ploidy=ploidy,
+            prob_recombination=prob_recombination,
+            prob_mutation=prob_mutation,
+            scale_mutation_rate=scale_mutation_rate,
+        )
+    )
+    emission_func, emission_matrix = get_emission_model(
+        emission_model, ploidy, emission_matrix
+    )
+    check_single_query(query_checked)
+
+    if ploidy == 1:
+        log_lik, V, V_argmaxes, recomb_offsets, recomb_haps, _ = (
+            forwards_loglik_viterbi_hap(
+                num_ref_haps,
+                num_sites,
+                ref_panel_checked,
+                query_checked,
+                emission_matrix,
+                prob_recombination,
+                emission_func=emission_func,
+                num_copiable_entries=panel.num_copiable_entries,
+                dtype=dtype,
+            )
+        )
+        best_path = backwards_viterbi_hap_compact(
+            num_sites, V, V_argmaxes, recomb_offsets, recomb_haps
+        )
+        path_log_lik = path_ll_hap(
+            num_ref_haps,
+            num_sites,
+            ref_panel_checked,
+            best_path,
+            query_checked,
+            emission_matrix,
+            prob_recombination,
+            emission_func=emission_func,
+            num_copiable_entries=panel.num_copiable_entries,
+        )
+    else:
+        log_lik, V, P_packed, V_argmaxes, V_rowcol_argmaxes, _ = (
+            forwards_loglik_viterbi_dip(
+                num_ref_haps,
+                num_sites,
+                ref_panel_checked,
+                query_checked,
+                emission_matrix,
+                prob_recombination,
+                num_copiable_entries=panel.num_copiable_entries,
+                dtype=dtype,
+            )
+        )
+        unphased_path = backwards_viterbi_dip_packed(
+            num_sites, V, P_packed, V_argmaxes, V_rowcol_argmaxes
+        )
+        best_path = get_phased_path(num_ref_haps, unphased_path)
+        path_log_lik = path_ll_dip(
+            num_ref_haps,
+            num_sites,
+            ref_panel_checked,
+            best_path,
+            query_checked,
+            emission_matrix,
+            prob_recombination,
+            num_copiable_entries=panel.num_copiable_entries,
+        )
+
+    return log_lik, best_path, path_log_lik
+
+
 def path_loglik(
     reference_panel,
     query,
@@ -358,11 +1620,18 @@ def path_loglik(
     *,
     prob_mutation=None,
     scale_mutation_rate=None,
+    emission_model=None,
 ):
-    """Evaluate the log-likelihood of a copying path for a query through a reference panel."""
+    """
+    Evaluate the log-likelihood of a copying path for a query through a reference panel.
+
+    If `emission_model` is given (haploid only), the emission probabilities are
+    computed by a registered emission function, as in `forwards`.
+    """
+    panel = prepare_panel(reference_panel, ploidy)
     num_ref_haps, num_sites, ref_panel_checked, query_checked, emission_matrix = (
         check_inputs(
-            reference_panel=reference_panel,
+            reference_panel=panel,
             query=query,
             ploidy=ploidy,
             prob_recombination=prob_recombination,
@@ -370,6 +1639,11 @@ def path_loglik(
             scale_mutation_rate=scale_mutation_rate,
         )
     )
+    emission_func, emission_matrix = get_emission_model(
+        emission_model, ploidy, emission_matrix
+    )
+
+    check_single_query(query_checked)
 
     if ploidy == 1:
         log_lik = path_ll_hap(
@@ -380,7 +1654,8 @@ def path_loglik(
             query_checked,
             emission_matrix,
             prob_recombination,
-            emission_func=core.get_emission_probability_haploid,
+            emission_func=emission_func,
+            num_copiable_entries=panel.num_copiable_entries,
         )
     else:
         log_lik = path_ll_dip(
@@ -391,6 +1666,7 @@ def path_loglik(
             query_checked,
             emission_matrix,
             prob_recombination,
+            num_copiable_entries=panel.num_copiable_entries,
         )
 
     return log_lik
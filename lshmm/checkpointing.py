@@ -0,0 +1,463 @@
+"""
+Lazy access to forward, backward, and posterior probabilities stored at checkpoints,
+and the Viterbi algorithm with checkpoints.
+"""
+
+import numpy as np
+
+from .fb_diploid import (
+    backward_ls_dip_checkpoint,
+    backward_ls_dip_segment,
+    forward_ls_dip_checkpoint,
+    forward_ls_dip_segment,
+)
+from .fb_haploid import (
+    backwards_ls_hap_checkpoint,
+    backwards_ls_hap_segment,
+    forwards_ls_hap_checkpoint,
+    forwards_ls_hap_segment,
+)
+from .vit_diploid import (
+    backwards_viterbi_dip_checkpoint,
+    forwards_viterbi_dip_checkpoint,
+)
+from .vit_haploid import (
+    backwards_viterbi_hap_checkpoint,
+    forwards_viterbi_hap_checkpoint,
+)
+
+
+def get_checkpoint_interval(num_sites):
+    """
+    Return the default number of sites between checkpoints, which is about sqrt(m).
+
+    This minimises the memory needed to hold the checkpoints plus one recomputed segment.
+    """
+    return max(1, int(np.ceil(np.sqrt(num_sites))))
+
+
+def check_checkpoint_interval(checkpoint_interval, num_sites):
+    if checkpoint_interval is None:
+        return get_checkpoint_interval(num_sites)
+    if not isinstance(checkpoint_interval, (int, np.integer)) or isinstance(
+        checkpoint_interval, bool
+    ):
+        err_msg = "Checkpoint interval must be an integer."
+        raise TypeError(err_msg)
+    if checkpoint_interval < 1:
+        err_msg = "Checkpoint interval must be positive."
+        raise ValueError(err_msg)
+    return int(checkpoint_interval)
+
+
+def get_viterbi_memory(num_sites, num_ref_haps, ploidy, interval, dtype=np.float64):
+    """
+    Return the number of bytes needed by the Viterbi algorithm with checkpoints,
+    which is the memory of the checkpoints plus that of the pointers of one segment.
+
+    The pointers are a bitset of the recombinations per site in the haploid case, and
+    packed switch codes and the argmax of each row per site in the diploid case.
+    """
+    num_checkpoints = -(-num_sites // interval)
+    num_states = num_ref_haps**ploidy
+    if ploidy == 1:
+        pointer_bytes_per_site = (num_ref_haps + 7) // 8 + 8
+    else:
+        pointer_bytes_per_site = (num_states + 3) // 4 + 4 * num_ref_haps + 8
+    checkpoint_bytes = num_checkpoints * num_states * np.dtype(dtype).itemsize
+    return checkpoint_bytes + interval * pointer_bytes_per_site
+
+
+def get_viterbi_checkpoint_interval(
+    num_sites, num_ref_haps, ploidy, dtype=np.float64, max_memory=None
+):
+    """
+    Return the number of sites between checkpoints that minimises the memory needed
+    by the Viterbi algorithm with checkpoints.
+
+    If `max_memory` (in bytes) is given, a ValueError is raised if the memory needed
+    is larger than it.
+    """
+    # The memory is about m * a / interval + b * interval, where a is the size of
+    # a checkpoint and b is the size of the pointers at a site. For each number of
+    # checkpoints near the optimum, the smallest interval giving it is a candidate.
+    checkpoint_bytes = get_viterbi_memory(1, num_ref_haps, ploidy, 1, dtype)
+    pointer_bytes_per_site = get_viterbi_memory(1, num_ref_haps, ploidy, 2, dtype)
+    pointer_bytes_per_site -= checkpoint_bytes
+    checkpoint_bytes -= pointer_bytes_per_site
+    best_num_checkpoints = int(
+        np.sqrt(num_sites * pointer_bytes_per_site / checkpoint_bytes)
+    )
+    candidates = [
+        -(-num_sites // num_checkpoints)
+        for num_checkpoints in range(
+            max(1, best_num_checkpoints - 2),
+            min(num_sites, best_num_checkpoints + 3) + 1,
+        )
+    ]
+    interval = min(
+        candidates,
+        key=lambda x: get_viterbi_memory(num_sites, num_ref_haps, ploidy, x, dtype),
+    )
+    check_viterbi_memory(
+        num_sites, num_ref_haps, ploidy, interval, dtype, max_memory=max_memory
+    )
+    return interval
+
+
+def check_viterbi_memory(
+    num_sites, num_ref_haps, ploidy, interval, dtype=np.float64, max_memory=None
+):
+    if max_memory is None:
+        return
+    memory = get_viterbi_memory(num_sites, num_ref_haps, ploidy, interval, dtype)
+    if memory > max_memory:
+        err_msg = (
+            f"The Viterbi algorithm with checkpoints needs {memory} bytes, "
+            f"which is more than the maximum of {max_memory} bytes."
+        )
+        raise ValueError(err_msg)
+
+
+class CheckpointedArray:
+    """
+    A read-only array of probabilities of which only the checkpoints are held in memory.
+
+    The sites are split into segments of `interval` sites, and each segment is recomputed
+    from its checkpoint when one of its rows is accessed. The most recently recomputed
+    segment is cached, so accessing the rows in order (or in reverse order) recomputes
+    each segment once.
+
+    Indexing with an integer returns the row at a site, and indexing with a slice
+    returns a stacked array of rows. Use `numpy.asarray` to materialise the full array.
+    """
+
+    def __init__(self, num_sites, interval, checkpoints, compute_segment):
+        self.num_sites = num_sites
+        self.interval = interval
+        self.checkpoints = checkpoints
+        self._compute_segment = compute_segment
+        self._cached_segment_index = None
+        self._cached_segment = None
+
+    @property
+    def shape(self):
+        return (self.num_sites,) + self.checkpoints.shape[1:]
+
+    @property
+    def nbytes(self):
+        """Number of bytes held by the checkpoints and the cached segment."""
+        cached_bytes = 0
+        if self._cached_segment is not None:
+            cached_bytes = self._cached_segment.nbytes
+        return self.checkpoints.nbytes + cached_bytes
+
+    def __len__(self):
+        return self.num_sites
+
+    def get_segment(self, segment_index):
+        """Return the rows of a segment, recomputing them if not cached."""
+        if segment_index != self._cached_segment_index:
+            start = segment_index * self.interval
+            stop = min(start + self.interval, self.num_sites)
+            self._cached_segment = self._compute_segment(
+                self.checkpoints[segment_index], start, stop
+            )
+            self._cached_segment_index = segment_index
+        return self._cached_segment
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return np.stack([self[l] for l in range(*key.indices(self.num_sites))])
+        site = int(key)
+        if site < 0:
+            site += self.num_sites
+        if not 0 <= site < self.num_sites:
+            err_msg = "Site index is out of bounds."
+            raise IndexError(err_msg)
+        segment_index, offset = divmod(site, self.interval)
+        return self.get_segment(segment_index)[offset]
+
+    def __iter__(self):
+        for l in range(self.num_sites):
+            yield self[l]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+
+class PosteriorArray:
+    """
+    A read-only array of posterior probabilities computed lazily from checkpointed
+    forward and backward probabilities.
+
+    Each row is the product of the corresponding rows of the forward and backward
+    probabilities. Indexing behaves as in `CheckpointedArray`.
+    """
+
+    def __init__(self, forward_array, backward_array):
+        self.forward_array = forward_array
+        self.backward_array = backward_array
+
+    @property
+    def shape(self):
+        return self.forward_array.shape
+
+    @property
+    def num_sites(self):
+        return self.forward_array.num_sites
+
+    def __len__(self):
+        return self.num_sites
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return np.stack([self[l] for l in range(*key.indices(self.num_sites))])
+        return self.forward_array[key] * self.backward_array[key]
+
+    def __iter__(self):
+        for l in range(self.num_sites):
+            yield self[l]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+
+def forwards_checkpointed(
+    num_ref_haps,
+    num_sites,
+    ref_panel,
+    query,
+    emission_matrix,
+    prob_recombination,
+    ploidy,
+    interval,
+    num_copiable_entries,
+    emission_func=None,
+    dtype=np.float64,
+):
+    """
+    Run the normalised forwards algorithm, keeping only checkpoints.
+
+    Return a `CheckpointedArray` of forward probabilities, the normalisation factors,
+    and the log-likelihood.
+
+    In the haploid case, the emission probabilities are obtained from emission_func
+    and emission_matrix as in `core.lookup_emission_probability_haploid`.
+    """
+    if ploidy == 1:
+        checkpoints, c, ll = forwards_ls_hap_checkpoint(
+            num_ref_haps,
+            num_sites,
+            ref_panel,
+            query,
+            emission_matrix,
+            prob_recombination,
+            emission_func=emission_func,
+            interval=interval,
+            num_copiable_entries=num_copiable_entries,
+            dtype=dtype,
+        )
+
+        def compute_segment(checkpoint, start, stop):
+            return forwards_ls_hap_segment(
+                num_ref_haps,
+                ref_panel,
+                query,
+                emission_matrix,
+                np.zeros(stop - start),
+                prob_recombination,
+                emission_func,
+                checkpoint,
+                start,
+                stop,
+                num_copiable_entries,
+                dtype,
+            )
+
+    else:
+        checkpoints, c, ll = forward_ls_dip_checkpoint(
+            num_ref_haps,
+            num_sites,
+            ref_panel,
+            query,
+            emission_matrix,
+            prob_recombination,
+            interval=interval,
+            num_copiable_entries=num_copiable_entries,
+            dtype=dtype,
+        )
+
+        def compute_segment(checkpoint, start, stop):
+            return forward_ls_dip_segment(
+                num_ref_haps,
+                ref_panel,
+                query,
+                emission_matrix,
+                np.zeros(stop - start),
+                prob_recombination,
+                checkpoint,
+                start,
+                stop,
+                num_copiable_entries,
+                dtype,
+            )
+
+    forward_array = CheckpointedArray(num_sites, interval, checkpoints, compute_segment)
+
+    return forward_array, c, ll
+
+
+def backwards_checkpointed(
+    num_ref_haps,
+    num_sites,
+    ref_panel,
+    query,
+    emission_matrix,
+    normalisation_factor_from_forward,
+    prob_recombination,
+    ploidy,
+    interval,
+    num_copiable_entries,
+    emission_func=None,
+    dtype=np.float64,
+):
+    """Run the backwards algorithm, keeping only checkpoints, and return a `CheckpointedArray`."""
+    c = normalisation_factor_from_forward
+    if ploidy == 1:
+        checkpoints = backwards_ls_hap_checkpoint(
+            num_ref_haps,
+            num_sites,
+            ref_panel,
+            query,
+            emission_matrix,
+            c,
+            prob_recombination,
+            emission_func=emission_func,
+            interval=interval,
+            num_copiable_entries=num_copiable_entries,
+            dtype=dtype,
+        )
+
+        def compute_segment(checkpoint, start, stop):
+            return backwards_ls_hap_segment(
+                num_ref_haps,
+                num_sites,
+                ref_panel,
+                query,
+                emission_matrix,
+                c,
+                prob_recombination,
+                emission_func,
+                checkpoint,
+                start,
+                stop,
+                num_copiable_entries,
+                dtype,
+            )
+
+    else:
+        checkpoints = backward_ls_dip_checkpoint(
+            num_ref_haps,
+            num_sites,
+            ref_panel,
+            query,
+            emission_matrix,
+            c,
+            prob_recombination,
+            interval=interval,
+            num_copiable_entries=num_copiable_entries,
+            dtype=dtype,
+        )
+
+        def compute_segment(checkpoint, start, stop):
+            return backward_ls_dip_segment(
+                num_ref_haps,
+                num_sites,
+                ref_panel,
+                query,
+                emission_matrix,
+                c,
+                prob_recombination,
+                checkpoint,
+                start,
+                stop,
+                num_copiable_entries,
+                dtype,
+            )
+
+    return CheckpointedArray(num_sites, interval, checkpoints, compute_segment)
+
+
+def viterbi_checkpointed(
+    num_ref_haps,
+    num_sites,
+    ref_panel,
+    query,
+    emission_matrix,
+    prob_recombination,
+    ploidy,
+    interval,
+    num_copiable_entries,
+    emission_func=None,
+    dtype=np.float64,
+):
+    """
+    Run the Viterbi algorithm, keeping the Viterbi probabilities only at checkpoints
+    and replaying the segments between them to trace back the most likely path.
+
+    Return the most likely path and its log-likelihood. In the diploid case, the path
+    is unphased, i.e. indices into flattened (n, n) arrays.
+    """
+    if ploidy == 1:
+        checkpoints, V_last, ll = forwards_viterbi_hap_checkpoint(
+            num_ref_haps,
+            num_sites,
+            ref_panel,
+            query,
+            emission_matrix,
+            prob_recombination,
+            emission_func=emission_func,
+            interval=interval,
+            num_copiable_entries=num_copiable_entries,
+            dtype=dtype,
+        )
+        path = backwards_viterbi_hap_checkpoint(
+            num_ref_haps,
+            num_sites,
+            ref_panel,
+            query,
+            emission_matrix,
+            prob_recombination,
+            emission_func=emission_func,
+            checkpoints=checkpoints,
+            V_last=V_last,
+            interval=interval,
+            num_copiable_entries=num_copiable_entries,
+        )
+    else:
+        checkpoints, V_last, ll = forwards_viterbi_dip_checkpoint(
+            num_ref_haps,
+            num_sites,
+            ref_panel,
+            query,
+            emission_matrix,
+            prob_recombination,
+            interval=interval,
+            num_copiable_entries=num_copiable_entries,
+            dtype=dtype,
+        )
+        path = backwards_viterbi_dip_checkpoint(
+            num_ref_haps,
+            num_sites,
+            ref_panel,
+            query,
+            emission_matrix,
+            prob_recombination,
+            checkpoints=checkpoints,
+            V_last=V_last,
+            interval=interval,
+            num_copiable_entries=num_copiable_entries,
+        )
+
+    return path, ll
@@ -0,0 +1,267 @@
+"""
+Command line interface to run the Viterbi algorithm, and optionally the forwards
+and backwards algorithms, on a batch of queries.
+
+The queries are split into shards of a fixed number of queries, which are run
+in turn across worker processes (see :class:`SharedPanelPool`). The results of
+each shard are written to a separate file in the output directory, and
+the completed shards are recorded in a manifest, so that an interrupted job
+is resumed from the first incomplete shard when it is run again.
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from .pool import SharedPanelPool
+
+MANIFEST_FILE = "manifest.json"
+
+
+def get_shard_file(shard):
+    return f"shard_{shard:06d}.npz"
+
+
+def load_array(path):
+    """Load an array from a .npy file, which is memory-mapped rather than read."""
+    if not path.endswith(".npy"):
+        err_msg = f"Input file '{path}' is not a .npy file."
+        raise ValueError(err_msg)
+    return np.load(path, mmap_mode="r")
+
+
+def get_input_key(path):
+    """
+    Return the path, size and modification time of an input file, so that
+    a job is not resumed if the file has been replaced since it was started.
+    """
+    stat = os.stat(path)
+    return {
+        "path": os.path.abspath(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def get_probability(value, num_sites):
+    """Return a scalar probability, or an array of probabilities from a .npy file."""
+    if value is None or not value.endswith(".npy"):
+        return None if value is None else float(value)
+    prob = np.array(load_array(value), dtype=np.float64)
+    if prob.shape != (num_sites,):
+        err_msg = f"Probabilities in '{value}' are not an array of length {num_sites}."
+        raise ValueError(err_msg)
+    return prob
+
+
+def write_atomic(path, write_func):
+    """Write a file via a temporary file, so that it is either complete or absent."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write_func(f)
+    os.replace(tmp_path, path)
+
+
+def write_manifest(output_dir, manifest):
+    write_atomic(
+        os.path.join(output_dir, MANIFEST_FILE),
+        lambda f: f.write(json.dumps(manifest, indent=2).encode()),
+    )
+
+
+def load_manifest(output_dir, job):
+    """
+    Return the manifest in an output directory, or a new manifest if there is none.
+    The completed shards whose results are missing are not counted as completed.
+    """
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"job": job, "completed_shards": []}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest["job"] != job:
+        err_msg = (
+            f"Output directory '{output_dir}' contains the results of another job."
+        )
+        raise ValueError(err_msg)
+    manifest["completed_shards"] = [
+        shard
+        for shard in manifest["completed_shards"]
+        if os.path.exists(os.path.join(output_dir, get_shard_file(shard)))
+    ]
+    return manifest
+
+
+def run_shard(pool, query, ploidy, log_likelihood, posteriors):
+    """Return the results of a shard of queries as a dict of arrays."""
+    results = {}
+    path, results["path_log_lik"] = pool.viterbi(query)
+    if ploidy == 2:
+        # Stack the paths of the two haplotypes into an array of size (k, 2, m).
+        path = np.stack(path, axis=1)
+    results["path"] = path
+    if posteriors:
+        results["posteriors"], results["log_lik"] = pool.posteriors(query)
+    elif log_likelihood:
+        results["log_lik"] = pool.log_likelihood(query)
+    return results
+
+
+def run(args):
+    reference_panel = load_array(args.reference_panel)
+    query = load_array(args.query)
+    if len(reference_panel.shape) != 2 or len(query.shape) != 2:
+        err_msg = "Reference panel and query arrays must be 2D."
+        raise ValueError(err_msg)
+    num_sites = reference_panel.shape[0]
+    num_queries = query.shape[0]
+    num_shards = -(-num_queries // args.shard_size)
+
+    # The parameters that determine the results, which must match when resuming.
+    job = {
+        "reference_panel": get_input_key(args.reference_panel),
+        "query": get_input_key(args.query),
+        "ploidy": args.ploidy,
+        "prob_recombination": args.prob_recombination,
+        "prob_mutation": args.prob_mutation,
+        "scale_mutation_rate": args.scale_mutation_rate,
+        "log_likelihood": args.log_likelihood,
+        "posteriors": args.posteriors,
+        "num_queries": num_queries,
+        "shard_size": args.shard_size,
+    }
+    for name in ["prob_recombination", "prob_mutation"]:
+        value = getattr(args, name)
+        if value is not None and value.endswith(".npy"):
+            job[name] = get_input_key(value)
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest = load_manifest(args.output_dir, job)
+    manifest["num_shards"] = num_shards
+    completed_shards = set(manifest["completed_shards"])
+    if len(completed_shards) > 0 and not args.quiet:
+        print(f"Resuming: {len(completed_shards)} of {num_shards} shards completed.")
+
+    prob_recombination = get_probability(args.prob_recombination, num_sites)
+    if isinstance(prob_recombination, float):
+        prob_recombination = np.zeros(num_sites) + prob_recombination
+        prob_recombination[0] = 0.0
+
+    # The memory-mapped panel is copied straight into shared memory by the pool.
+    with SharedPanelPool(
+        reference_panel,
+        args.ploidy,
+        prob_recombination,
+        prob_mutation=get_probability(args.prob_mutation, num_sites),
+        scale_mutation_rate=args.scale_mutation_rate,
+        num_workers=args.num_workers,
+        chunk_size=args.chunk_size,
+    ) as pool:
+        for shard in range(num_shards):
+            if shard in completed_shards:
+                continue
+            start = shard * args.shard_size
+            stop = min(start + args.shard_size, num_queries)
+            results = run_shard(
+                pool,
+                np.asarray(query[start:stop]),
+                args.ploidy,
+                args.log_likelihood,
+                args.posteriors,
+            )
+            results["query_index"] = np.arange(start, stop)
+            write_atomic(
+                os.path.join(args.output_dir, get_shard_file(shard)),
+                lambda f: np.savez(f, **results),
+            )
+            completed_shards.add(shard)
+            manifest["completed_shards"] = sorted(completed_shards)
+            write_manifest(args.output_dir, manifest)
+            if not args.quiet:
+                print(f"Completed shard {shard + 1} of {num_shards}.")
+    write_manifest(args.output_dir, manifest)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="lshmm",
+        description=(
+            "Run the Li & Stephens HMM on a batch of queries against a reference panel, "
+            "writing the results of each shard of queries to the output directory."
+        ),
+    )
+    parser.add_argument(
+        "reference_panel",
+        help="A .npy file of reference haplotypes of size (m, n).",
+    )
+    parser.add_argument(
+        "query",
+        help=(
+            "A .npy file of queries of size (k, m): haplotypes if the ploidy is 1, "
+            "or unphased genotypes (allele dosages) if the ploidy is 2."
+        ),
+    )
+    parser.add_argument("output_dir", help="The output directory.")
+    parser.add_argument("--ploidy", type=int, choices=[1, 2], default=1)
+    parser.add_argument(
+        "--prob-recombination",
+        required=True,
+        help="Recombination probability: a scalar or a .npy file of one per site.",
+    )
+    parser.add_argument(
+        "--prob-mutation",
+        default=None,
+        help=(
+            "Mutation probability: a scalar or a .npy file of one per site "
+            "(default: as per Li & Stephens (2003))."
+        ),
+    )
+    parser.add_argument(
+        "--no-scale-mutation-rate",
+        dest="scale_mutation_rate",
+        action="store_false",
+        help="Do not scale the mutation rate by the number of alleles per site.",
+    )
+    parser.add_argument(
+        "--log-likelihood",
+        action="store_true",
+        help="Also compute the log-likelihood of each query.",
+    )
+    parser.add_argument(
+        "--posteriors",
+        action="store_true",
+        help="Also compute the posterior probabilities and log-likelihood of each query.",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=1000,
+        help="Number of queries per shard (default: 1000).",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of CPUs).",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=None,
+        help="Number of queries sent to a worker at a time.",
+    )
+    parser.add_argument("--quiet", action="store_true", help="Do not report progress.")
+    return parser
+
+
+def main(arg_list=None):
+    parser = get_parser()
+    args = parser.parse_args(arg_list)
+    if args.shard_size < 1:
+        parser.error("Shard size must be a positive integer.")
+    try:
+        run(args)
+    except ValueError as e:
+        parser.exit(1, f"{parser.prog}: error: {e}\n")
+    return 0
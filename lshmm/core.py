@@ -10,9 +10,31 @@ REF_HOM_OBS_HET = 1
 REF_HET_OBS_HOM = 2
 MISSING_INDEX = 3
 
+# Columns of the emission lookup table for the haploid case.
+MISMATCH_INDEX_HAPLOID = 0
+MATCH_INDEX_HAPLOID = 1
+MISSING_INDEX_HAPLOID = 2
+NONCOPY_INDEX_HAPLOID = 3
+
 MISSING = -1
 NONCOPY = -2
 
+# The forward and backward probabilities in the sparse implementations are held
+# as a global affine transform of stored values. If the scale of the transform drops
+# below this value, then the transform is applied to all the stored values.
+MIN_SPARSE_SCALE = 1e-100
+# In the diploid case, the stored values can be much larger in magnitude than
+# the probabilities that they encode, when most of the probability is on the pairs
+# of minor allele carriers. If the ratio exceeds this value, then the transform
+# is also applied to all the stored values.
+MAX_SPARSE_CANCELLATION = 1e4
+
+# The parallel kernels split the reference haplotypes (or the pairs of them) into
+# blocks of about this size, which are updated by different threads. Sums over
+# the haplotypes are computed from the partial sums of the blocks in order, so that
+# the results do not depend on the number of threads.
+PARALLEL_BLOCK_SIZE = 1024
+
 
 # Helper functions.
 # https://github.com/numba/numba/issues/1269
@@ -54,6 +76,25 @@ def np_argmax(array, axis):
     return np_apply_along_axis(np.argmax, axis, array)
 
 
+@jit.numba_njit
+def sum_float64(array):
+    """Sum all the entries of an array, accumulating in double precision."""
+    total = 0.0
+    for value in array.flat:
+        total += value
+    return total
+
+
+@jit.numba_njit(parallel=True)
+def scale_parallel(array, factor, block_size=PARALLEL_BLOCK_SIZE):
+    """Multiply a 1D array by a factor in place, in parallel over blocks."""
+    n = len(array)
+    num_blocks = (n + block_size - 1) // block_size
+    for b in jit.prange(num_blocks):
+        for i in range(b * block_size, min((b + 1) * block_size, n)):
+            array[i] *= factor
+
+
 # Functions used across different implementations of LS HMM. """
 def convert_haplotypes_to_phased_genotypes(ref_panel):
     """
@@ -80,21 +121,17 @@ def convert_haplotypes_to_phased_genotypes(ref_panel):
     if not np.all(np.isin(np.unique(ref_panel), ALLOWED_ALLELE_STATES)):
         err_msg = "Reference haplotypes contain illegal allele states."
         raise ValueError(err_msg)
-    num_sites = ref_panel.shape[0]
-    num_haps = ref_panel.shape[1]
-    genotypes = np.zeros((num_sites, num_haps, num_haps), dtype=np.int8) - np.inf
-    for i in range(num_sites):
-        site_alleles = ref_panel[i, :]
-        genotypes[i, :, :] = np.add.outer(site_alleles, site_alleles)
-        genotypes[i, site_alleles == NONCOPY, :] = NONCOPY
-        genotypes[i, :, site_alleles == NONCOPY] = NONCOPY
+    ref_panel = ref_panel.astype(np.int8)
+    genotypes = ref_panel[:, :, np.newaxis] + ref_panel[:, np.newaxis, :]
+    is_noncopy = ref_panel == NONCOPY
+    genotypes[is_noncopy[:, :, np.newaxis] | is_noncopy[:, np.newaxis, :]] = NONCOPY
     return genotypes
 
 
 def convert_haplotypes_to_unphased_genotypes(query):
     """
-    Convert an array of two haplotypes into an array of genotypes encoded as allele dosages,
-    and return the genotypes.
+    Convert an array of pairs of haplotypes into an array of genotypes encoded
+    as allele dosages, and return the genotypes.
 
     It is assumed all sites are biallelic and alleles are encoded as ancestral/derived.
     The only allowable allele states are 0, 1, and MISSING.
@@ -103,10 +140,15 @@ def convert_haplotypes_to_unphased_genotypes(query):
     Allowable genotype values are 0, 1, 2, and MISSING. If either one haplotype is MISSING
     at a site, then the genotype at the site is assigned MISSING.
 
-    The input query haplotypes is of size (2, m), and the output genotypes is of size (1, m),
-    where m = number of sites.
+    The input query haplotypes is of size (2k, m), and the output genotypes is of size (k, m),
+    where:
+        m = number of sites.
+        k = number of diploid individuals.
+
+    The haplotypes of each individual are in consecutive rows, i.e. rows 2i and 2i + 1
+    are converted into row i of the output genotypes.
 
-    :param numpy.ndarray query: An array of two query haplotypes.
+    :param numpy.ndarray query: An array of pairs of query haplotypes.
     :return: An array of query genotypes.
     :rtype: numpy.ndarray
     """
@@ -116,12 +158,12 @@ def convert_haplotypes_to_unphased_genotypes(query):
         raise ValueError(err_msg)
     num_sites = query.shape[1]
     num_haps = query.shape[0]
-    if num_haps != 2:
-        err_msg = "Two haplotypes are expected in a diploid query."
+    if num_haps == 0 or num_haps % 2 != 0:
+        err_msg = "Pairs of haplotypes are expected in a diploid query."
         raise ValueError(err_msg)
-    genotypes = np.zeros((1, num_sites), dtype=np.int8) - np.inf
-    genotypes[0, :] = np.sum(query, axis=0)
-    genotypes[0, np.any(query == MISSING, axis=0)] = MISSING
+    query = query.astype(np.int8).reshape((num_haps // 2, 2, num_sites))
+    genotypes = np.sum(query, axis=1, dtype=np.int8)
+    genotypes[np.any(query == MISSING, axis=1)] = MISSING
     return genotypes
 
 
@@ -172,6 +214,56 @@ def get_num_copiable_entries(ref_panel):
     return num_copiable_entries
 
 
+@jit.numba_njit
+def get_num_copiable_entries_diploid(ref_panel):
+    """
+    Return the number of copiable pairs of haplotypes at each site of a haploid
+    reference panel, which is the square of the number of copiable haplotypes.
+    """
+    num_copiable_entries = get_num_copiable_entries(ref_panel)
+    return num_copiable_entries.astype(np.int64) ** 2
+
+
+@jit.numba_njit
+def get_parallel_block_size_diploid(num_ref_haps):
+    """
+    Return the number of rows in the blocks of the (n, n) arrays of pairs of reference
+    haplotypes that are updated by different threads in the parallel diploid kernels.
+
+    Each block has about PARALLEL_BLOCK_SIZE pairs of haplotypes. The number of rows
+    is a multiple of 4, so that the blocks do not share any bytes of packed pointers.
+
+    :param int num_ref_haps: Number of reference haplotypes.
+    :return: Number of rows per block.
+    :rtype: int
+    """
+    return 4 * max(1, PARALLEL_BLOCK_SIZE // (4 * num_ref_haps))
+
+
+def get_minor_allele_index(ref_panel):
+    """
+    Return the major allele at each site of a reference panel, and the haplotypes
+    not carrying it in a compressed sparse row layout.
+
+    The major allele is the most common allele (or NONCOPY) at a site. The haplotypes
+    not carrying the major allele at site l are in minor_haps from minor_offsets[l]
+    to minor_offsets[l + 1], in increasing order.
+
+    :param numpy.ndarray ref_panel: An array of reference haplotypes of size (m, n).
+    :return: Major alleles, offsets, and indices of the minor allele carriers.
+    :rtype: tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    num_sites = ref_panel.shape[0]
+    values = np.unique(ref_panel)
+    counts = np.array([np.sum(ref_panel == v, axis=1) for v in values])
+    major_alleles = values[np.argmax(counts, axis=0)]
+    is_minor = ref_panel != major_alleles[:, np.newaxis]
+    minor_offsets = np.zeros(num_sites + 1, dtype=np.int64)
+    minor_offsets[1:] = np.cumsum(np.sum(is_minor, axis=1))
+    minor_haps = np.nonzero(is_minor)[1].astype(np.int32)
+    return major_alleles, minor_offsets, minor_haps
+
+
 def get_num_alleles(ref_panel, query):
     num_sites = ref_panel.shape[0]
     if ref_panel.shape[0] != query.shape[1]:
@@ -216,6 +308,79 @@ def check_alleles(alleles, num_sites):
     return num_alleles
 
 
+# Compiled functions to check the input data, which do not hold the GIL.
+@jit.numba_njit
+def has_allele(array, allele):
+    """Return True if any entry of a 2D array is equal to allele."""
+    for i in range(array.shape[0]):
+        for j in range(array.shape[1]):
+            if array[i, j] == allele:
+                return True
+    return False
+
+
+@jit.numba_njit
+def has_only_alleles(array, alleles):
+    """Return True if every entry of a 2D array is equal to one of alleles."""
+    for i in range(array.shape[0]):
+        for j in range(array.shape[1]):
+            is_allowed = False
+            for allele in alleles:
+                if array[i, j] == allele:
+                    is_allowed = True
+                    break
+            if not is_allowed:
+                return False
+    return True
+
+
+@jit.numba_njit
+def get_site_alleles(ref_panel):
+    """
+    Return the distinct alleles (excluding NONCOPY) in a reference panel of size (m, n),
+    in increasing order, and an array of size (m, a) indicating which of the a alleles
+    are at each site.
+    """
+    num_sites, num_ref_haps = ref_panel.shape
+    alleles = np.unique(ref_panel)
+    alleles = alleles[alleles != NONCOPY]
+    site_alleles = np.zeros((num_sites, len(alleles)), dtype=np.bool_)
+    for l in range(num_sites):
+        for j in range(num_ref_haps):
+            if ref_panel[l, j] != NONCOPY:
+                site_alleles[l, np.searchsorted(alleles, ref_panel[l, j])] = True
+    return alleles, site_alleles
+
+
+@jit.numba_njit
+def get_num_alleles_with_query(alleles, site_alleles, query):
+    """
+    Return the number of distinct alleles at each site in a reference panel,
+    as returned by `get_site_alleles`, and a set of query haplotypes of size (k, m).
+
+    Note that MISSING and NONCOPY values are excluded from the counts.
+    """
+    num_queries, num_sites = query.shape
+    num_alleles = np.zeros(num_sites, dtype=np.int8)
+    for l in range(num_sites):
+        num_alleles[l] = np.sum(site_alleles[l, :])
+        for i in range(num_queries):
+            allele = query[i, l]
+            if allele == MISSING or allele == NONCOPY:
+                continue
+            k = np.searchsorted(alleles, allele)
+            if k < len(alleles) and alleles[k] == allele and site_alleles[l, k]:
+                continue
+            # Alleles in previous query haplotypes are already counted.
+            is_new = True
+            for j in range(i):
+                if query[j, l] == allele:
+                    is_new = False
+            if is_new:
+                num_alleles[l] += 1
+    return num_alleles
+
+
 # Functions to assign emission probabilities for haploid LS HMM.
 @jit.numba_njit
 def get_emission_matrix_haploid(mu, num_sites, num_alleles, scale_mutation_rate):
@@ -302,6 +467,85 @@ def get_emission_probability_haploid(ref_allele, query_allele, site, emission_ma
             return emission_matrix[site, 1]
 
 
+def get_emission_lookup_haploid(emission_matrix):
+    """
+    Extend an emission probability matrix for the haploid case to a lookup table,
+    and return it.
+
+    The emission probability matrix is an array of size (..., m, 2), and the lookup
+    table is an array of size (..., m, 4), where m = number of sites. The two extra
+    columns hold the emission probabilities when the query allele is MISSING and
+    when the reference allele is NONCOPY, so that the kernels can look up emission
+    probabilities without branching or checking the inputs at every entry.
+
+    :param numpy.ndarray emission_matrix: Emission probability matrix.
+    :return: Emission lookup table.
+    :rtype: numpy.ndarray
+    """
+    if emission_matrix.shape[-1] != 2:
+        err_msg = "Emission probability matrix has incorrect shape."
+        raise ValueError(err_msg)
+    emission_lookup = np.zeros(emission_matrix.shape[:-1] + (4,), dtype=np.float64)
+    emission_lookup[..., MISMATCH_INDEX_HAPLOID] = emission_matrix[..., 0]
+    emission_lookup[..., MATCH_INDEX_HAPLOID] = emission_matrix[..., 1]
+    emission_lookup[..., MISSING_INDEX_HAPLOID] = 1.0
+    emission_lookup[..., NONCOPY_INDEX_HAPLOID] = 0.0
+    return emission_lookup
+
+
+@jit.numba_njit
+def get_index_in_emission_lookup_haploid(ref_allele, query_allele):
+    """
+    Compare the reference and query alleles to get the index of the entry
+    in the emission lookup table, and return the index.
+
+    A NONCOPY reference allele takes precedence over a MISSING query allele.
+
+    :param int ref_allele: Reference allele.
+    :param int query_allele: Query allele.
+    :return: Index in emission lookup table.
+    :rtype: int
+    """
+    is_match = ref_allele == query_allele
+    is_missing = query_allele == MISSING
+    is_noncopy = ref_allele == NONCOPY
+    return max(
+        MATCH_INDEX_HAPLOID * is_match + MISSING_INDEX_HAPLOID * is_missing,
+        NONCOPY_INDEX_HAPLOID * is_noncopy,
+    )
+
+
+@jit.numba_njit
+def lookup_emission_probability_haploid(
+    emission_func, ref_allele, query_allele, site, emission_matrix
+):
+    """
+    Return the emission probability at a specified site for the haploid case.
+
+    If emission_func is None, then emission_matrix is a lookup table from
+    `get_emission_lookup_haploid`. Otherwise, emission_func is called with
+    emission_matrix, as in `get_emission_probability_haploid`.
+
+    :param function emission_func: Emission function, or None.
+    :param int ref_allele: Reference allele.
+    :param int query_allele: Query allele.
+    :param int site: Site index.
+    :param numpy.ndarray emission_matrix: Emission lookup table or probability matrix.
+    :return: Emission probability.
+    :rtype: float
+    """
+    if emission_func is None:
+        emission_index = get_index_in_emission_lookup_haploid(ref_allele, query_allele)
+        return emission_matrix[site, emission_index]
+    else:
+        return emission_func(
+            ref_allele=ref_allele,
+            query_allele=query_allele,
+            site=site,
+            emission_matrix=emission_matrix,
+        )
+
+
 # Functions to assign emission probabilities for diploid LS HMM.
 @jit.numba_njit
 def get_emission_matrix_diploid(mu, num_sites, num_alleles, scale_mutation_rate):
@@ -399,6 +643,86 @@ def get_emission_probability_diploid_genotypes(
     return emission_probs
 
 
+@jit.numba_njit
+def get_phased_genotype(ref_allele_1, ref_allele_2):
+    """
+    Return the genotype (allele dosage) of a pair of reference haplotypes at a site,
+    as in `convert_haplotypes_to_phased_genotypes`.
+
+    :param int ref_allele_1: Allele of the first reference haplotype.
+    :param int ref_allele_2: Allele of the second reference haplotype.
+    :return: Reference genotype, or NONCOPY if either allele is NONCOPY.
+    :rtype: int
+    """
+    if ref_allele_1 == NONCOPY or ref_allele_2 == NONCOPY:
+        return NONCOPY
+    return ref_allele_1 + ref_allele_2
+
+
+@jit.numba_njit
+def get_num_unordered_pairs(num_ref_haps):
+    """Return the number of unordered pairs of reference haplotypes, n(n + 1) / 2."""
+    return num_ref_haps * (num_ref_haps + 1) // 2
+
+
+@jit.numba_njit
+def get_unordered_pair_index(num_ref_haps, j1, j2):
+    """
+    Return the index of the unordered pair {j1, j2} of reference haplotypes
+    in an array of unordered pairs.
+
+    The unordered pairs are stored as the upper triangle (j1 <= j2) of an (n, n) array,
+    flattened row by row, as in `numpy.triu_indices`.
+    """
+    if j1 > j2:
+        j1, j2 = j2, j1
+    return j1 * num_ref_haps - j1 * (j1 - 1) // 2 + j2 - j1
+
+
+def unpack_unordered_pairs(array, num_ref_haps):
+    """
+    Expand an array whose last axis is over the unordered pairs of reference haplotypes
+    into an array whose last two axes are over the ordered pairs, and return it.
+
+    The value of an unordered pair {j1, j2} is assigned to both (j1, j2) and (j2, j1).
+
+    :param numpy.ndarray array: An array of size (..., n(n + 1) / 2).
+    :param int num_ref_haps: Number of reference haplotypes.
+    :return: An array of size (..., n, n).
+    :rtype: numpy.ndarray
+    """
+    array = np.asarray(array)
+    if array.shape[-1] != get_num_unordered_pairs(num_ref_haps):
+        err_msg = "Last axis does not match the number of unordered pairs."
+        raise ValueError(err_msg)
+    j1, j2 = np.triu_indices(num_ref_haps)
+    unpacked = np.zeros(array.shape[:-1] + (num_ref_haps, num_ref_haps), array.dtype)
+    unpacked[..., j1, j2] = array
+    unpacked[..., j2, j1] = array
+    return unpacked
+
+
+@jit.numba_njit
+def get_emission_probability_diploid_haplotypes(
+    ref_haplotypes, query_genotype, site, emission_matrix
+):
+    """
+    Return the emission probabilities of all the pairs of reference haplotypes at a site,
+    given the alleles of the reference haplotypes at the site.
+    """
+    num_ref_haps = len(ref_haplotypes)
+    emission_probs = np.zeros((num_ref_haps, num_ref_haps), dtype=np.float64)
+    for i in range(num_ref_haps):
+        for j in range(num_ref_haps):
+            emission_probs[i, j] = get_emission_probability_diploid(
+                ref_genotype=get_phased_genotype(ref_haplotypes[i], ref_haplotypes[j]),
+                query_genotype=query_genotype,
+                site=site,
+                emission_matrix=emission_matrix,
+            )
+    return emission_probs
+
+
 @jit.numba_njit
 def get_index_in_emission_matrix_diploid(ref_genotype, query_genotype):
     """
@@ -0,0 +1,114 @@
+"""
+Functions to run the HMM algorithms concurrently on a pool of threads.
+
+The compiled kernels release the GIL, so that independent calls of the API
+functions run concurrently on a :class:`concurrent.futures.ThreadPoolExecutor`,
+and can share a reference panel without copying it. The reference panel is read,
+but not modified, by the API functions. To check it only once, pass
+a :class:`PreparedPanel` from :func:`prepare_panel` instead of an array.
+
+The parallel kernels, which run batches of queries in :func:`viterbi` and
+the algorithms when `num_threads` is given, can only be called concurrently
+with Numba's tbb or omp threading layers. With the workqueue threading layer,
+a RuntimeError is raised when such calls are scheduled.
+"""
+
+import asyncio
+import functools
+
+import numpy as np
+
+from . import api
+from . import jit
+
+
+def check_parallel_kernels(query, viterbi, kwargs):
+    """
+    Check that the parallel kernels can be called concurrently, if a call
+    of :func:`forwards` or :func:`viterbi` with these arguments would use them.
+    """
+    is_batch = np.ndim(query) == 2 and np.shape(query)[0] > 1
+    if kwargs.get("num_threads") is not None or (viterbi and is_batch):
+        jit.check_concurrent_parallel_kernels()
+
+
+def submit_forwards(
+    executor, reference_panel, query, ploidy, prob_recombination, **kwargs
+):
+    """
+    Schedule a call of :func:`forwards` on an executor, and return a future
+    of the forward probabilities, normalisation factors, and log-likelihood.
+
+    :param concurrent.futures.Executor executor: An executor, e.g. a thread pool.
+    :param numpy.ndarray/PreparedPanel reference_panel: A panel of reference haplotypes.
+    :param numpy.ndarray query: A query (a haplotype or a sequence of allelic dosages).
+    :param int ploidy: Ploidy (only 1 or 2 are supported).
+    :param numpy.ndarray prob_recombination: Recombination probability.
+    :param kwargs: Further keyword arguments of :func:`forwards`.
+    :return: A future of the output of :func:`forwards`.
+    :rtype: concurrent.futures.Future
+    """
+    check_parallel_kernels(query, False, kwargs)
+    return executor.submit(
+        api.forwards, reference_panel, query, ploidy, prob_recombination, **kwargs
+    )
+
+
+def submit_viterbi(
+    executor, reference_panel, query, ploidy, prob_recombination, **kwargs
+):
+    """
+    Schedule a call of :func:`viterbi` on an executor, and return a future
+    of the best path and its log-likelihood.
+
+    :param concurrent.futures.Executor executor: An executor, e.g. a thread pool.
+    :param numpy.ndarray/PreparedPanel reference_panel: A panel of reference haplotypes.
+    :param numpy.ndarray query: A query (a haplotype or a sequence of allelic dosages).
+    :param int ploidy: Ploidy (only 1 or 2 are supported).
+    :param numpy.ndarray prob_recombination: Recombination probability.
+    :param kwargs: Further keyword arguments of :func:`viterbi`.
+    :return: A future of the output of :func:`viterbi`.
+    :rtype: concurrent.futures.Future
+    """
+    check_parallel_kernels(query, True, kwargs)
+    return executor.submit(
+        api.viterbi, reference_panel, query, ploidy, prob_recombination, **kwargs
+    )
+
+
+async def forwards_async(
+    reference_panel, query, ploidy, prob_recombination, *, executor=None, **kwargs
+):
+    """
+    Run :func:`forwards` on an executor (by default, that of the running event loop),
+    without blocking the event loop.
+
+    :param concurrent.futures.Executor executor: An executor, e.g. a thread pool.
+    :return: The output of :func:`forwards`.
+    :rtype: tuple
+    """
+    check_parallel_kernels(query, False, kwargs)
+    loop = asyncio.get_running_loop()
+    func = functools.partial(
+        api.forwards, reference_panel, query, ploidy, prob_recombination, **kwargs
+    )
+    return await loop.run_in_executor(executor, func)
+
+
+async def viterbi_async(
+    reference_panel, query, ploidy, prob_recombination, *, executor=None, **kwargs
+):
+    """
+    Run :func:`viterbi` on an executor (by default, that of the running event loop),
+    without blocking the event loop.
+
+    :param concurrent.futures.Executor executor: An executor, e.g. a thread pool.
+    :return: The output of :func:`viterbi`.
+    :rtype: tuple
+    """
+    check_parallel_kernels(query, True, kwargs)
+    loop = asyncio.get_running_loop()
+    func = functools.partial(
+        api.viterbi, reference_panel, query, ploidy, prob_recombination, **kwargs
+    )
+    return await loop.run_in_executor(executor, func)
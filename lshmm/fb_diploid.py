@@ -249,31 +249,52 @@ def backward_ls_dip_starting_point(n, m, G, s, e, r):
 
 
 @jit.numba_njit
-def forward_ls_dip_loop(n, m, G, s, e, r, norm=True):
+def forward_ls_dip_loop(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    norm=True,
+    num_copiable_entries=None,
+    dtype=np.float64,
+    rescale_threshold=np.inf,
+):
     """
     An implementation without vectorisation.
 
+    The reference panel H is an array of haplotypes of size (m, n), and the genotypes
+    of the pairs of reference haplotypes are computed on the fly.
+
+    If norm is True, the forward probabilities at a site are only rescaled if their
+    sum is below rescale_threshold, or at the last site, as in `forwards_ls_hap`.
+
     This is exposed via the API.
     """
     # Initialise
-    F = np.zeros((m, n, n))
+    F = np.zeros((m, n, n), dtype=dtype)
     for j1 in range(n):
         for j2 in range(n):
             F[0, j1, j2] = 1 / (n**2)
             emission_prob = core.get_emission_probability_diploid(
-                ref_genotype=G[0, j1, j2],
+                ref_genotype=core.get_phased_genotype(H[0, j1], H[0, j2]),
                 query_genotype=s[0, 0],
                 site=0,
                 emission_matrix=e,
             )
             F[0, j1, j2] *= emission_prob
-    num_copiable_entries = core.get_num_copiable_entries(G)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
     r_n = r / num_copiable_entries
     c = np.ones(m)
 
     if norm:
-        c[0] = np.sum(F[0, :, :])
-        F[0, :, :] *= 1 / c[0]
+        F_sum = core.sum_float64(F[0, :, :])
+        if F_sum < rescale_threshold or m == 1:
+            c[0] = F_sum
+            F[0, :, :] *= 1 / c[0]
+            F_sum = 1.0
 
         for l in range(1, m):
             F_no_change = np.zeros((n, n))
@@ -284,7 +305,8 @@ def forward_ls_dip_loop(n, m, G, s, e, r, norm=True):
                     F_no_change[j1, j2] = (1 - r[l]) ** 2 * F[l - 1, j1, j2]
                     F_j_change[j1] += (1 - r[l]) * r_n[l] * F[l - 1, j2, j1]
 
-            F[l, :, :] = r_n[l] ** 2
+            F[l, :, :] = r_n[l] ** 2 * F_sum
+            F_sum = 0.0
 
             for j1 in range(n):
                 F[l, j1, :] += F_j_change
@@ -295,15 +317,18 @@ def forward_ls_dip_loop(n, m, G, s, e, r, norm=True):
             for j1 in range(n):
                 for j2 in range(n):
                     emission_prob = core.get_emission_probability_diploid(
-                        ref_genotype=G[l, j1, j2],
+                        ref_genotype=core.get_phased_genotype(H[l, j1], H[l, j2]),
                         query_genotype=s[0, l],
                         site=l,
                         emission_matrix=e,
                     )
                     F[l, j1, j2] *= emission_prob
+                    F_sum += F[l, j1, j2]
 
-            c[l] = np.sum(F[l, :, :])
-            F[l, :, :] *= 1 / c[l]
+            if F_sum < rescale_threshold or l == m - 1:
+                c[l] = F_sum
+                F[l, :, :] *= 1 / c[l]
+                F_sum = 1.0
 
         ll = np.sum(np.log10(c))
 
@@ -332,29 +357,32 @@ def forward_ls_dip_loop(n, m, G, s, e, r, norm=True):
             for j1 in range(n):
                 for j2 in range(n):
                     emission_prob = core.get_emission_probability_diploid(
-                        ref_genotype=G[l, j1, j2],
+                        ref_genotype=core.get_phased_genotype(H[l, j1], H[l, j2]),
                         query_genotype=s[0, l],
                         site=l,
                         emission_matrix=e,
                     )
                     F[l, j1, j2] *= emission_prob
 
-            ll = np.log10(np.sum(F[l, :, :]))
+        ll = np.log10(core.sum_float64(F[m - 1, :, :]))
 
     return F, c, ll
 
 
 @jit.numba_njit
-def backward_ls_dip_loop(n, m, G, s, e, c, r):
+def backward_ls_dip_loop(
+    n, m, H, s, e, c, r, num_copiable_entries=None, dtype=np.float64
+):
     """
     An implementation without vectorisation.
 
     This is exposed via the API.
     """
     # Initialise
-    B = np.zeros((m, n, n))
+    B = np.zeros((m, n, n), dtype=dtype)
     B[m - 1, :, :] = 1
-    num_copiable_entries = core.get_num_copiable_entries(G)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
     r_n = r / num_copiable_entries
 
     for l in range(m - 2, -1, -1):
@@ -368,7 +396,7 @@ def backward_ls_dip_loop(n, m, G, s, e, c, r):
         for j1 in range(n):
             for j2 in range(n):
                 emission_prob = core.get_emission_probability_diploid(
-                    ref_genotype=G[l + 1, j1, j2],
+                    ref_genotype=core.get_phased_genotype(H[l + 1, j1], H[l + 1, j2]),
                     query_genotype=s[0, l + 1],
                     site=l + 1,
                     emission_matrix=e,
@@ -399,3 +427,1587 @@ def backward_ls_dip_loop(n, m, G, s, e, c, r):
         B[l, :, :] *= 1 / c[l + 1]
 
     return B
+
+
+@jit.numba_njit(parallel=True)
+def forward_ls_dip_loop_parallel_step(
+    n, l, H, s, e, r, r_n, F, F_sum, block_size, F_j_change, F_block_sums
+):
+    """
+    Compute the forward probabilities at site l from those at site l - 1, whose sum
+    is F_sum (or initialise them at site 0), updating the blocks of rows in parallel.
+    The sums over the blocks are written to F_block_sums.
+
+    The forward probabilities are symmetric in j1 and j2, so the sum over a column
+    is found from the row with the same index, by the thread that updates the row.
+    """
+    num_blocks = len(F_block_sums)
+    if l > 0:
+        for b in jit.prange(num_blocks):
+            for j1 in range(b * block_size, min((b + 1) * block_size, n)):
+                F_j_change[j1] = 0.0
+                for j2 in range(n):
+                    F_j_change[j1] += (1 - r[l]) * r_n[l] * F[l - 1, j1, j2]
+
+    for b in jit.prange(num_blocks):
+        F_block_sums[b] = 0.0
+        for j1 in range(b * block_size, min((b + 1) * block_size, n)):
+            for j2 in range(n):
+                emission_prob = core.get_emission_probability_diploid(
+                    ref_genotype=core.get_phased_genotype(H[l, j1], H[l, j2]),
+                    query_genotype=s[0, l],
+                    site=l,
+                    emission_matrix=e,
+                )
+                if l == 0:
+                    F[0, j1, j2] = 1 / (n**2)
+                else:
+                    # Add the changes in the same order as `forward_ls_dip_loop`.
+                    F[l, j1, j2] = r_n[l] ** 2 * F_sum
+                    F[l, j1, j2] += F_j_change[max(j1, j2)]
+                    F[l, j1, j2] += F_j_change[min(j1, j2)]
+                    F[l, j1, j2] += (1 - r[l]) ** 2 * F[l - 1, j1, j2]
+                F[l, j1, j2] *= emission_prob
+                F_block_sums[b] += F[l, j1, j2]
+
+
+@jit.starts_threads
+@jit.numba_njit
+def forward_ls_dip_loop_parallel(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    norm=True,
+    num_copiable_entries=None,
+    dtype=np.float64,
+    rescale_threshold=np.inf,
+    block_size=None,
+):
+    """
+    A parallel implementation, in which the rows (j1) of the pairs of haplotypes
+    are split into blocks of block_size rows (by default, as given by
+    `core.get_parallel_block_size_diploid`), which are updated by different threads
+    at each site.
+
+    The sum of the forward probabilities at a site is computed from the sums
+    over the blocks, and the forward probabilities are rescaled as in
+    `forward_ls_dip_loop`.
+
+    This is exposed via the API.
+    """
+    F = np.zeros((m, n, n), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r / num_copiable_entries
+    # Numba passes the block size to the parallel step as None if it is assigned
+    # within an if statement.
+    block_size = (
+        core.get_parallel_block_size_diploid(n) if block_size is None else block_size
+    )
+    F_j_change = np.zeros(n)
+    F_block_sums = np.zeros((n + block_size - 1) // block_size)
+
+    c = np.ones(m)
+    F_sum = 0.0
+    for l in range(m):
+        forward_ls_dip_loop_parallel_step(
+            n, l, H, s, e, r, r_n, F, F_sum, block_size, F_j_change, F_block_sums
+        )
+        F_sum = core.sum_float64(F_block_sums)
+
+        if norm and (F_sum < rescale_threshold or l == m - 1):
+            c[l] = F_sum
+            core.scale_parallel(F[l].reshape(n * n), 1 / c[l], block_size * n)
+            F_sum = 1.0
+
+    if norm:
+        ll = np.sum(np.log10(c))
+    else:
+        ll = np.log10(F_sum)
+
+    return F, c, ll
+
+
+@jit.numba_njit(parallel=True)
+def backward_ls_dip_loop_parallel_step(
+    n, l, H, s, e, r, r_n, B, tmp_B, block_size, B_j_change, B_block_sums
+):
+    """
+    Multiply the backward probabilities at site l + 1 by the emission probabilities,
+    updating the blocks of rows in parallel. The products are written to tmp_B,
+    the changes from a switch in one of the haplotypes to B_j_change, and the changes
+    from a switch in both of them, summed over the blocks, to B_block_sums.
+
+    As in `forward_ls_dip_loop_parallel_step`, the sums over the columns are found
+    from the rows.
+    """
+    for b in jit.prange(len(B_block_sums)):
+        B_block_sums[b] = 0.0
+        for j1 in range(b * block_size, min((b + 1) * block_size, n)):
+            B_j_change[j1] = 0.0
+            for j2 in range(n):
+                emission_prob = core.get_emission_probability_diploid(
+                    ref_genotype=core.get_phased_genotype(H[l + 1, j1], H[l + 1, j2]),
+                    query_genotype=s[0, l + 1],
+                    site=l + 1,
+                    emission_matrix=e,
+                )
+                tmp_B[j1, j2] = B[l + 1, j1, j2] * emission_prob
+                B_j_change[j1] += (1 - r[l + 1]) * r_n[l + 1] * tmp_B[j1, j2]
+                B_block_sums[b] += r_n[l + 1] ** 2 * tmp_B[j1, j2]
+
+
+@jit.numba_njit(parallel=True)
+def backward_ls_dip_loop_parallel_update(
+    n, l, c, r, B, tmp_B, B_both_change, block_size, B_j_change
+):
+    """Compute the backward probabilities at site l, updating the blocks of rows in parallel."""
+    num_blocks = (n + block_size - 1) // block_size
+    for b in jit.prange(num_blocks):
+        for j1 in range(b * block_size, min((b + 1) * block_size, n)):
+            for j2 in range(n):
+                B[l, j1, j2] = B_both_change
+                B[l, j1, j2] += B_j_change[max(j1, j2)]
+                B[l, j1, j2] += B_j_change[min(j1, j2)]
+                B[l, j1, j2] += (1 - r[l + 1]) ** 2 * tmp_B[j1, j2]
+                B[l, j1, j2] *= 1 / c[l + 1]
+
+
+@jit.starts_threads
+@jit.numba_njit
+def backward_ls_dip_loop_parallel(
+    n,
+    m,
+    H,
+    s,
+    e,
+    c,
+    r,
+    num_copiable_entries=None,
+    dtype=np.float64,
+    block_size=None,
+):
+    """
+    A parallel implementation, in which the rows of the pairs of haplotypes
+    are split into blocks as in `forward_ls_dip_loop_parallel`.
+
+    This is exposed via the API.
+    """
+    B = np.zeros((m, n, n), dtype=dtype)
+    B[m - 1, :, :] = 1
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r / num_copiable_entries
+    # As in `forward_ls_dip_loop_parallel`.
+    block_size = (
+        core.get_parallel_block_size_diploid(n) if block_size is None else block_size
+    )
+    tmp_B = np.zeros((n, n))
+    B_j_change = np.zeros(n)
+    B_block_sums = np.zeros((n + block_size - 1) // block_size)
+
+    for l in range(m - 2, -1, -1):
+        backward_ls_dip_loop_parallel_step(
+            n, l, H, s, e, r, r_n, B, tmp_B, block_size, B_j_change, B_block_sums
+        )
+        B_both_change = core.sum_float64(B_block_sums)
+        backward_ls_dip_loop_parallel_update(
+            n, l, c, r, B, tmp_B, B_both_change, block_size, B_j_change
+        )
+
+    return B
+
+
+@jit.numba_njit
+def forward_ls_dip_loop_batch(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    norm=True,
+    num_copiable_entries=None,
+    dtype=np.float64,
+    rescale_threshold=np.inf,
+):
+    """
+    Run the implementation without vectorisation on a batch of queries.
+
+    The queries are an array of size (k, m), and the emission probability matrices
+    are an array of size (k, m, 8). The reference panel is shared by all the queries.
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    F = np.zeros((k, m, n, n), dtype=dtype)
+    c = np.zeros((k, m))
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    for q in range(k):
+        F_q, c_q, ll_q = forward_ls_dip_loop(
+            n,
+            m,
+            H,
+            s[q : q + 1, :],
+            e[q],
+            r,
+            norm,
+            num_copiable_entries,
+            dtype,
+            rescale_threshold,
+        )
+        F[q] = F_q
+        c[q] = c_q
+        ll[q] = ll_q
+    return F, c, ll
+
+
+@jit.numba_njit
+def backward_ls_dip_loop_batch(
+    n, m, H, s, e, c, r, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    Run the implementation without vectorisation on a batch of queries.
+
+    The queries are an array of size (k, m), the emission probability matrices
+    are an array of size (k, m, 8), and the normalisation factors from the forwards
+    pass are an array of size (k, m).
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    B = np.zeros((k, m, n, n), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    for q in range(k):
+        B[q] = backward_ls_dip_loop(
+            n, m, H, s[q : q + 1, :], e[q], c[q], r, num_copiable_entries, dtype
+        )
+    return B
+
+
+@jit.numba_njit
+def posteriors_ls_dip_loop(
+    n, m, H, s, e, r, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    Compute the posterior probabilities of the pairs of copying states at each site.
+
+    The normalised forward probabilities are computed first, and the backward
+    probabilities are then computed one site at a time, overwriting the forward
+    probabilities with the posterior probabilities. Only a single matrix of
+    backward probabilities of size (n, n) is held in memory.
+
+    This is exposed via the API.
+    """
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    P, c, ll = forward_ls_dip_loop(n, m, H, s, e, r, True, num_copiable_entries, dtype)
+    r_n = r / num_copiable_entries
+
+    B = np.ones((n, n), dtype=dtype)
+    B_no_change = np.zeros((n, n))
+    B_j1_change = np.zeros(n)
+    B_j2_change = np.zeros(n)
+    e_tmp = np.zeros((n, n))
+    for l in range(m - 2, -1, -1):
+        B_j1_change[:] = 0
+        B_j2_change[:] = 0
+        B_both_change = 0
+
+        for j1 in range(n):
+            for j2 in range(n):
+                e_tmp[j1, j2] = core.get_emission_probability_diploid(
+                    ref_genotype=core.get_phased_genotype(H[l + 1, j1], H[l + 1, j2]),
+                    query_genotype=s[0, l + 1],
+                    site=l + 1,
+                    emission_matrix=e,
+                )
+
+        for j1 in range(n):
+            for j2 in range(n):
+                B_no_change[j1, j2] = (1 - r[l + 1]) ** 2 * B[j1, j2] * e_tmp[j1, j2]
+                B_j2_change[j1] += (
+                    (1 - r[l + 1]) * r_n[l + 1] * B[j1, j2] * e_tmp[j1, j2]
+                )
+                B_j1_change[j1] += (
+                    (1 - r[l + 1]) * r_n[l + 1] * B[j2, j1] * e_tmp[j2, j1]
+                )
+                B_both_change += r_n[l + 1] ** 2 * e_tmp[j1, j2] * B[j1, j2]
+
+        for j1 in range(n):
+            for j2 in range(n):
+                B[j1, j2] = (
+                    B_both_change
+                    + B_j2_change[j1]
+                    + B_j1_change[j2]
+                    + B_no_change[j1, j2]
+                ) / c[l + 1]
+                P[l, j1, j2] *= B[j1, j2]
+
+    return P, ll
+
+
+@jit.numba_njit
+def posteriors_ls_dip_loop_batch(
+    n, m, H, s, e, r, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    Compute the posterior probabilities of the pairs of copying states for a batch of queries.
+
+    The queries are an array of size (k, m), and the emission probability matrices
+    are an array of size (k, m, 8).
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    P = np.zeros((k, m, n, n), dtype=dtype)
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    for q in range(k):
+        P_q, ll_q = posteriors_ls_dip_loop(
+            n, m, H, s[q : q + 1, :], e[q], r, num_copiable_entries, dtype
+        )
+        P[q] = P_q
+        ll[q] = ll_q
+    return P, ll
+
+
+@jit.numba_njit
+def forward_ls_dip_segment(
+    n, H, s, e, c, r, F_prev, start, stop, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    Compute the normalised forward probabilities at the sites from start to stop - 1.
+
+    The forward probabilities at site start - 1 are given in F_prev, which is ignored
+    if start is 0. The normalisation factors at the sites are written into c,
+    which is of size stop - start. Only the sites of the segment are read, so that
+    the cost of recomputing a segment does not depend on the number of sites.
+    """
+    F = np.zeros((stop - start, n, n), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r[start:stop] / num_copiable_entries[start:stop]
+
+    F_j_change = np.zeros(n)
+    for l in range(start, stop):
+        row = l - start
+        if l == 0:
+            F[row, :, :] = 1 / (n**2)
+        else:
+            F_before = F_prev if l == start else F[row - 1]
+            F_j_change[:] = 0
+            for j1 in range(n):
+                for j2 in range(n):
+                    F_j_change[j1] += (1 - r[l]) * r_n[row] * F_before[j2, j1]
+
+            for j1 in range(n):
+                for j2 in range(n):
+                    F[row, j1, j2] = (
+                        r_n[row] ** 2
+                        + F_j_change[j1]
+                        + F_j_change[j2]
+                        + (1 - r[l]) ** 2 * F_before[j1, j2]
+                    )
+
+        for j1 in range(n):
+            for j2 in range(n):
+                emission_prob = core.get_emission_probability_diploid(
+                    ref_genotype=core.get_phased_genotype(H[l, j1], H[l, j2]),
+                    query_genotype=s[0, l],
+                    site=l,
+                    emission_matrix=e,
+                )
+                F[row, j1, j2] *= emission_prob
+
+        c[row] = core.sum_float64(F[row, :, :])
+        F[row, :, :] *= 1 / c[row]
+
+    return F
+
+
+@jit.numba_njit
+def forward_ls_dip_checkpoint(
+    n, m, H, s, e, r, interval, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    Compute the normalised forward probabilities, keeping only checkpoints.
+
+    The sites are split into segments of `interval` sites. Checkpoint j holds the
+    forward probabilities at the site before the start of segment j, from which
+    the segment can be recomputed using `forward_ls_dip_segment`.
+    The checkpoint of the first segment is unused.
+    """
+    num_segments = (m + interval - 1) // interval
+    checkpoints = np.zeros((num_segments, n, n), dtype=dtype)
+    c = np.zeros(m)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+
+    for j in range(num_segments):
+        start = j * interval
+        stop = min(start + interval, m)
+        F = forward_ls_dip_segment(
+            n,
+            H,
+            s,
+            e,
+            c[start:stop],
+            r,
+            checkpoints[j],
+            start,
+            stop,
+            num_copiable_entries,
+            dtype,
+        )
+        if j + 1 < num_segments:
+            checkpoints[j + 1, :, :] = F[stop - start - 1]
+
+    ll = np.sum(np.log10(c))
+
+    return checkpoints, c, ll
+
+
+@jit.numba_njit
+def backward_ls_dip_segment(
+    n,
+    m,
+    H,
+    s,
+    e,
+    c,
+    r,
+    B_next,
+    start,
+    stop,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the backward probabilities at the sites from start to stop - 1.
+
+    The backward probabilities at site stop are given in B_next, which is ignored
+    if stop is m. Only the sites of the segment and site stop are read.
+    """
+    B = np.zeros((stop - start, n, n), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    # The recombination probabilities from site start + row to site start + row + 1.
+    r_n = r[start + 1 : stop + 1] / num_copiable_entries[start + 1 : stop + 1]
+
+    B_j1_change = np.zeros(n)
+    B_j2_change = np.zeros(n)
+    e_tmp = np.zeros((n, n))
+    for l in range(stop - 1, start - 1, -1):
+        row = l - start
+        if l == m - 1:
+            B[row, :, :] = 1
+            continue
+        B_after = B_next if l == stop - 1 else B[row + 1]
+        B_j1_change[:] = 0
+        B_j2_change[:] = 0
+        B_both_change = 0
+
+        for j1 in range(n):
+            for j2 in range(n):
+                e_tmp[j1, j2] = core.get_emission_probability_diploid(
+                    ref_genotype=core.get_phased_genotype(H[l + 1, j1], H[l + 1, j2]),
+                    query_genotype=s[0, l + 1],
+                    site=l + 1,
+                    emission_matrix=e,
+                )
+
+        for j1 in range(n):
+            for j2 in range(n):
+                B_j2_change[j1] += (
+                    (1 - r[l + 1]) * r_n[row] * B_after[j1, j2] * e_tmp[j1, j2]
+                )
+                B_j1_change[j1] += (
+                    (1 - r[l + 1]) * r_n[row] * B_after[j2, j1] * e_tmp[j2, j1]
+                )
+                B_both_change += r_n[row] ** 2 * e_tmp[j1, j2] * B_after[j1, j2]
+
+        for j1 in range(n):
+            for j2 in range(n):
+                B[row, j1, j2] = (
+                    B_both_change
+                    + B_j2_change[j1]
+                    + B_j1_change[j2]
+                    + (1 - r[l + 1]) ** 2 * B_after[j1, j2] * e_tmp[j1, j2]
+                ) / c[l + 1]
+
+    return B
+
+
+@jit.numba_njit
+def backward_ls_dip_checkpoint(
+    n, m, H, s, e, c, r, interval, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    Compute the backward probabilities, keeping only checkpoints.
+
+    The sites are split into segments of `interval` sites. Checkpoint j holds the
+    backward probabilities at the site after the end of segment j, from which
+    the segment can be recomputed using `backward_ls_dip_segment`.
+    The checkpoint of the last segment is unused.
+    """
+    num_segments = (m + interval - 1) // interval
+    checkpoints = np.zeros((num_segments, n, n), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+
+    for j in range(num_segments - 1, -1, -1):
+        start = j * interval
+        stop = min(start + interval, m)
+        B = backward_ls_dip_segment(
+            n,
+            m,
+            H,
+            s,
+            e,
+            c,
+            r,
+            checkpoints[j],
+            start,
+            stop,
+            num_copiable_entries,
+            dtype,
+        )
+        if j > 0:
+            checkpoints[j - 1, :, :] = B[0]
+
+    return checkpoints
+
+
+@jit.numba_njit
+def forward_ls_dip_loop_loglik(
+    n, m, H, s, e, r, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    Compute the normalisation factors and log-likelihood of the forwards algorithm.
+
+    Only the forward probabilities at the previous and current sites are held in memory.
+
+    This is exposed via the API.
+    """
+    F = np.zeros((n, n), dtype=dtype)
+    F_prev = np.zeros((n, n), dtype=dtype)
+    F_j_change = np.zeros(n)
+    c = np.zeros(m)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r / num_copiable_entries
+
+    for l in range(m):
+        if l == 0:
+            F[:, :] = 1 / (n**2)
+        else:
+            F_prev[:, :] = F
+            F_j_change[:] = 0
+            for j1 in range(n):
+                for j2 in range(n):
+                    F_j_change[j1] += (1 - r[l]) * r_n[l] * F_prev[j2, j1]
+
+            for j1 in range(n):
+                for j2 in range(n):
+                    F[j1, j2] = (
+                        r_n[l] ** 2
+                        + F_j_change[j1]
+                        + F_j_change[j2]
+                        + (1 - r[l]) ** 2 * F_prev[j1, j2]
+                    )
+
+        for j1 in range(n):
+            for j2 in range(n):
+                emission_prob = core.get_emission_probability_diploid(
+                    ref_genotype=core.get_phased_genotype(H[l, j1], H[l, j2]),
+                    query_genotype=s[0, l],
+                    site=l,
+                    emission_matrix=e,
+                )
+                F[j1, j2] *= emission_prob
+
+        c[l] = core.sum_float64(F)
+        F *= 1 / c[l]
+
+    ll = np.sum(np.log10(c))
+
+    return c, ll
+
+
+@jit.numba_njit
+def forward_ls_dip_loop_loglik_batch(
+    n, m, H, s, e, r, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    Compute the normalisation factors and log-likelihoods for a batch of queries.
+
+    The queries are an array of size (k, m), and the emission probability matrices
+    are an array of size (k, m, 8).
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    c = np.zeros((k, m))
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    for q in range(k):
+        c_q, ll_q = forward_ls_dip_loop_loglik(
+            n, m, H, s[q : q + 1, :], e[q], r, num_copiable_entries, dtype
+        )
+        c[q] = c_q
+        ll[q] = ll_q
+    return c, ll
+
+
+@jit.numba_njit
+def forward_ls_dip_loop_log(
+    n, m, H, s, e, r, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    Compute the unnormalised forward probabilities in log space (base 10).
+
+    The sums over the previous site are computed by log-sum-exp relative to the maximum
+    at the previous site, so the forward probabilities do not underflow for long queries.
+
+    This is exposed via the API.
+    """
+    logF = np.zeros((m, n, n), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r / num_copiable_entries
+
+    for j1 in range(n):
+        for j2 in range(n):
+            emission_prob = core.get_emission_probability_diploid(
+                ref_genotype=core.get_phased_genotype(H[0, j1], H[0, j2]),
+                query_genotype=s[0, 0],
+                site=0,
+                emission_matrix=e,
+            )
+            logF[0, j1, j2] = np.log10(1 / (n**2) * emission_prob)
+
+    scaled_F = np.zeros((n, n))
+    F_row_sum = np.zeros(n)
+    F_col_sum = np.zeros(n)
+    for l in range(1, m):
+        max_logF = np.max(logF[l - 1, :, :])
+        F_row_sum[:] = 0
+        F_col_sum[:] = 0
+        F_sum = 0.0
+        for j1 in range(n):
+            for j2 in range(n):
+                scaled_F[j1, j2] = 10 ** (logF[l - 1, j1, j2] - max_logF)
+                F_row_sum[j1] += scaled_F[j1, j2]
+                F_col_sum[j2] += scaled_F[j1, j2]
+                F_sum += scaled_F[j1, j2]
+
+        for j1 in range(n):
+            for j2 in range(n):
+                emission_prob = core.get_emission_probability_diploid(
+                    ref_genotype=core.get_phased_genotype(H[l, j1], H[l, j2]),
+                    query_genotype=s[0, l],
+                    site=l,
+                    emission_matrix=e,
+                )
+                F_no_change = (1 - r[l]) ** 2 * scaled_F[j1, j2]
+                F_single_change = (1 - r[l]) * r_n[l] * (F_row_sum[j1] + F_col_sum[j2])
+                F_both_change = r_n[l] ** 2 * F_sum
+                logF[l, j1, j2] = (
+                    max_logF
+                    + np.log10(F_no_change + F_single_change + F_both_change)
+                    + np.log10(emission_prob)
+                )
+
+    max_logF = np.max(logF[m - 1, :, :])
+    ll = max_logF + np.log10(core.sum_float64(10 ** (logF[m - 1, :, :] - max_logF)))
+
+    return logF, ll
+
+
+@jit.numba_njit
+def forward_ls_dip_loop_log_batch(
+    n, m, H, s, e, r, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    Compute the unnormalised forward probabilities in log space for a batch of queries.
+
+    The queries are an array of size (k, m), and the emission probability matrices
+    are an array of size (k, m, 8).
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    logF = np.zeros((k, m, n, n), dtype=dtype)
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    for q in range(k):
+        logF_q, ll_q = forward_ls_dip_loop_log(
+            n, m, H, s[q : q + 1, :], e[q], r, num_copiable_entries, dtype
+        )
+        logF[q] = logF_q
+        ll[q] = ll_q
+    return logF, ll
+
+
+@jit.numba_njit
+def forward_ls_dip_unordered(
+    n, m, H, s, e, r, norm=True, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    An implementation over the unordered pairs of reference haplotypes.
+
+    The emission and transition probabilities are symmetric in the two haplotypes
+    of a pair, and so are the forward probabilities. Only the pairs with j1 <= j2 are
+    stored, in an array of size (m, n(n + 1) / 2) indexed as in
+    `core.get_unordered_pair_index`. Each entry is the forward probability of
+    the ordered pair (j1, j2), so that the pairs with j1 < j2 are counted twice
+    in the sums over all the pairs.
+
+    This is exposed via the API.
+    """
+    num_pairs = core.get_num_unordered_pairs(n)
+    F = np.zeros((m, num_pairs), dtype=dtype)
+    c = np.ones(m)
+    F_j_change = np.zeros(n)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r / num_copiable_entries
+
+    F_sum = 0.0
+    F_both_change = 0.0
+    for l in range(m):
+        if l > 0:
+            # The row sums are equal to the column sums.
+            F_j_change[:] = 0
+            j1_j2 = 0
+            for j1 in range(n):
+                for j2 in range(j1, n):
+                    F_j_change[j1] += F[l - 1, j1_j2]
+                    if j1 != j2:
+                        F_j_change[j2] += F[l - 1, j1_j2]
+                    j1_j2 += 1
+            F_j_change *= (1 - r[l]) * r_n[l]
+            if norm:
+                F_both_change = r_n[l] ** 2
+            else:
+                F_both_change = r_n[l] ** 2 * F_sum
+
+        F_sum = 0.0
+        j1_j2 = 0
+        for j1 in range(n):
+            for j2 in range(j1, n):
+                if l == 0:
+                    F[l, j1_j2] = 1 / (n**2)
+                else:
+                    F[l, j1_j2] = (
+                        F_both_change
+                        + F_j_change[j1]
+                        + F_j_change[j2]
+                        + (1 - r[l]) ** 2 * F[l - 1, j1_j2]
+                    )
+                emission_prob = core.get_emission_probability_diploid(
+                    ref_genotype=core.get_phased_genotype(H[l, j1], H[l, j2]),
+                    query_genotype=s[0, l],
+                    site=l,
+                    emission_matrix=e,
+                )
+                F[l, j1_j2] *= emission_prob
+                if j1 == j2:
+                    F_sum += F[l, j1_j2]
+                else:
+                    F_sum += 2 * F[l, j1_j2]
+                j1_j2 += 1
+
+        if norm:
+            c[l] = F_sum
+            F[l, :] *= 1 / c[l]
+            F_sum = 1.0
+
+    if norm:
+        ll = np.sum(np.log10(c))
+    else:
+        ll = np.log10(F_sum)
+
+    return F, c, ll
+
+
+@jit.numba_njit
+def backward_ls_dip_unordered(
+    n, m, H, s, e, c, r, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    An implementation over the unordered pairs of reference haplotypes.
+
+    The backward probabilities are stored as in `forward_ls_dip_unordered`.
+
+    This is exposed via the API.
+    """
+    num_pairs = core.get_num_unordered_pairs(n)
+    B = np.zeros((m, num_pairs), dtype=dtype)
+    B[m - 1, :] = 1
+    BE = np.zeros(num_pairs)
+    BE_row_sum = np.zeros(n)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r / num_copiable_entries
+
+    for l in range(m - 2, -1, -1):
+        # Backward probabilities times emission probabilities at the next site.
+        BE_row_sum[:] = 0
+        j1_j2 = 0
+        for j1 in range(n):
+            for j2 in range(j1, n):
+                emission_prob = core.get_emission_probability_diploid(
+                    ref_genotype=core.get_phased_genotype(H[l + 1, j1], H[l + 1, j2]),
+                    query_genotype=s[0, l + 1],
+                    site=l + 1,
+                    emission_matrix=e,
+                )
+                BE[j1_j2] = B[l + 1, j1_j2] * emission_prob
+                BE_row_sum[j1] += BE[j1_j2]
+                if j1 != j2:
+                    BE_row_sum[j2] += BE[j1_j2]
+                j1_j2 += 1
+        B_both_change = r_n[l + 1] ** 2 * np.sum(BE_row_sum)
+
+        j1_j2 = 0
+        for j1 in range(n):
+            for j2 in range(j1, n):
+                B[l, j1_j2] = (
+                    B_both_change
+                    + (1 - r[l + 1]) * r_n[l + 1] * (BE_row_sum[j1] + BE_row_sum[j2])
+                    + (1 - r[l + 1]) ** 2 * BE[j1_j2]
+                ) / c[l + 1]
+                j1_j2 += 1
+
+    return B
+
+
+@jit.numba_njit
+def forward_ls_dip_unordered_batch(
+    n, m, H, s, e, r, norm=True, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    Run the implementation over the unordered pairs on a batch of queries.
+
+    The queries are an array of size (k, m), and the emission probability matrices
+    are an array of size (k, m, 8). The reference panel is shared by all the queries.
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    F = np.zeros((k, m, core.get_num_unordered_pairs(n)), dtype=dtype)
+    c = np.zeros((k, m))
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    for q in range(k):
+        F_q, c_q, ll_q = forward_ls_dip_unordered(
+            n, m, H, s[q : q + 1, :], e[q], r, norm, num_copiable_entries, dtype
+        )
+        F[q] = F_q
+        c[q] = c_q
+        ll[q] = ll_q
+    return F, c, ll
+
+
+@jit.numba_njit
+def backward_ls_dip_unordered_batch(
+    n, m, H, s, e, c, r, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    Run the implementation over the unordered pairs on a batch of queries.
+
+    The queries are an array of size (k, m), the emission probability matrices
+    are an array of size (k, m, 8), and the normalisation factors from the forwards
+    pass are an array of size (k, m).
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    B = np.zeros((k, m, core.get_num_unordered_pairs(n)), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    for q in range(k):
+        B[q] = backward_ls_dip_unordered(
+            n, m, H, s[q : q + 1, :], e[q], c[q], r, num_copiable_entries, dtype
+        )
+    return B
+
+
+@jit.numba_njit
+def forward_ls_dip_sparse_step(
+    n,
+    l,
+    H,
+    s,
+    e,
+    r,
+    r_n,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    X,
+    X_rows,
+    u,
+    a,
+    b,
+    X_abs_sum,
+    F_rows,
+    u_new,
+    is_minor,
+    F_l,
+    materialise,
+):
+    """
+    Move the lazily transformed forward probabilities from site l - 1 to site l.
+
+    The forward probability of the pair (j1, j2) is a * X[j1, j2] + u[j1] + u[j2] + b,
+    where X is symmetric, X_rows holds its row sums, and X_abs_sum is the sum of
+    its absolute values. Only the rows and columns of the haplotypes not carrying
+    the major allele at site l are updated. If materialise is True, then
+    the normalised forward probabilities at site l are written to F_l.
+
+    Return the updated a, b, X_abs_sum, and the normalisation factor at site l.
+    """
+    start = minor_offsets[l]
+    stop = minor_offsets[l + 1]
+    for k in range(start, stop):
+        is_minor[minor_haps[k]] = True
+    emission_prob_major = core.get_emission_probability_diploid(
+        ref_genotype=core.get_phased_genotype(major_alleles[l], major_alleles[l]),
+        query_genotype=s[0, l],
+        site=l,
+        emission_matrix=e,
+    )
+    no_change = (1 - r[l]) ** 2
+    j_change = (1 - r[l]) * r_n[l]
+    both_change = r_n[l] ** 2
+
+    # The row sums of the forward probabilities at site l - 1.
+    u_sum = core.sum_float64(u)
+    for j in range(n):
+        F_rows[j] = a * X_rows[j] + n * u[j] + u_sum + n * b
+        u_new[j] = emission_prob_major * (no_change * u[j] + j_change * F_rows[j])
+    a_new = emission_prob_major * no_change * a
+    b_new = emission_prob_major * (no_change * b + both_change)
+
+    # The sum of the forward probabilities of the pairs both carrying the major
+    # allele at site l, which is a lower bound on the normalisation factor.
+    num_major = n - (stop - start)
+    F_rows_sum = core.sum_float64(F_rows)
+    F_rows_minor_sum = 0.0
+    F_minor_minor_sum = 0.0
+    for k1 in range(start, stop):
+        j1 = minor_haps[k1]
+        F_rows_minor_sum += F_rows[j1]
+        for k2 in range(start, stop):
+            j2 = minor_haps[k2]
+            F_minor_minor_sum += a * X[j1, j2] + u[j1] + u[j2] + b
+    F_major_major_sum = max(F_rows_sum - 2 * F_rows_minor_sum + F_minor_minor_sum, 0.0)
+    c_major = emission_prob_major * (
+        no_change * F_major_major_sum
+        + j_change * 2 * num_major * (F_rows_sum - F_rows_minor_sum)
+        + both_change * num_major**2
+    )
+    magnitude = a_new * X_abs_sum + 2 * n * core.sum_float64(u_new) + n**2 * b_new
+
+    if (
+        a_new < core.MIN_SPARSE_SCALE
+        or magnitude > core.MAX_SPARSE_CANCELLATION * c_major
+    ):
+        # Apply the transform to all the pairs.
+        for j1 in range(n):
+            for j2 in range(j1, n):
+                if is_minor[j1] or is_minor[j2]:
+                    emission_prob = core.get_emission_probability_diploid(
+                        ref_genotype=core.get_phased_genotype(H[l, j1], H[l, j2]),
+                        query_genotype=s[0, l],
+                        site=l,
+                        emission_matrix=e,
+                    )
+                else:
+                    emission_prob = emission_prob_major
+                F_j1_j2 = emission_prob * (
+                    no_change * (a * X[j1, j2] + u[j1] + u[j2] + b)
+                    + j_change * (F_rows[j1] + F_rows[j2])
+                    + both_change
+                )
+                X[j1, j2] = F_j1_j2
+                X[j2, j1] = F_j1_j2
+        a_new = 1.0
+        b_new = 0.0
+        u[:] = 0
+        for j in range(n):
+            X_rows[j] = core.sum_float64(X[j, :])
+        c = core.sum_float64(X_rows)
+        X_abs_sum = c
+        if materialise:
+            for j1 in range(n):
+                for j2 in range(n):
+                    F_l[j1, j2] = X[j1, j2] / c
+    else:
+        for k in range(start, stop):
+            j1 = minor_haps[k]
+            for j2 in range(n):
+                if is_minor[j2] and j2 < j1:
+                    # The pair is updated from the row of j2.
+                    continue
+                emission_prob = core.get_emission_probability_diploid(
+                    ref_genotype=core.get_phased_genotype(H[l, j1], H[l, j2]),
+                    query_genotype=s[0, l],
+                    site=l,
+                    emission_matrix=e,
+                )
+                F_j1_j2 = emission_prob * (
+                    no_change * (a * X[j1, j2] + u[j1] + u[j2] + b)
+                    + j_change * (F_rows[j1] + F_rows[j2])
+                    + both_change
+                )
+                X_j1_j2 = (F_j1_j2 - u_new[j1] - u_new[j2] - b_new) / a_new
+                diff = X_j1_j2 - X[j1, j2]
+                abs_diff = abs(X_j1_j2) - abs(X[j1, j2])
+                X[j1, j2] = X_j1_j2
+                X[j2, j1] = X_j1_j2
+                X_rows[j1] += diff
+                X_abs_sum += abs_diff
+                if j1 != j2:
+                    X_rows[j2] += diff
+                    X_abs_sum += abs_diff
+                if materialise:
+                    F_l[j1, j2] = F_j1_j2
+                    F_l[j2, j1] = F_j1_j2
+        u[:] = u_new
+        c = (
+            a_new * core.sum_float64(X_rows)
+            + 2 * n * core.sum_float64(u)
+            + n**2 * b_new
+        )
+        if materialise:
+            # The pairs with a minor allele carrier are set exactly, e.g. to keep zeros.
+            for j1 in range(n):
+                for j2 in range(n):
+                    if is_minor[j1] or is_minor[j2]:
+                        F_l[j1, j2] *= 1 / c
+                    else:
+                        F_l[j1, j2] = (a_new * X[j1, j2] + u[j1] + u[j2] + b_new) / c
+
+    for k in range(start, stop):
+        is_minor[minor_haps[k]] = False
+    u *= 1 / c
+
+    return a_new / c, b_new / c, X_abs_sum, c
+
+
+@jit.numba_njit
+def forward_ls_dip_sparse_init(n, H, s, e, X, X_rows):
+    """
+    Set X to the unnormalised forward probabilities at the first site.
+
+    Return the normalisation factor, which is also the sum of X.
+    """
+    for j1 in range(n):
+        for j2 in range(n):
+            emission_prob = core.get_emission_probability_diploid(
+                ref_genotype=core.get_phased_genotype(H[0, j1], H[0, j2]),
+                query_genotype=s[0, 0],
+                site=0,
+                emission_matrix=e,
+            )
+            X[j1, j2] = 1 / (n**2) * emission_prob
+        X_rows[j1] = core.sum_float64(X[j1, :])
+    return core.sum_float64(X_rows)
+
+
+@jit.numba_njit
+def forward_ls_dip_sparse(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the normalised forward probabilities, updating only the rows and columns
+    of the minor allele carriers.
+
+    The emission probabilities of the pairs of haplotypes both carrying the major
+    allele at a site are the same, so their update is a uniform scaling plus
+    the row and column sums of the forward probabilities. The forward probabilities
+    are held as such a transform of the values in X, and only the pairs with
+    a minor allele carrier are updated explicitly. The per-site index of the minor
+    allele carriers is given by core.get_minor_allele_index.
+
+    This is exposed via the API.
+    """
+    F = np.zeros((m, n, n), dtype=dtype)
+    c = np.zeros(m)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r / num_copiable_entries
+
+    X = np.zeros((n, n))
+    X_rows = np.zeros(n)
+    u = np.zeros(n)
+    c[0] = forward_ls_dip_sparse_init(n, H, s, e, X, X_rows)
+    F[0, :, :] = X / c[0]
+    a = 1 / c[0]
+    b = 0.0
+    X_abs_sum = c[0]
+
+    F_rows = np.zeros(n)
+    u_new = np.zeros(n)
+    is_minor = np.zeros(n, dtype=np.bool_)
+    F_l = np.zeros((n, n))
+    for l in range(1, m):
+        a, b, X_abs_sum, c_l = forward_ls_dip_sparse_step(
+            n,
+            l,
+            H,
+            s,
+            e,
+            r,
+            r_n,
+            major_alleles,
+            minor_offsets,
+            minor_haps,
+            X,
+            X_rows,
+            u,
+            a,
+            b,
+            X_abs_sum,
+            F_rows,
+            u_new,
+            is_minor,
+            F_l,
+            True,
+        )
+        c[l] = c_l
+        F[l, :, :] = F_l
+
+    ll = np.sum(np.log10(c))
+
+    return F, c, ll
+
+
+@jit.numba_njit
+def forward_ls_dip_sparse_loglik(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    num_copiable_entries=None,
+):
+    """
+    Compute the normalisation factors and log-likelihood, updating only the rows
+    and columns of the minor allele carriers.
+
+    Apart from the first site, the cost per site is O(nk) for k minor allele carriers.
+
+    This is exposed via the API.
+    """
+    c = np.zeros(m)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r / num_copiable_entries
+
+    X = np.zeros((n, n))
+    X_rows = np.zeros(n)
+    u = np.zeros(n)
+    c[0] = forward_ls_dip_sparse_init(n, H, s, e, X, X_rows)
+    a = 1 / c[0]
+    b = 0.0
+    X_abs_sum = c[0]
+
+    F_rows = np.zeros(n)
+    u_new = np.zeros(n)
+    is_minor = np.zeros(n, dtype=np.bool_)
+    F_l = np.zeros((0, 0))
+    for l in range(1, m):
+        a, b, X_abs_sum, c_l = forward_ls_dip_sparse_step(
+            n,
+            l,
+            H,
+            s,
+            e,
+            r,
+            r_n,
+            major_alleles,
+            minor_offsets,
+            minor_haps,
+            X,
+            X_rows,
+            u,
+            a,
+            b,
+            X_abs_sum,
+            F_rows,
+            u_new,
+            is_minor,
+            F_l,
+            False,
+        )
+        c[l] = c_l
+
+    ll = np.sum(np.log10(c))
+
+    return c, ll
+
+
+@jit.numba_njit
+def backward_ls_dip_sparse(
+    n,
+    m,
+    H,
+    s,
+    e,
+    c,
+    r,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the scaled backward probabilities, updating only the rows and columns
+    of the minor allele carriers.
+
+    The normalisation factors are those from the forwards algorithm. The backward
+    probabilities are held as a uniform scaling plus row and column terms,
+    as in `forward_ls_dip_sparse`.
+
+    This is exposed via the API.
+    """
+    B = np.zeros((m, n, n), dtype=dtype)
+    B[m - 1, :, :] = 1
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r / num_copiable_entries
+
+    X = np.ones((n, n))
+    X_rows = np.zeros(n) + n
+    X_abs_sum = n**2
+    u = np.zeros(n)
+    a = 1.0
+    b = 0.0
+
+    # Row sums of the emission probabilities times the backward probabilities.
+    EB_rows = np.zeros(n)
+    u_new = np.zeros(n)
+    is_minor = np.zeros(n, dtype=np.bool_)
+    for l in range(m - 2, -1, -1):
+        start = minor_offsets[l + 1]
+        stop = minor_offsets[l + 2]
+        for k in range(start, stop):
+            is_minor[minor_haps[k]] = True
+        emission_prob_major = core.get_emission_probability_diploid(
+            ref_genotype=core.get_phased_genotype(
+                major_alleles[l + 1], major_alleles[l + 1]
+            ),
+            query_genotype=s[0, l + 1],
+            site=l + 1,
+            emission_matrix=e,
+        )
+        no_change = (1 - r[l + 1]) ** 2
+        j_change = (1 - r[l + 1]) * r_n[l + 1]
+        both_change = r_n[l + 1] ** 2
+
+        u_sum = core.sum_float64(u)
+        for j in range(n):
+            EB_rows[j] = emission_prob_major * (
+                a * X_rows[j] + n * u[j] + u_sum + n * b
+            )
+        for k in range(start, stop):
+            EB_rows[minor_haps[k]] = 0
+        for k in range(start, stop):
+            j1 = minor_haps[k]
+            for j2 in range(n):
+                emission_prob = core.get_emission_probability_diploid(
+                    ref_genotype=core.get_phased_genotype(H[l + 1, j1], H[l + 1, j2]),
+                    query_genotype=s[0, l + 1],
+                    site=l + 1,
+                    emission_matrix=e,
+                )
+                B_j1_j2 = a * X[j1, j2] + u[j1] + u[j2] + b
+                EB_rows[j1] += emission_prob * B_j1_j2
+                if not is_minor[j2]:
+                    EB_rows[j2] += (emission_prob - emission_prob_major) * B_j1_j2
+        EB_sum = core.sum_float64(EB_rows)
+
+        for j in range(n):
+            u_new[j] = (
+                no_change * emission_prob_major * u[j] + j_change * EB_rows[j]
+            ) / c[l + 1]
+        a_new = no_change * emission_prob_major * a / c[l + 1]
+        b_new = (no_change * emission_prob_major * b + both_change * EB_sum) / c[l + 1]
+
+        # The sum of the backward probabilities of the pairs both carrying the major
+        # allele at site l + 1, as in `forward_ls_dip_sparse_step`.
+        num_major = n - (stop - start)
+        B_rows_sum = 0.0
+        B_rows_minor_sum = 0.0
+        for j in range(n):
+            B_rows_j = a * X_rows[j] + n * u[j] + u_sum + n * b
+            B_rows_sum += B_rows_j
+            if is_minor[j]:
+                B_rows_minor_sum += B_rows_j
+        B_minor_minor_sum = 0.0
+        EB_rows_minor_sum = 0.0
+        for k1 in range(start, stop):
+            j1 = minor_haps[k1]
+            EB_rows_minor_sum += EB_rows[j1]
+            for k2 in range(start, stop):
+                j2 = minor_haps[k2]
+                B_minor_minor_sum += a * X[j1, j2] + u[j1] + u[j2] + b
+        B_major_major_sum = max(
+            B_rows_sum - 2 * B_rows_minor_sum + B_minor_minor_sum, 0.0
+        )
+        B_major = (
+            no_change * emission_prob_major * B_major_major_sum
+            + j_change * 2 * num_major * (EB_sum - EB_rows_minor_sum)
+            + both_change * num_major**2 * EB_sum
+        ) / c[l + 1]
+        magnitude = a_new * X_abs_sum + 2 * n * core.sum_float64(u_new) + n**2 * b_new
+
+        if (
+            a_new < core.MIN_SPARSE_SCALE
+            or magnitude > core.MAX_SPARSE_CANCELLATION * B_major
+        ):
+            # Apply the transform to all the pairs.
+            for j1 in range(n):
+                for j2 in range(j1, n):
+                    if is_minor[j1] or is_minor[j2]:
+                        emission_prob = core.get_emission_probability_diploid(
+                            ref_genotype=core.get_phased_genotype(
+                                H[l + 1, j1], H[l + 1, j2]
+                            ),
+                            query_genotype=s[0, l + 1],
+                            site=l + 1,
+                            emission_matrix=e,
+                        )
+                    else:
+                        emission_prob = emission_prob_major
+                    B_j1_j2 = (
+                        no_change * emission_prob * (a * X[j1, j2] + u[j1] + u[j2] + b)
+                        + j_change * (EB_rows[j1] + EB_rows[j2])
+                        + both_change * EB_sum
+                    ) / c[l + 1]
+                    X[j1, j2] = B_j1_j2
+                    X[j2, j1] = B_j1_j2
+            a = 1.0
+            b = 0.0
+            u[:] = 0
+            for j in range(n):
+                X_rows[j] = core.sum_float64(X[j, :])
+            X_abs_sum = core.sum_float64(X_rows)
+            B[l, :, :] = X
+        else:
+            for k in range(start, stop):
+                j1 = minor_haps[k]
+                for j2 in range(n):
+                    if is_minor[j2] and j2 < j1:
+                        # The pair is updated from the row of j2.
+                        continue
+                    emission_prob = core.get_emission_probability_diploid(
+                        ref_genotype=core.get_phased_genotype(
+                            H[l + 1, j1], H[l + 1, j2]
+                        ),
+                        query_genotype=s[0, l + 1],
+                        site=l + 1,
+                        emission_matrix=e,
+                    )
+                    B_j1_j2 = (
+                        no_change * emission_prob * (a * X[j1, j2] + u[j1] + u[j2] + b)
+                        + j_change * (EB_rows[j1] + EB_rows[j2])
+                        + both_change * EB_sum
+                    ) / c[l + 1]
+                    X_j1_j2 = (B_j1_j2 - u_new[j1] - u_new[j2] - b_new) / a_new
+                    diff = X_j1_j2 - X[j1, j2]
+                    abs_diff = abs(X_j1_j2) - abs(X[j1, j2])
+                    X[j1, j2] = X_j1_j2
+                    X[j2, j1] = X_j1_j2
+                    X_rows[j1] += diff
+                    X_abs_sum += abs_diff
+                    if j1 != j2:
+                        X_rows[j2] += diff
+                        X_abs_sum += abs_diff
+                    B[l, j1, j2] = B_j1_j2
+                    B[l, j2, j1] = B_j1_j2
+            a = a_new
+            b = b_new
+            u[:] = u_new
+            for j1 in range(n):
+                if is_minor[j1]:
+                    continue
+                for j2 in range(n):
+                    if not is_minor[j2]:
+                        B[l, j1, j2] = a * X[j1, j2] + u[j1] + u[j2] + b
+
+        for k in range(start, stop):
+            is_minor[minor_haps[k]] = False
+
+    return B
+
+
+@jit.numba_njit
+def forward_ls_dip_sparse_batch(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Run the implementation updating only the rows and columns of the minor allele
+    carriers on a batch of queries.
+
+    The queries are an array of size (k, m), and the emission probability matrices
+    are an array of size (k, m, 8).
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    F = np.zeros((k, m, n, n), dtype=dtype)
+    c = np.zeros((k, m))
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    for q in range(k):
+        F_q, c_q, ll_q = forward_ls_dip_sparse(
+            n,
+            m,
+            H,
+            s[q : q + 1, :],
+            e[q],
+            r,
+            major_alleles,
+            minor_offsets,
+            minor_haps,
+            num_copiable_entries,
+            dtype,
+        )
+        F[q] = F_q
+        c[q] = c_q
+        ll[q] = ll_q
+    return F, c, ll
+
+
+@jit.numba_njit
+def backward_ls_dip_sparse_batch(
+    n,
+    m,
+    H,
+    s,
+    e,
+    c,
+    r,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Run the implementation updating only the rows and columns of the minor allele
+    carriers on a batch of queries.
+
+    The queries are an array of size (k, m), the emission probability matrices
+    are an array of size (k, m, 8), and the normalisation factors from the forwards
+    pass are an array of size (k, m).
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    B = np.zeros((k, m, n, n), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    for q in range(k):
+        B[q] = backward_ls_dip_sparse(
+            n,
+            m,
+            H,
+            s[q : q + 1, :],
+            e[q],
+            c[q],
+            r,
+            major_alleles,
+            minor_offsets,
+            minor_haps,
+            num_copiable_entries,
+            dtype,
+        )
+    return B
+
+
+@jit.numba_njit
+def forward_ls_dip_sparse_loglik_batch(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    num_copiable_entries=None,
+):
+    """
+    Compute the normalisation factors and log-likelihoods for a batch of queries,
+    updating only the rows and columns of the minor allele carriers.
+
+    The queries are an array of size (k, m), and the emission probability matrices
+    are an array of size (k, m, 8).
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    c = np.zeros((k, m))
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    for q in range(k):
+        c_q, ll_q = forward_ls_dip_sparse_loglik(
+            n,
+            m,
+            H,
+            s[q : q + 1, :],
+            e[q],
+            r,
+            major_alleles,
+            minor_offsets,
+            minor_haps,
+            num_copiable_entries,
+        )
+        c[q] = c_q
+        ll[q] = ll_q
+    return c, ll
@@ -16,53 +16,73 @@ def forwards_ls_hap(
     r,
     emission_func,
     norm=True,
+    num_copiable_entries=None,
+    dtype=np.float64,
+    rescale_threshold=np.inf,
 ):
     """
     A matrix-based implementation using Numpy.
 
+    If norm is True, the forward probabilities at a site are only rescaled if their
+    sum is below rescale_threshold, or at the last site, and the normalisation factor
+    is 1 at the other sites. By default, they are rescaled at every site.
+
     This is exposed via the API.
     """
-    F = np.zeros((m, n))
-    num_copiable_entries = core.get_num_copiable_entries(H)
+    F = np.zeros((m, n), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
     r_n = r / num_copiable_entries
 
     if norm:
-        c = np.zeros(m)
+        c = np.ones(m)
+        F_sum = 0.0
         for i in range(n):
-            emission_prob = emission_func(
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
                 ref_allele=H[0, i],
                 query_allele=s[0, 0],
                 site=0,
                 emission_matrix=e,
             )
             F[0, i] = 1 / n * emission_prob
-            c[0] += F[0, i]
+            F_sum += F[0, i]
 
-        for i in range(n):
-            F[0, i] *= 1 / c[0]
+        if F_sum < rescale_threshold or m == 1:
+            c[0] = F_sum
+            for i in range(n):
+                F[0, i] *= 1 / c[0]
+            F_sum = 1.0
 
         # Forwards pass
         for l in range(1, m):
+            F_sum_prev = F_sum
+            F_sum = 0.0
             for i in range(n):
-                F[l, i] = F[l - 1, i] * (1 - r[l]) + r_n[l]
-                emission_prob = emission_func(
+                F[l, i] = F[l - 1, i] * (1 - r[l]) + F_sum_prev * r_n[l]
+                emission_prob = core.lookup_emission_probability_haploid(
+                    emission_func,
                     ref_allele=H[l, i],
                     query_allele=s[0, l],
                     site=l,
                     emission_matrix=e,
                 )
                 F[l, i] *= emission_prob
-                c[l] += F[l, i]
+                F_sum += F[l, i]
 
-            for i in range(n):
-                F[l, i] *= 1 / c[l]
+            if F_sum < rescale_threshold or l == m - 1:
+                c[l] = F_sum
+                for i in range(n):
+                    F[l, i] *= 1 / c[l]
+                F_sum = 1.0
 
         ll = np.sum(np.log10(c))
 
     else:
         c = np.ones(m)
         for i in range(n):
-            emission_prob = emission_func(
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
                 ref_allele=H[0, i],
                 query_allele=s[0, 0],
                 site=0,
@@ -72,9 +92,12 @@ def forwards_ls_hap(
 
         # Forwards pass
         for l in range(1, m):
+            # The sum over the previous site is the same for all the haplotypes.
+            F_sum = core.sum_float64(F[l - 1, :])
             for i in range(n):
-                F[l, i] = F[l - 1, i] * (1 - r[l]) + np.sum(F[l - 1, :]) * r_n[l]
-                emission_prob = emission_func(
+                F[l, i] = F[l - 1, i] * (1 - r[l]) + F_sum * r_n[l]
+                emission_prob = core.lookup_emission_probability_haploid(
+                    emission_func,
                     ref_allele=H[l, i],
                     query_allele=s[0, l],
                     site=l,
@@ -82,7 +105,7 @@ def forwards_ls_hap(
                 )
                 F[l, i] *= emission_prob
 
-        ll = np.log10(np.sum(F[m - 1, :]))
+        ll = np.log10(core.sum_float64(F[m - 1, :]))
 
     return F, c, ll
 
@@ -97,16 +120,19 @@ def backwards_ls_hap(
     c,
     r,
     emission_func,
+    num_copiable_entries=None,
+    dtype=np.float64,
 ):
     """
     A matrix-based implementation using Numpy.
 
     This is exposed via the API.
     """
-    B = np.zeros((m, n))
+    B = np.zeros((m, n), dtype=dtype)
     for i in range(n):
         B[m - 1, i] = 1
-    num_copiable_entries = core.get_num_copiable_entries(H)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
     r_n = r / num_copiable_entries
 
     # Backwards pass
@@ -114,7 +140,8 @@ def backwards_ls_hap(
         tmp_B = np.zeros(n)
         tmp_B_sum = 0
         for i in range(n):
-            emission_prob = emission_func(
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
                 ref_allele=H[l + 1, i],
                 query_allele=s[0, l + 1],
                 site=l + 1,
@@ -128,3 +155,1365 @@ def backwards_ls_hap(
             B[l, i] *= 1 / c[l + 1]
 
     return B
+
+
+@jit.numba_njit(parallel=True)
+def forwards_ls_hap_parallel_step(
+    n, l, H, s, e, r, r_n, emission_func, F, F_sum, block_size, F_block_sums
+):
+    """
+    Compute the forward probabilities at site l from those at site l - 1, whose sum
+    is F_sum (or initialise them at site 0), updating the blocks of haplotypes
+    in parallel. The sums over the blocks are written to F_block_sums.
+    """
+    for b in jit.prange(len(F_block_sums)):
+        F_block_sums[b] = 0.0
+        for i in range(b * block_size, min((b + 1) * block_size, n)):
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
+                ref_allele=H[l, i],
+                query_allele=s[0, l],
+                site=l,
+                emission_matrix=e,
+            )
+            if l == 0:
+                F[0, i] = 1 / n * emission_prob
+            else:
+                F[l, i] = F[l - 1, i] * (1 - r[l]) + F_sum * r_n[l]
+                F[l, i] *= emission_prob
+            F_block_sums[b] += F[l, i]
+
+
+@jit.starts_threads
+@jit.numba_njit
+def forwards_ls_hap_parallel(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    norm=True,
+    num_copiable_entries=None,
+    dtype=np.float64,
+    rescale_threshold=np.inf,
+    block_size=core.PARALLEL_BLOCK_SIZE,
+):
+    """
+    A parallel implementation, in which the haplotypes are split into blocks
+    of size block_size, which are updated by different threads at each site.
+
+    The sum of the forward probabilities at a site is computed from the sums
+    over the blocks, and the forward probabilities are rescaled as in
+    `forwards_ls_hap`.
+
+    This is exposed via the API.
+    """
+    F = np.zeros((m, n), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r / num_copiable_entries
+    F_block_sums = np.zeros((n + block_size - 1) // block_size)
+
+    c = np.ones(m)
+    F_sum = 0.0
+    for l in range(m):
+        forwards_ls_hap_parallel_step(
+            n, l, H, s, e, r, r_n, emission_func, F, F_sum, block_size, F_block_sums
+        )
+        F_sum = core.sum_float64(F_block_sums)
+
+        if norm and (F_sum < rescale_threshold or l == m - 1):
+            c[l] = F_sum
+            core.scale_parallel(F[l, :], 1 / c[l], block_size)
+            F_sum = 1.0
+
+    if norm:
+        ll = np.sum(np.log10(c))
+    else:
+        ll = np.log10(F_sum)
+
+    return F, c, ll
+
+
+@jit.numba_njit(parallel=True)
+def backwards_ls_hap_parallel_step(
+    n, l, H, s, e, emission_func, B, tmp_B, block_size, tmp_B_block_sums
+):
+    """
+    Multiply the backward probabilities at site l + 1 by the emission probabilities,
+    updating the blocks of haplotypes in parallel. The products are written
+    to tmp_B, and the sums over the blocks to tmp_B_block_sums.
+    """
+    for b in jit.prange(len(tmp_B_block_sums)):
+        tmp_B_block_sums[b] = 0.0
+        for i in range(b * block_size, min((b + 1) * block_size, n)):
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
+                ref_allele=H[l + 1, i],
+                query_allele=s[0, l + 1],
+                site=l + 1,
+                emission_matrix=e,
+            )
+            tmp_B[i] = emission_prob * B[l + 1, i]
+            tmp_B_block_sums[b] += tmp_B[i]
+
+
+@jit.numba_njit(parallel=True)
+def backwards_ls_hap_parallel_update(n, l, c, r, r_n, B, tmp_B, tmp_B_sum, block_size):
+    """Compute the backward probabilities at site l, updating the blocks in parallel."""
+    num_blocks = (n + block_size - 1) // block_size
+    for b in jit.prange(num_blocks):
+        for i in range(b * block_size, min((b + 1) * block_size, n)):
+            B[l, i] = r_n[l + 1] * tmp_B_sum
+            B[l, i] += (1 - r[l + 1]) * tmp_B[i]
+            B[l, i] *= 1 / c[l + 1]
+
+
+@jit.starts_threads
+@jit.numba_njit
+def backwards_ls_hap_parallel(
+    n,
+    m,
+    H,
+    s,
+    e,
+    c,
+    r,
+    emission_func,
+    num_copiable_entries=None,
+    dtype=np.float64,
+    block_size=core.PARALLEL_BLOCK_SIZE,
+):
+    """
+    A parallel implementation, in which the haplotypes are split into blocks
+    as in `forwards_ls_hap_parallel`.
+
+    This is exposed via the API.
+    """
+    B = np.zeros((m, n), dtype=dtype)
+    B[m - 1, :] = 1
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r / num_copiable_entries
+    tmp_B = np.zeros(n)
+    tmp_B_block_sums = np.zeros((n + block_size - 1) // block_size)
+
+    # Backwards pass
+    for l in range(m - 2, -1, -1):
+        backwards_ls_hap_parallel_step(
+            n, l, H, s, e, emission_func, B, tmp_B, block_size, tmp_B_block_sums
+        )
+        tmp_B_sum = core.sum_float64(tmp_B_block_sums)
+        backwards_ls_hap_parallel_update(
+            n, l, c, r, r_n, B, tmp_B, tmp_B_sum, block_size
+        )
+
+    return B
+
+
+@jit.numba_njit
+def forwards_ls_hap_batch(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    norm=True,
+    num_copiable_entries=None,
+    dtype=np.float64,
+    rescale_threshold=np.inf,
+):
+    """
+    A matrix-based implementation for a batch of queries.
+
+    The queries are an array of size (k, m), and the emission probability matrices
+    are an array of size (k, m, 2). Each site of the reference panel is swept once
+    for all the k queries. The forward probabilities are rescaled as in
+    `forwards_ls_hap`.
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    F = np.zeros((k, m, n), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r / num_copiable_entries
+
+    for q in range(k):
+        for i in range(n):
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
+                ref_allele=H[0, i],
+                query_allele=s[q, 0],
+                site=0,
+                emission_matrix=e[q],
+            )
+            F[q, 0, i] = 1 / n * emission_prob
+
+    if norm:
+        c = np.ones((k, m))
+        F_sums = np.zeros(k)
+        for q in range(k):
+            F_sums[q] = core.sum_float64(F[q, 0, :])
+            if F_sums[q] < rescale_threshold or m == 1:
+                c[q, 0] = F_sums[q]
+                F[q, 0, :] *= 1 / c[q, 0]
+                F_sums[q] = 1.0
+
+        # Forwards pass
+        for l in range(1, m):
+            for q in range(k):
+                F_sum_prev = F_sums[q]
+                F_sum = 0.0
+                for i in range(n):
+                    F[q, l, i] = F[q, l - 1, i] * (1 - r[l]) + F_sum_prev * r_n[l]
+                    emission_prob = core.lookup_emission_probability_haploid(
+                        emission_func,
+                        ref_allele=H[l, i],
+                        query_allele=s[q, l],
+                        site=l,
+                        emission_matrix=e[q],
+                    )
+                    F[q, l, i] *= emission_prob
+                    F_sum += F[q, l, i]
+
+                if F_sum < rescale_threshold or l == m - 1:
+                    c[q, l] = F_sum
+                    for i in range(n):
+                        F[q, l, i] *= 1 / c[q, l]
+                    F_sum = 1.0
+                F_sums[q] = F_sum
+
+        ll = np.zeros(k)
+        for q in range(k):
+            ll[q] = np.sum(np.log10(c[q, :]))
+
+    else:
+        c = np.ones((k, m))
+
+        # Forwards pass
+        for l in range(1, m):
+            for q in range(k):
+                F_sum = core.sum_float64(F[q, l - 1, :])
+                for i in range(n):
+                    F[q, l, i] = F[q, l - 1, i] * (1 - r[l]) + F_sum * r_n[l]
+                    emission_prob = core.lookup_emission_probability_haploid(
+                        emission_func,
+                        ref_allele=H[l, i],
+                        query_allele=s[q, l],
+                        site=l,
+                        emission_matrix=e[q],
+                    )
+                    F[q, l, i] *= emission_prob
+
+        ll = np.zeros(k)
+        for q in range(k):
+            ll[q] = np.log10(core.sum_float64(F[q, m - 1, :]))
+
+    return F, c, ll
+
+
+@jit.numba_njit
+def backwards_ls_hap_batch(
+    n,
+    m,
+    H,
+    s,
+    e,
+    c,
+    r,
+    emission_func,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    A matrix-based implementation for a batch of queries.
+
+    The queries are an array of size (k, m), the emission probability matrices
+    are an array of size (k, m, 2), and the normalisation factors from the forwards
+    pass are an array of size (k, m).
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    B = np.zeros((k, m, n), dtype=dtype)
+    B[:, m - 1, :] = 1
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r / num_copiable_entries
+
+    # Backwards pass
+    tmp_B = np.zeros(n)
+    for l in range(m - 2, -1, -1):
+        for q in range(k):
+            tmp_B_sum = 0
+            for i in range(n):
+                emission_prob = core.lookup_emission_probability_haploid(
+                    emission_func,
+                    ref_allele=H[l + 1, i],
+                    query_allele=s[q, l + 1],
+                    site=l + 1,
+                    emission_matrix=e[q],
+                )
+                tmp_B[i] = emission_prob * B[q, l + 1, i]
+                tmp_B_sum += tmp_B[i]
+            for i in range(n):
+                B[q, l, i] = r_n[l + 1] * tmp_B_sum
+                B[q, l, i] += (1 - r[l + 1]) * tmp_B[i]
+                B[q, l, i] *= 1 / c[q, l + 1]
+
+    return B
+
+
+@jit.numba_njit
+def posteriors_ls_hap(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the posterior probabilities of the copying states at each site.
+
+    The normalised forward probabilities are computed first, and the backward
+    probabilities are then computed one site at a time, overwriting the forward
+    probabilities with the posterior probabilities. Only a single vector of
+    backward probabilities is held in memory.
+
+    This is exposed via the API.
+    """
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    P, c, ll = forwards_ls_hap(
+        n, m, H, s, e, r, emission_func, True, num_copiable_entries, dtype
+    )
+    r_n = r / num_copiable_entries
+
+    B = np.ones(n, dtype=dtype)
+    tmp_B = np.zeros(n)
+    for l in range(m - 2, -1, -1):
+        tmp_B_sum = 0
+        for i in range(n):
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
+                ref_allele=H[l + 1, i],
+                query_allele=s[0, l + 1],
+                site=l + 1,
+                emission_matrix=e,
+            )
+            tmp_B[i] = emission_prob * B[i]
+            tmp_B_sum += tmp_B[i]
+        for i in range(n):
+            B[i] = r_n[l + 1] * tmp_B_sum
+            B[i] += (1 - r[l + 1]) * tmp_B[i]
+            B[i] *= 1 / c[l + 1]
+            P[l, i] *= B[i]
+
+    return P, ll
+
+
+@jit.numba_njit
+def posteriors_ls_hap_batch(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the posterior probabilities of the copying states for a batch of queries.
+
+    The queries are an array of size (k, m), and the emission probability matrices
+    are an array of size (k, m, 2).
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    P = np.zeros((k, m, n), dtype=dtype)
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    for q in range(k):
+        P_q, ll_q = posteriors_ls_hap(
+            n,
+            m,
+            H,
+            s[q : q + 1, :],
+            e[q],
+            r,
+            emission_func,
+            num_copiable_entries,
+            dtype,
+        )
+        P[q] = P_q
+        ll[q] = ll_q
+    return P, ll
+
+
+@jit.numba_njit
+def forwards_ls_hap_segment(
+    n,
+    H,
+    s,
+    e,
+    c,
+    r,
+    emission_func,
+    F_prev,
+    start,
+    stop,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the normalised forward probabilities at the sites from start to stop - 1.
+
+    The forward probabilities at site start - 1 are given in F_prev, which is ignored
+    if start is 0. The normalisation factors at the sites are written into c,
+    which is of size stop - start. Only the sites of the segment are read, so that
+    the cost of recomputing a segment does not depend on the number of sites.
+    """
+    F = np.zeros((stop - start, n), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r[start:stop] / num_copiable_entries[start:stop]
+
+    for l in range(start, stop):
+        row = l - start
+        F_before = F_prev if l == start else F[row - 1]
+        c[row] = 0
+        for i in range(n):
+            if l == 0:
+                F[row, i] = 1 / n
+            else:
+                F[row, i] = F_before[i] * (1 - r[l]) + r_n[row]
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
+                ref_allele=H[l, i],
+                query_allele=s[0, l],
+                site=l,
+                emission_matrix=e,
+            )
+            F[row, i] *= emission_prob
+            c[row] += F[row, i]
+
+        for i in range(n):
+            F[row, i] *= 1 / c[row]
+
+    return F
+
+
+@jit.numba_njit
+def forwards_ls_hap_checkpoint(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    interval,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the normalised forward probabilities, keeping only checkpoints.
+
+    The sites are split into segments of `interval` sites. Checkpoint j holds the
+    forward probabilities at the site before the start of segment j, from which
+    the segment can be recomputed using `forwards_ls_hap_segment`.
+    The checkpoint of the first segment is unused.
+    """
+    num_segments = (m + interval - 1) // interval
+    checkpoints = np.zeros((num_segments, n), dtype=dtype)
+    c = np.zeros(m)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+
+    for j in range(num_segments):
+        start = j * interval
+        stop = min(start + interval, m)
+        F = forwards_ls_hap_segment(
+            n,
+            H,
+            s,
+            e,
+            c[start:stop],
+            r,
+            emission_func,
+            checkpoints[j],
+            start,
+            stop,
+            num_copiable_entries,
+            dtype,
+        )
+        if j + 1 < num_segments:
+            checkpoints[j + 1, :] = F[stop - start - 1]
+
+    ll = np.sum(np.log10(c))
+
+    return checkpoints, c, ll
+
+
+@jit.numba_njit
+def backwards_ls_hap_segment(
+    n,
+    m,
+    H,
+    s,
+    e,
+    c,
+    r,
+    emission_func,
+    B_next,
+    start,
+    stop,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the backward probabilities at the sites from start to stop - 1.
+
+    The backward probabilities at site stop are given in B_next, which is ignored
+    if stop is m. Only the sites of the segment and site stop are read.
+    """
+    B = np.zeros((stop - start, n), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    # The recombination probabilities from site start + row to site start + row + 1.
+    r_n = r[start + 1 : stop + 1] / num_copiable_entries[start + 1 : stop + 1]
+
+    tmp_B = np.zeros(n)
+    for l in range(stop - 1, start - 1, -1):
+        row = l - start
+        if l == m - 1:
+            B[row, :] = 1
+            continue
+        B_after = B_next if l == stop - 1 else B[row + 1]
+        tmp_B_sum = 0
+        for i in range(n):
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
+                ref_allele=H[l + 1, i],
+                query_allele=s[0, l + 1],
+                site=l + 1,
+                emission_matrix=e,
+            )
+            tmp_B[i] = emission_prob * B_after[i]
+            tmp_B_sum += tmp_B[i]
+        for i in range(n):
+            B[row, i] = r_n[row] * tmp_B_sum
+            B[row, i] += (1 - r[l + 1]) * tmp_B[i]
+            B[row, i] *= 1 / c[l + 1]
+
+    return B
+
+
+@jit.numba_njit
+def backwards_ls_hap_checkpoint(
+    n,
+    m,
+    H,
+    s,
+    e,
+    c,
+    r,
+    emission_func,
+    interval,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the backward probabilities, keeping only checkpoints.
+
+    The sites are split into segments of `interval` sites. Checkpoint j holds the
+    backward probabilities at the site after the end of segment j, from which
+    the segment can be recomputed using `backwards_ls_hap_segment`.
+    The checkpoint of the last segment is unused.
+    """
+    num_segments = (m + interval - 1) // interval
+    checkpoints = np.zeros((num_segments, n), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+
+    for j in range(num_segments - 1, -1, -1):
+        start = j * interval
+        stop = min(start + interval, m)
+        B = backwards_ls_hap_segment(
+            n,
+            m,
+            H,
+            s,
+            e,
+            c,
+            r,
+            emission_func,
+            checkpoints[j],
+            start,
+            stop,
+            num_copiable_entries,
+            dtype,
+        )
+        if j > 0:
+            checkpoints[j - 1, :] = B[0]
+
+    return checkpoints
+
+
+@jit.numba_njit
+def forwards_ls_hap_loglik(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the normalisation factors and log-likelihood of the forwards algorithm.
+
+    Only the forward probabilities at the current site are held in memory.
+
+    This is exposed via the API.
+    """
+    F = np.zeros(n, dtype=dtype)
+    c = np.zeros(m)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r / num_copiable_entries
+
+    for l in range(m):
+        for i in range(n):
+            if l == 0:
+                F[i] = 1 / n
+            else:
+                F[i] = F[i] * (1 - r[l]) + r_n[l]
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
+                ref_allele=H[l, i],
+                query_allele=s[0, l],
+                site=l,
+                emission_matrix=e,
+            )
+            F[i] *= emission_prob
+            c[l] += F[i]
+
+        for i in range(n):
+            F[i] *= 1 / c[l]
+
+    ll = np.sum(np.log10(c))
+
+    return c, ll
+
+
+@jit.numba_njit
+def forwards_ls_hap_loglik_batch(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the normalisation factors and log-likelihoods for a batch of queries.
+
+    The queries are an array of size (k, m), and the emission probability matrices
+    are an array of size (k, m, 2).
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    c = np.zeros((k, m))
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    for q in range(k):
+        c_q, ll_q = forwards_ls_hap_loglik(
+            n,
+            m,
+            H,
+            s[q : q + 1, :],
+            e[q],
+            r,
+            emission_func,
+            num_copiable_entries,
+            dtype,
+        )
+        c[q] = c_q
+        ll[q] = ll_q
+    return c, ll
+
+
+@jit.numba_njit
+def forwards_ls_hap_log(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the unnormalised forward probabilities in log space (base 10).
+
+    The sum over the previous site is computed by log-sum-exp relative to the maximum
+    at the previous site, so the forward probabilities do not underflow for long queries.
+
+    This is exposed via the API.
+    """
+    logF = np.zeros((m, n), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r / num_copiable_entries
+
+    for i in range(n):
+        emission_prob = core.lookup_emission_probability_haploid(
+            emission_func,
+            ref_allele=H[0, i],
+            query_allele=s[0, 0],
+            site=0,
+            emission_matrix=e,
+        )
+        logF[0, i] = np.log10(1 / n * emission_prob)
+
+    # Forwards pass
+    scaled_F = np.zeros(n)
+    for l in range(1, m):
+        max_logF = np.max(logF[l - 1, :])
+        F_sum = 0.0
+        for i in range(n):
+            scaled_F[i] = 10 ** (logF[l - 1, i] - max_logF)
+            F_sum += scaled_F[i]
+        for i in range(n):
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
+                ref_allele=H[l, i],
+                query_allele=s[0, l],
+                site=l,
+                emission_matrix=e,
+            )
+            logF[l, i] = (
+                max_logF
+                + np.log10(scaled_F[i] * (1 - r[l]) + F_sum * r_n[l])
+                + np.log10(emission_prob)
+            )
+
+    max_logF = np.max(logF[m - 1, :])
+    ll = max_logF + np.log10(core.sum_float64(10 ** (logF[m - 1, :] - max_logF)))
+
+    return logF, ll
+
+
+@jit.numba_njit
+def forwards_ls_hap_log_batch(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the unnormalised forward probabilities in log space for a batch of queries.
+
+    The queries are an array of size (k, m), and the emission probability matrices
+    are an array of size (k, m, 2).
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    logF = np.zeros((k, m, n), dtype=dtype)
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    for q in range(k):
+        logF_q, ll_q = forwards_ls_hap_log(
+            n,
+            m,
+            H,
+            s[q : q + 1, :],
+            e[q],
+            r,
+            emission_func,
+            num_copiable_entries,
+            dtype,
+        )
+        logF[q] = logF_q
+        ll[q] = ll_q
+    return logF, ll
+
+
+@jit.numba_njit
+def forwards_ls_hap_sparse_step(
+    n,
+    l,
+    H,
+    s,
+    e,
+    r,
+    r_n,
+    emission_func,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    X,
+    a,
+    b,
+    X_sum,
+    F_row,
+    materialise,
+):
+    """
+    Move the lazily transformed forward probabilities from site l - 1 to site l.
+
+    The forward probability of haplotype i is a * X[i] + b. Only the haplotypes
+    that do not carry the major allele at site l are updated. If materialise is
+    True, then the normalised forward probabilities at site l are written to F_row.
+
+    Return the updated a, b, X_sum, and the normalisation factor at site l.
+    """
+    start = minor_offsets[l]
+    stop = minor_offsets[l + 1]
+    emission_prob_major = core.lookup_emission_probability_haploid(
+        emission_func,
+        ref_allele=major_alleles[l],
+        query_allele=s[0, l],
+        site=l,
+        emission_matrix=e,
+    )
+    a_new = emission_prob_major * (1 - r[l]) * a
+    b_new = emission_prob_major * ((1 - r[l]) * b + r_n[l])
+
+    if a_new < core.MIN_SPARSE_SCALE:
+        # Apply the transform to all the haplotypes.
+        k = start
+        for i in range(n):
+            if k < stop and minor_haps[k] == i:
+                emission_prob = core.lookup_emission_probability_haploid(
+                    emission_func,
+                    ref_allele=H[l, i],
+                    query_allele=s[0, l],
+                    site=l,
+                    emission_matrix=e,
+                )
+                k += 1
+            else:
+                emission_prob = emission_prob_major
+            X[i] = ((a * X[i] + b) * (1 - r[l]) + r_n[l]) * emission_prob
+        a_new = 1.0
+        b_new = 0.0
+        X_sum = core.sum_float64(X)
+        c = X_sum
+        if materialise:
+            for i in range(n):
+                F_row[i] = X[i] / c
+    else:
+        for k in range(start, stop):
+            i = minor_haps[k]
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
+                ref_allele=H[l, i],
+                query_allele=s[0, l],
+                site=l,
+                emission_matrix=e,
+            )
+            F_i = ((a * X[i] + b) * (1 - r[l]) + r_n[l]) * emission_prob
+            X_i = (F_i - b_new) / a_new
+            X_sum += X_i - X[i]
+            X[i] = X_i
+            if materialise:
+                F_row[i] = F_i
+        c = a_new * X_sum + n * b_new
+        if materialise:
+            # The minor allele carriers are set exactly, e.g. to keep zeros.
+            k = start
+            for i in range(n):
+                if k < stop and minor_haps[k] == i:
+                    F_row[i] *= 1 / c
+                    k += 1
+                else:
+                    F_row[i] = (a_new * X[i] + b_new) / c
+
+    return a_new / c, b_new / c, X_sum, c
+
+
+@jit.numba_njit
+def forwards_ls_hap_sparse(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the normalised forward probabilities, updating only the minor allele carriers.
+
+    The forward probabilities are held as a global affine transform of the values
+    in X, so that the haplotypes carrying the major allele at a site are updated
+    in constant time. The per-site index of the minor allele carriers is given
+    by core.get_minor_allele_index.
+
+    This is exposed via the API.
+    """
+    F = np.zeros((m, n), dtype=dtype)
+    c = np.zeros(m)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r / num_copiable_entries
+
+    X = np.zeros(n)
+    for i in range(n):
+        emission_prob = core.lookup_emission_probability_haploid(
+            emission_func,
+            ref_allele=H[0, i],
+            query_allele=s[0, 0],
+            site=0,
+            emission_matrix=e,
+        )
+        X[i] = 1 / n * emission_prob
+    X_sum = core.sum_float64(X)
+    c[0] = X_sum
+    for i in range(n):
+        F[0, i] = X[i] / c[0]
+    a = 1 / c[0]
+    b = 0.0
+
+    F_row = np.zeros(n)
+    for l in range(1, m):
+        a, b, X_sum, c_l = forwards_ls_hap_sparse_step(
+            n,
+            l,
+            H,
+            s,
+            e,
+            r,
+            r_n,
+            emission_func,
+            major_alleles,
+            minor_offsets,
+            minor_haps,
+            X,
+            a,
+            b,
+            X_sum,
+            F_row,
+            True,
+        )
+        c[l] = c_l
+        F[l, :] = F_row
+
+    ll = np.sum(np.log10(c))
+
+    return F, c, ll
+
+
+@jit.numba_njit
+def forwards_ls_hap_sparse_loglik(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    num_copiable_entries=None,
+):
+    """
+    Compute the normalisation factors and log-likelihood, updating only the minor allele carriers.
+
+    Apart from the first site, the cost per site is proportional to the number of
+    minor allele carriers.
+
+    This is exposed via the API.
+    """
+    c = np.zeros(m)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r / num_copiable_entries
+
+    X = np.zeros(n)
+    for i in range(n):
+        emission_prob = core.lookup_emission_probability_haploid(
+            emission_func,
+            ref_allele=H[0, i],
+            query_allele=s[0, 0],
+            site=0,
+            emission_matrix=e,
+        )
+        X[i] = 1 / n * emission_prob
+    X_sum = core.sum_float64(X)
+    c[0] = X_sum
+    a = 1 / c[0]
+    b = 0.0
+
+    F_row = np.zeros(0)
+    for l in range(1, m):
+        a, b, X_sum, c_l = forwards_ls_hap_sparse_step(
+            n,
+            l,
+            H,
+            s,
+            e,
+            r,
+            r_n,
+            emission_func,
+            major_alleles,
+            minor_offsets,
+            minor_haps,
+            X,
+            a,
+            b,
+            X_sum,
+            F_row,
+            False,
+        )
+        c[l] = c_l
+
+    ll = np.sum(np.log10(c))
+
+    return c, ll
+
+
+@jit.numba_njit
+def backwards_ls_hap_sparse_step(
+    n,
+    l,
+    H,
+    s,
+    e,
+    c,
+    r,
+    r_n,
+    emission_func,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    X,
+    a,
+    b,
+    X_sum,
+    B_row,
+):
+    """
+    Move the lazily transformed backward probabilities from site l + 1 to site l.
+
+    The backward probability of haplotype i is a * X[i] + b. Only the haplotypes
+    that do not carry the major allele at site l + 1 are updated, and the backward
+    probabilities at site l are written to B_row.
+
+    Return the updated a, b, and X_sum.
+    """
+    start = minor_offsets[l + 1]
+    stop = minor_offsets[l + 2]
+    emission_prob_major = core.lookup_emission_probability_haploid(
+        emission_func,
+        ref_allele=major_alleles[l + 1],
+        query_allele=s[0, l + 1],
+        site=l + 1,
+        emission_matrix=e,
+    )
+
+    # Sum of the emission probabilities times the backward probabilities at site l + 1.
+    B_sum = emission_prob_major * (a * X_sum + n * b)
+    for k in range(start, stop):
+        i = minor_haps[k]
+        emission_prob = core.lookup_emission_probability_haploid(
+            emission_func,
+            ref_allele=H[l + 1, i],
+            query_allele=s[0, l + 1],
+            site=l + 1,
+            emission_matrix=e,
+        )
+        B_sum += (emission_prob - emission_prob_major) * (a * X[i] + b)
+
+    a_new = emission_prob_major * (1 - r[l + 1]) * a / c[l + 1]
+    b_new = (emission_prob_major * (1 - r[l + 1]) * b + r_n[l + 1] * B_sum) / c[l + 1]
+
+    if a_new < core.MIN_SPARSE_SCALE:
+        # Apply the transform to all the haplotypes.
+        k = start
+        for i in range(n):
+            if k < stop and minor_haps[k] == i:
+                emission_prob = core.lookup_emission_probability_haploid(
+                    emission_func,
+                    ref_allele=H[l + 1, i],
+                    query_allele=s[0, l + 1],
+                    site=l + 1,
+                    emission_matrix=e,
+                )
+                k += 1
+            else:
+                emission_prob = emission_prob_major
+            X[i] = (
+                emission_prob * (1 - r[l + 1]) * (a * X[i] + b) + r_n[l + 1] * B_sum
+            ) / c[l + 1]
+            B_row[i] = X[i]
+        a_new = 1.0
+        b_new = 0.0
+        X_sum = core.sum_float64(X)
+    else:
+        for k in range(start, stop):
+            i = minor_haps[k]
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
+                ref_allele=H[l + 1, i],
+                query_allele=s[0, l + 1],
+                site=l + 1,
+                emission_matrix=e,
+            )
+            B_i = (
+                emission_prob * (1 - r[l + 1]) * (a * X[i] + b) + r_n[l + 1] * B_sum
+            ) / c[l + 1]
+            X_i = (B_i - b_new) / a_new
+            X_sum += X_i - X[i]
+            X[i] = X_i
+            B_row[i] = B_i
+        k = start
+        for i in range(n):
+            if k < stop and minor_haps[k] == i:
+                k += 1
+            else:
+                B_row[i] = a_new * X[i] + b_new
+
+    return a_new, b_new, X_sum
+
+
+@jit.numba_njit
+def backwards_ls_hap_sparse(
+    n,
+    m,
+    H,
+    s,
+    e,
+    c,
+    r,
+    emission_func,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the scaled backward probabilities, updating only the minor allele carriers.
+
+    The normalisation factors are those from the forwards algorithm. The backward
+    probabilities are held as a global affine transform, as in forwards_ls_hap_sparse.
+
+    This is exposed via the API.
+    """
+    B = np.zeros((m, n), dtype=dtype)
+    for i in range(n):
+        B[m - 1, i] = 1
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r / num_copiable_entries
+
+    X = np.ones(n)
+    X_sum = float(n)
+    a = 1.0
+    b = 0.0
+
+    B_row = np.zeros(n)
+    for l in range(m - 2, -1, -1):
+        a, b, X_sum = backwards_ls_hap_sparse_step(
+            n,
+            l,
+            H,
+            s,
+            e,
+            c,
+            r,
+            r_n,
+            emission_func,
+            major_alleles,
+            minor_offsets,
+            minor_haps,
+            X,
+            a,
+            b,
+            X_sum,
+            B_row,
+        )
+        B[l, :] = B_row
+
+    return B
+
+
+@jit.numba_njit
+def forwards_ls_hap_sparse_batch(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the normalised forward probabilities for a batch of queries, updating only the minor allele carriers.
+
+    The queries are an array of size (k, m), and the emission probability matrices
+    are an array of size (k, m, 2).
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    F = np.zeros((k, m, n), dtype=dtype)
+    c = np.zeros((k, m))
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    for q in range(k):
+        F_q, c_q, ll_q = forwards_ls_hap_sparse(
+            n,
+            m,
+            H,
+            s[q : q + 1, :],
+            e[q],
+            r,
+            emission_func,
+            major_alleles,
+            minor_offsets,
+            minor_haps,
+            num_copiable_entries,
+            dtype,
+        )
+        F[q] = F_q
+        c[q] = c_q
+        ll[q] = ll_q
+    return F, c, ll
+
+
+@jit.numba_njit
+def backwards_ls_hap_sparse_batch(
+    n,
+    m,
+    H,
+    s,
+    e,
+    c,
+    r,
+    emission_func,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Compute the scaled backward probabilities for a batch of queries, updating only the minor allele carriers.
+
+    The queries are an array of size (k, m), the emission probability matrices are
+    an array of size (k, m, 2), and the normalisation factors are an array of size (k, m).
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    B = np.zeros((k, m, n), dtype=dtype)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    for q in range(k):
+        B[q] = backwards_ls_hap_sparse(
+            n,
+            m,
+            H,
+            s[q : q + 1, :],
+            e[q],
+            c[q],
+            r,
+            emission_func,
+            major_alleles,
+            minor_offsets,
+            minor_haps,
+            num_copiable_entries,
+            dtype,
+        )
+    return B
+
+
+@jit.numba_njit
+def forwards_ls_hap_sparse_loglik_batch(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    num_copiable_entries=None,
+):
+    """
+    Compute the normalisation factors and log-likelihoods for a batch of queries, updating only the minor allele carriers.
+
+    The queries are an array of size (k, m), and the emission probability matrices
+    are an array of size (k, m, 2).
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    c = np.zeros((k, m))
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    for q in range(k):
+        c_q, ll_q = forwards_ls_hap_sparse_loglik(
+            n,
+            m,
+            H,
+            s[q : q + 1, :],
+            e[q],
+            r,
+            emission_func,
+            major_alleles,
+            minor_offsets,
+            minor_haps,
+            num_copiable_entries,
+        )
+        c[q] = c_q
+        ll[q] = ll_q
+    return c, ll
@@ -1,3 +1,5 @@
+import contextlib
+import functools
 import logging
 import os
 
@@ -23,14 +25,84 @@ if not ENABLE_NUMBA:
     )
 
 
+# The kernels release the GIL, so that they can be run concurrently by threads.
 DEFAULT_NUMBA_ARGS = {
     "nopython": True,
+    "nogil": True,
     "cache": True,
 }
 
 
-def numba_njit(func, **kwargs):
+def numba_njit(func=None, **kwargs):
+    # Allow the decorator to be used with or without extra arguments, e.g.
+    # @numba_njit or @numba_njit(parallel=True).
+    if func is None:
+        return lambda f: numba_njit(f, **kwargs)
     if ENABLE_NUMBA:  # pragma: no cover
         return numba.jit(func, **{**DEFAULT_NUMBA_ARGS, **kwargs})
     else:
         return func
+
+
+# Behaves like range when numba is disabled.
+prange = numba.prange
+
+
+def starts_threads(func):
+    """
+    Start Numba's threads before each call of a compiled kernel that calls
+    parallel kernels, so that it can be called directly.
+
+    A cached kernel calling a parallel kernel crashes when loaded from the cache
+    unless the threads have been started. The threads are not started when
+    the kernels are compiled, so that importing lshmm does not start any threads,
+    which would make it unsafe to fork the process.
+    """
+    if not ENABLE_NUMBA:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        numba.get_num_threads()
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def limit_num_threads(num_threads):
+    """
+    Run the parallel kernels called within the context with at most num_threads threads
+    (and at most as many as Numba has started), or with the default number of threads
+    if num_threads is None.
+    """
+    if not ENABLE_NUMBA:
+        yield
+        return
+    # Getting the number of threads also starts them, as in `starts_threads`.
+    prev_num_threads = numba.get_num_threads()
+    if num_threads is None:
+        yield
+        return
+    numba.set_num_threads(min(num_threads, numba.config.NUMBA_NUM_THREADS))
+    try:
+        yield
+    finally:
+        numba.set_num_threads(prev_num_threads)
+
+
+def check_concurrent_parallel_kernels():
+    """
+    Raise a RuntimeError if the parallel kernels cannot be called concurrently
+    by several threads, which is the case with Numba's workqueue threading layer.
+    """
+    if not ENABLE_NUMBA:
+        return
+    # The threading layer is only chosen when the threads are started.
+    numba.get_num_threads()
+    if numba.threading_layer() == "workqueue":
+        err_msg = "The parallel kernels, which are used for batches of queries in "
+        err_msg += "viterbi and when num_threads is given, cannot be run concurrently "
+        err_msg += "with Numba's workqueue threading layer. Install tbb, or set "
+        err_msg += "NUMBA_THREADING_LAYER to 'omp' or 'tbb'."
+        raise RuntimeError(err_msg)
@@ -0,0 +1,298 @@
+"""
+A pool of worker processes to run the HMM algorithms on large batches of queries.
+
+The reference panel is put into shared memory once, and each worker process
+prepares it once, so that it is neither copied nor checked for each query.
+The queries of a batch and the outputs are also held in shared memory,
+and the workers are sent ranges of queries, whose outputs they write in place.
+
+Before any queries are sent to the workers, the first query is run by the main process,
+which compiles the kernels and writes them to the Numba cache, so that the workers
+load the compiled kernels rather than compiling them again.
+"""
+
+import concurrent.futures
+import multiprocessing
+import os
+import warnings
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import api
+
+# The state of a worker process, which is set up by `_init_worker`.
+_worker_state = {}
+
+
+def _create_shared_array(shape, dtype):
+    """
+    Return a block of shared memory holding an array of zeros, and the spec
+    of the array, by which other processes find it.
+    """
+    dtype = np.dtype(dtype)
+    size = max(1, int(np.prod(shape)) * dtype.itemsize)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    np.ndarray(shape, dtype=dtype, buffer=shm.buf)[...] = 0
+    return shm, (shm.name, shape, dtype.str)
+
+
+def _get_shared_array(shm, spec):
+    """
+    Return the array in a block of shared memory. The array must be released before
+    the shared memory is closed.
+    """
+    _, shape, dtype = spec
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _get_outputs(func_name, result):
+    """Return the output of an API function on a single query as a tuple of arrays."""
+    if func_name == "log_likelihood":
+        return (np.asarray(result),)
+    # Paths in the diploid case are tuples of two arrays.
+    return tuple(np.asarray(x) for x in result)
+
+
+def _run_query(func_name, panel, query, prob_recombination, kwargs):
+    func = getattr(api, func_name)
+    result = func(panel, query, panel.ploidy, prob_recombination, **kwargs)
+    return _get_outputs(func_name, result)
+
+
+def _init_worker(panel_spec, ploidy, prob_recombination, kwargs):
+    shm = shared_memory.SharedMemory(name=panel_spec[0])
+    _worker_state["shm"] = shm
+    _worker_state["panel"] = api.prepare_panel(
+        _get_shared_array(shm, panel_spec), ploidy
+    )
+    _worker_state["prob_recombination"] = prob_recombination
+    _worker_state["kwargs"] = kwargs
+
+
+def _run_chunk(func_name, query_spec, output_specs, start, stop, kwargs):
+    """Run an API function on queries start to stop, writing the outputs in place."""
+    shms = []
+    arrays = []
+    try:
+        for spec in (query_spec,) + output_specs:
+            shms.append(shared_memory.SharedMemory(name=spec[0]))
+            arrays.append(_get_shared_array(shms[-1], spec))
+        # Any warnings about the inputs are raised in the main process.
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for i in range(start, stop):
+                result = _run_query(
+                    func_name,
+                    _worker_state["panel"],
+                    arrays[0][i : i + 1],
+                    _worker_state["prob_recombination"],
+                    {**_worker_state["kwargs"], **kwargs},
+                )
+                for j, x in enumerate(result):
+                    arrays[j + 1][i] = x
+    finally:
+        # The arrays must be released before the shared memory is closed.
+        arrays.clear()
+        for shm in shms:
+            shm.close()
+
+
+class SharedPanelPool:
+    """
+    A pool of worker processes that run the HMM algorithms on batches of queries
+    against a reference panel held in shared memory.
+
+    The pool is used as a context manager, or closed with :meth:`close`.
+    The worker processes are started on first use.
+
+    The reference panel is copied straight into shared memory, so a memory-mapped
+    array (e.g. from :func:`numpy.load` with `mmap_mode="r"`) is not read
+    into private memory first.
+
+    :param numpy.ndarray/PreparedPanel reference_panel: A panel of reference haplotypes.
+    :param int ploidy: Ploidy (only 1 or 2 are supported).
+    :param numpy.ndarray prob_recombination: Recombination probability.
+    :param numpy.ndarray prob_mutation: Mutation probability.
+    :param bool scale_mutation_rate: Scale mutation rate or not.
+    :param int num_workers: Number of worker processes (default: number of CPUs).
+    :param int chunk_size: Number of queries sent to a worker at a time
+        (default: so that there are about four chunks per worker).
+    """
+
+    def __init__(
+        self,
+        reference_panel,
+        ploidy,
+        prob_recombination,
+        *,
+        prob_mutation=None,
+        scale_mutation_rate=None,
+        num_workers=None,
+        chunk_size=None,
+    ):
+        if num_workers is None:
+            num_workers = os.cpu_count()
+        if not isinstance(num_workers, int) or num_workers < 1:
+            err_msg = "Number of workers must be a positive integer."
+            raise ValueError(err_msg)
+        if chunk_size is not None and (
+            not isinstance(chunk_size, int) or chunk_size < 1
+        ):
+            err_msg = "Chunk size must be a positive integer."
+            raise ValueError(err_msg)
+
+        self.panel = api.prepare_panel(reference_panel, ploidy)
+        self.ploidy = ploidy
+        self.prob_recombination = prob_recombination
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self._kwargs = {
+            "prob_mutation": prob_mutation,
+            "scale_mutation_rate": scale_mutation_rate,
+        }
+
+        self._panel_shm, self._panel_spec = _create_shared_array(
+            self.panel.reference_panel.shape, self.panel.reference_panel.dtype
+        )
+        np.copyto(
+            _get_shared_array(self._panel_shm, self._panel_spec),
+            self.panel.reference_panel,
+        )
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Start the workers afresh, rather than forking the threads of Numba.
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(
+                    self._panel_spec,
+                    self.ploidy,
+                    self.prob_recombination,
+                    self._kwargs,
+                ),
+            )
+        return self._executor
+
+    def _run(self, func_name, query, kwargs):
+        if len(query.shape) != 2 or query.shape[0] < 1:
+            err_msg = "Query array has incorrect dimensions."
+            raise ValueError(err_msg)
+        num_queries = query.shape[0]
+
+        # Run the first query here, which also warms the Numba cache for the workers.
+        result = _run_query(
+            func_name,
+            self.panel,
+            query[:1],
+            self.prob_recombination,
+            {**self._kwargs, **kwargs},
+        )
+
+        shared = [_create_shared_array(query.shape, query.dtype)] + [
+            _create_shared_array((num_queries,) + x.shape, x.dtype) for x in result
+        ]
+        specs = [spec for _, spec in shared]
+        arrays = []
+        try:
+            arrays.extend(_get_shared_array(shm, spec) for shm, spec in shared)
+            arrays[0][:] = query
+            for j, x in enumerate(result):
+                arrays[j + 1][0] = x
+
+            if num_queries > 1:
+                chunk_size = self.chunk_size
+                if chunk_size is None:
+                    chunk_size = -(-(num_queries - 1) // (4 * self.num_workers))
+                executor = self._get_executor()
+                futures = [
+                    executor.submit(
+                        _run_chunk,
+                        func_name,
+                        specs[0],
+                        tuple(specs[1:]),
+                        start,
+                        min(start + chunk_size, num_queries),
+                        kwargs,
+                    )
+                    for start in range(1, num_queries, chunk_size)
+                ]
+                for future in futures:
+                    future.result()
+
+            outputs = [array.copy() for array in arrays[1:]]
+        finally:
+            # The arrays must be released before the shared memory is closed.
+            arrays.clear()
+            for shm, _ in shared:
+                shm.close()
+                shm.unlink()
+        return outputs
+
+    def viterbi(self, query, **kwargs):
+        """
+        Run :func:`viterbi` on each query of an array of size (k, m).
+
+        The best paths and their log-likelihoods are returned as arrays of size (k, m)
+        and (k,), respectively, as by :func:`viterbi` on multiple queries. In the diploid
+        case, the paths are returned as a tuple of two arrays, one per haplotype.
+
+        :param numpy.ndarray query: An array of queries.
+        :param kwargs: Further keyword arguments of :func:`viterbi`.
+        :return: Best paths and log-likelihoods.
+        :rtype: tuple
+        """
+        outputs = self._run("viterbi", query, kwargs)
+        if self.ploidy == 2:
+            paths = outputs[0]
+            return (paths[:, 0], paths[:, 1]), outputs[1]
+        return outputs[0], outputs[1]
+
+    def log_likelihood(self, query, **kwargs):
+        """
+        Run :func:`log_likelihood` on each query of an array of size (k, m).
+
+        :param numpy.ndarray query: An array of queries.
+        :param kwargs: Further keyword arguments of :func:`log_likelihood`.
+        :return: An array of log-likelihoods of size (k,).
+        :rtype: numpy.ndarray
+        """
+        return self._run("log_likelihood", query, kwargs)[0]
+
+    def posteriors(self, query, **kwargs):
+        """
+        Run :func:`posteriors` on each query of an array of size (k, m).
+
+        The posterior probabilities and log-likelihoods are returned as arrays of size
+        (k, m, n) and (k,), respectively, in the haploid case, and of size (k, m, n, n)
+        and (k,) in the diploid case.
+
+        :param numpy.ndarray query: An array of queries.
+        :param kwargs: Further keyword arguments of :func:`posteriors`.
+        :return: Posterior probabilities and log-likelihoods.
+        :rtype: tuple
+        """
+        if kwargs.get("return_path") or kwargs.get("checkpoint"):
+            err_msg = "Paths and checkpoints are not supported by the pool."
+            raise ValueError(err_msg)
+        posteriors, log_lik = self._run("posteriors", query, kwargs)
+        return posteriors, log_lik
+
+    def close(self):
+        """Shut down the worker processes, and free the shared reference panel."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._panel_shm is not None:
+            self._panel_shm.close()
+            self._panel_shm.unlink()
+            self._panel_shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -5,6 +5,13 @@ import numpy as np
 from . import core
 from . import jit
 
+# Codes of the switches into a pair of haplotypes (j1, j2) from the previous site,
+# stored in two bits per pair by the packed implementation.
+NO_SWITCH = 0
+SWITCH_J2 = 1  # Switch in the second haplotype, keeping j1.
+SWITCH_J1 = 2  # Switch in the first haplotype, keeping j2.
+DOUBLE_SWITCH = 3
+
 
 @jit.numba_njit
 def forwards_viterbi_dip_naive(n, m, G, s, e, r):
@@ -115,24 +122,31 @@ def forwards_viterbi_dip_naive_low_mem(n, m, G, s, e, r):
 
 
 @jit.numba_njit
-def forwards_viterbi_dip_low_mem(n, m, G, s, e, r):
+def forwards_viterbi_dip_low_mem(
+    n, m, H, s, e, r, num_copiable_entries=None, dtype=np.float64
+):
     """
     An implementation with reduced memory.
 
-    This is exposed via the API.
+    The reference panel H is an array of haplotypes of size (m, n), and the genotypes
+    of the pairs of reference haplotypes are computed on the fly.
+
+    The API uses `forwards_viterbi_dip_low_mem_packed`, which gives the same path
+    with packed pointers.
     """
     # Initialise
-    V = np.zeros((n, n))
-    V_prev = np.zeros((n, n))
+    V = np.zeros((n, n), dtype=dtype)
+    V_prev = np.zeros((n, n), dtype=dtype)
     P = np.zeros((m, n, n), dtype=np.int64)
     c = np.ones(m)
-    num_copiable_entries = core.get_num_copiable_entries(G)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
     r_n = r / num_copiable_entries
 
     for j1 in range(n):
         for j2 in range(n):
             emission_prob = core.get_emission_probability_diploid(
-                ref_genotype=G[0, j1, j2],
+                ref_genotype=core.get_phased_genotype(H[0, j1], H[0, j2]),
                 query_genotype=s[0, 0],
                 site=0,
                 emission_matrix=e,
@@ -141,8 +155,8 @@ def forwards_viterbi_dip_low_mem(n, m, G, s, e, r):
 
     # Diploid Viterbi, with smaller memory footprint, rescaling, and using the structure of the HMM.
     for l in range(1, m):
-        emission_probs = core.get_emission_probability_diploid_genotypes(
-            ref_genotypes=G[l, :, :],
+        emission_probs = core.get_emission_probability_diploid_haplotypes(
+            ref_haplotypes=H[l, :],
             query_genotype=s[0, l],
             site=l,
             emission_matrix=e,
@@ -292,6 +306,327 @@ def forwards_viterbi_dip_low_mem_no_pointer(n, m, G, s, e, r):
     )
 
 
+@jit.numba_njit
+def set_switch_code(packed_codes, index, code):
+    """Set the switch code of a pair of haplotypes in an array of packed switch codes."""
+    packed_codes[index >> 2] |= np.uint8(code << (2 * (index & 3)))
+
+
+@jit.numba_njit
+def get_switch_code(packed_codes, index):
+    """Return the switch code of a pair of haplotypes from an array of packed switch codes."""
+    return (packed_codes[index >> 2] >> (2 * (index & 3))) & 3
+
+
+@jit.numba_njit
+def forwards_viterbi_dip_low_mem_packed(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    num_copiable_entries=None,
+    dtype=np.float64,
+    rescale_threshold=np.inf,
+):
+    """
+    An implementation with reduced memory and packed pointers.
+
+    Instead of a pointer to the best previous pair of haplotypes, a two-bit switch code
+    is stored per pair of haplotypes and site, packed four to a byte in an array
+    of size (m, ceil(n^2 / 4)). The best previous pair is recovered from the code and
+    the argmax of the rescaled Viterbi probabilities and of their rows (or columns),
+    which are stored per site. This takes about 32 times less memory than
+    the pointers of `forwards_viterbi_dip_low_mem`, and gives the same path.
+
+    The Viterbi probabilities are only rescaled if their maximum is below
+    rescale_threshold. By default, they are rescaled at every site.
+
+    This is exposed via the API.
+    """
+    # Initialise
+    V = np.zeros((n, n), dtype=dtype)
+    V_prev = np.zeros((n, n), dtype=dtype)
+    P_packed = np.zeros((m, (n * n + 3) // 4), dtype=np.uint8)
+    V_argmaxes = np.zeros(m, dtype=np.int64)
+    V_rowcol_argmaxes = np.zeros((m, n), dtype=np.int32)
+    c = np.ones(m)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r / num_copiable_entries
+
+    for j1 in range(n):
+        for j2 in range(n):
+            emission_prob = core.get_emission_probability_diploid(
+                ref_genotype=core.get_phased_genotype(H[0, j1], H[0, j2]),
+                query_genotype=s[0, 0],
+                site=0,
+                emission_matrix=e,
+            )
+            V_prev[j1, j2] = 1 / (n**2) * emission_prob
+
+    # The argmaxes of the Viterbi probabilities and of their columns are found
+    # while updating, rather than in further passes.
+    argmax = np.argmax(V_prev)
+    V_max = V_prev[argmax // n, argmax % n]
+    V_rowcol_argmax = np.zeros(n, dtype=np.int64)
+    V_rowcol_argmax[:] = core.np_argmax(V_prev, 0)
+    V_rowcol_max = np.zeros(n)
+    for l in range(1, m):
+        emission_probs = core.get_emission_probability_diploid_haplotypes(
+            ref_haplotypes=H[l, :],
+            query_genotype=s[0, l],
+            site=l,
+            emission_matrix=e,
+        )
+
+        V_argmaxes[l - 1] = argmax
+        if V_max < rescale_threshold:
+            c[l] = V_max
+            V_prev *= 1 / c[l]
+            V_max = 1.0
+            # Rescaling can create ties, so the argmaxes are found again.
+            V_rowcol_argmax[:] = core.np_argmax(V_prev, 0)
+        for j in range(n):
+            V_rowcol_max[j] = V_prev[V_rowcol_argmax[j], j]
+        V_rowcol_argmaxes[l - 1, :] = V_rowcol_argmax
+
+        no_switch = (1 - r[l]) ** 2 + 2 * (r_n[l] * (1 - r[l])) + r_n[l] ** 2
+        single_switch = r_n[l] * (1 - r[l]) + r_n[l] ** 2
+        double_switch = r_n[l] ** 2 * V_max
+
+        argmax = 0
+        V_max = 0.0
+        V_rowcol_argmax[:] = 0
+        j1_j2 = 0
+        for j1 in range(n):
+            for j2 in range(n):
+                if V_rowcol_max[j1] >= V_rowcol_max[j2]:
+                    V_single_switch = V_rowcol_max[j1]
+                    code_single_switch = SWITCH_J2
+                else:
+                    V_single_switch = V_rowcol_max[j2]
+                    code_single_switch = SWITCH_J1
+
+                V[j1, j2] = V_prev[j1, j2] * no_switch
+                code = NO_SWITCH
+                if single_switch * V_single_switch > double_switch:
+                    if V[j1, j2] < single_switch * V_single_switch:
+                        V[j1, j2] = single_switch * V_single_switch
+                        code = code_single_switch
+                else:
+                    if V[j1, j2] < double_switch:
+                        V[j1, j2] = double_switch
+                        code = DOUBLE_SWITCH
+                if code != NO_SWITCH:
+                    set_switch_code(P_packed[l], j1_j2, code)
+
+                V[j1, j2] *= emission_probs[j1, j2]
+                if j1_j2 == 0 or V[j1, j2] > V_max:
+                    argmax = j1_j2
+                    V_max = V[j1, j2]
+                if V[j1, j2] > V[V_rowcol_argmax[j2], j2]:
+                    V_rowcol_argmax[j2] = j1
+                j1_j2 += 1
+        V, V_prev = V_prev, V
+
+    ll = np.sum(np.log10(c)) + np.log10(V_max)
+
+    return V_prev, P_packed, V_argmaxes, V_rowcol_argmaxes, ll
+
+
+@jit.numba_njit(parallel=True)
+def forwards_viterbi_dip_parallel_rescale(n, V, factor, block_size, V_rowcol_argmax):
+    """
+    Multiply the Viterbi probabilities by factor, and find the argmaxes of their rows
+    (or columns) again, updating the blocks of rows in parallel.
+    """
+    num_blocks = (n + block_size - 1) // block_size
+    for b in jit.prange(num_blocks):
+        for j1 in range(b * block_size, min((b + 1) * block_size, n)):
+            row_argmax = 0
+            for j2 in range(n):
+                V[j1, j2] *= factor
+                if V[j1, j2] > V[j1, row_argmax]:
+                    row_argmax = j2
+            V_rowcol_argmax[j1] = row_argmax
+
+
+@jit.numba_njit(parallel=True)
+def forwards_viterbi_dip_parallel_step(
+    n,
+    l,
+    H,
+    s,
+    e,
+    r,
+    r_n,
+    V,
+    V_prev,
+    V_rowcol_max,
+    double_switch,
+    P_packed_row,
+    block_size,
+    V_rowcol_argmax,
+    block_argmaxes,
+):
+    """
+    Move the Viterbi probabilities from site l - 1 (V_prev) to site l (V),
+    or initialise them at site 0, updating the blocks of rows in parallel.
+
+    The argmax of each block (as an index into the flattened array) is written
+    to block_argmaxes. The Viterbi probabilities are symmetric in j1 and j2,
+    so the argmax of a column is found from the row with the same index,
+    by the thread that updates the row.
+    """
+    if l > 0:
+        no_switch = (1 - r[l]) ** 2 + 2 * (r_n[l] * (1 - r[l])) + r_n[l] ** 2
+        single_switch = r_n[l] * (1 - r[l]) + r_n[l] ** 2
+    else:
+        no_switch = 1.0
+        single_switch = 0.0
+    num_blocks = len(block_argmaxes)
+    for b in jit.prange(num_blocks):
+        block_argmax = b * block_size * n
+        for j1 in range(b * block_size, min((b + 1) * block_size, n)):
+            row_argmax = 0
+            for j2 in range(n):
+                emission_prob = core.get_emission_probability_diploid(
+                    ref_genotype=core.get_phased_genotype(H[l, j1], H[l, j2]),
+                    query_genotype=s[0, l],
+                    site=l,
+                    emission_matrix=e,
+                )
+                if l == 0:
+                    V[j1, j2] = 1 / (n**2) * emission_prob
+                else:
+                    if V_rowcol_max[j1] >= V_rowcol_max[j2]:
+                        V_single_switch = V_rowcol_max[j1]
+                        code_single_switch = SWITCH_J2
+                    else:
+                        V_single_switch = V_rowcol_max[j2]
+                        code_single_switch = SWITCH_J1
+
+                    V[j1, j2] = V_prev[j1, j2] * no_switch
+                    code = NO_SWITCH
+                    if single_switch * V_single_switch > double_switch:
+                        if V[j1, j2] < single_switch * V_single_switch:
+                            V[j1, j2] = single_switch * V_single_switch
+                            code = code_single_switch
+                    else:
+                        if V[j1, j2] < double_switch:
+                            V[j1, j2] = double_switch
+                            code = DOUBLE_SWITCH
+                    if code != NO_SWITCH:
+                        set_switch_code(P_packed_row, j1 * n + j2, code)
+
+                    V[j1, j2] *= emission_prob
+                if V[j1, j2] > V[j1, row_argmax]:
+                    row_argmax = j2
+                if V[j1, j2] > V[block_argmax // n, block_argmax % n]:
+                    block_argmax = j1 * n + j2
+            V_rowcol_argmax[j1] = row_argmax
+        block_argmaxes[b] = block_argmax
+
+
+@jit.starts_threads
+@jit.numba_njit
+def forwards_viterbi_dip_low_mem_packed_parallel(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    num_copiable_entries=None,
+    dtype=np.float64,
+    rescale_threshold=np.inf,
+    block_size=None,
+):
+    """
+    A parallel implementation of `forwards_viterbi_dip_low_mem_packed`, in which
+    the rows (j1) of the pairs of haplotypes are split into blocks of block_size rows
+    (by default, as given by `core.get_parallel_block_size_diploid`), which are
+    updated by different threads at each site.
+
+    The argmaxes of the blocks are merged in order, so that the pointers and the ties
+    are the same as in the serial implementation. The number of rows per block
+    must be a multiple of 4, so that the blocks do not share any bytes of
+    packed pointers.
+
+    This is exposed via the API.
+    """
+    # As in `forward_ls_dip_loop_parallel` in fb_diploid.
+    block_size = (
+        core.get_parallel_block_size_diploid(n) if block_size is None else block_size
+    )
+    if block_size % 4 != 0:
+        err_msg = "Number of rows per block must be a multiple of 4."
+        raise ValueError(err_msg)
+    V = np.zeros((n, n), dtype=dtype)
+    V_prev = np.zeros((n, n), dtype=dtype)
+    P_packed = np.zeros((m, (n * n + 3) // 4), dtype=np.uint8)
+    V_argmaxes = np.zeros(m, dtype=np.int64)
+    V_rowcol_argmaxes = np.zeros((m, n), dtype=np.int32)
+    c = np.ones(m)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r / num_copiable_entries
+    block_argmaxes = np.zeros((n + block_size - 1) // block_size, dtype=np.int64)
+
+    argmax = 0
+    V_max = 0.0
+    double_switch = 0.0
+    V_rowcol_argmax = np.zeros(n, dtype=np.int64)
+    V_rowcol_max = np.zeros(n)
+    for l in range(m):
+        if l > 0:
+            V_argmaxes[l - 1] = argmax
+            if V_max < rescale_threshold:
+                c[l] = V_max
+                forwards_viterbi_dip_parallel_rescale(
+                    n, V_prev, 1 / c[l], block_size, V_rowcol_argmax
+                )
+                V_max = 1.0
+            for j in range(n):
+                V_rowcol_max[j] = V_prev[V_rowcol_argmax[j], j]
+            V_rowcol_argmaxes[l - 1, :] = V_rowcol_argmax
+            double_switch = r_n[l] ** 2 * V_max
+
+        forwards_viterbi_dip_parallel_step(
+            n,
+            l,
+            H,
+            s,
+            e,
+            r,
+            r_n,
+            V,
+            V_prev,
+            V_rowcol_max,
+            double_switch,
+            P_packed[l],
+            block_size,
+            V_rowcol_argmax,
+            block_argmaxes,
+        )
+
+        argmax = block_argmaxes[0]
+        for b in range(1, len(block_argmaxes)):
+            if (
+                V[block_argmaxes[b] // n, block_argmaxes[b] % n]
+                > V[argmax // n, argmax % n]
+            ):
+                argmax = block_argmaxes[b]
+        V_max = V[argmax // n, argmax % n]
+        V, V_prev = V_prev, V
+
+    ll = np.sum(np.log10(c)) + np.log10(V_max)
+
+    return V_prev, P_packed, V_argmaxes, V_rowcol_argmaxes, ll
+
+
 @jit.numba_njit
 def forwards_viterbi_dip_naive_vec(n, m, G, s, e, r):
     """An implementation using Numpy vectorisation."""
@@ -388,8 +723,6 @@ def forwards_viterbi_dip_naive_full_vec(n, m, G, s, e, r):
 def backwards_viterbi_dip(m, V_last, P):
     """
     Run a backwards pass to determine the most likely path.
-
-    This is exposed via the API.
     """
     assert V_last.ndim == 2
     assert V_last.shape[0] == V_last.shape[1]
@@ -450,20 +783,82 @@ def backwards_viterbi_dip_no_pointer(
     return path
 
 
-def get_phased_path(n, path):
-    """This is exposed via the API."""
-    return np.unravel_index(path, (n, n))
+@jit.numba_njit
+def backwards_viterbi_dip_packed(m, V_last, P_packed, V_argmaxes, V_rowcol_argmaxes):
+    """
+    Run a backwards pass to determine the most likely path from the packed pointers
+    of `forwards_viterbi_dip_low_mem_packed`.
+
+    This is exposed via the API.
+    """
+    assert V_last.ndim == 2
+    assert V_last.shape[0] == V_last.shape[1]
+
+    # Initialise
+    path = np.zeros(m, dtype=np.int64)
+    path[m - 1] = np.argmax(V_last)
+    n = V_last.shape[0]
+
+    # Backtrace
+    for l in range(m - 2, -1, -1):
+        current_best_template = path[l + 1]
+        code = get_switch_code(P_packed[l + 1], current_best_template)
+        if code == DOUBLE_SWITCH:
+            current_best_template = V_argmaxes[l]
+        elif code == SWITCH_J2:
+            j1 = current_best_template // n
+            current_best_template = j1 * n + V_rowcol_argmaxes[l, j1]
+        elif code == SWITCH_J1:
+            j2 = current_best_template % n
+            current_best_template = V_rowcol_argmaxes[l, j2] * n + j2
+        path[l] = current_best_template
+
+    return path
+
+
+def get_phased_path(n, path, unordered_pairs=False):
+    """
+    Convert a path through the pairs of reference haplotypes into a pair of paths,
+    one per haplotype.
+
+    If `unordered_pairs` is True, the path is of indices of unordered pairs,
+    as returned by `backwards_viterbi_dip_unordered`. At each site, the pair is oriented
+    so that it has the fewest switches from the orientation at the previous site.
+
+    This is exposed via the API.
+    """
+    if not unordered_pairs:
+        return np.unravel_index(path, (n, n))
+    j1, j2 = np.triu_indices(n)
+    path = np.asarray(path)
+    path_1 = j1[path]
+    path_2 = j2[path]
+    for l in range(1, path.shape[-1]):
+        num_switches = (path_1[..., l] != path_1[..., l - 1]).astype(np.int64) + (
+            path_2[..., l] != path_2[..., l - 1]
+        )
+        num_switches_swapped = (path_2[..., l] != path_1[..., l - 1]).astype(
+            np.int64
+        ) + (path_1[..., l] != path_2[..., l - 1])
+        swap = num_switches_swapped < num_switches
+        path_1[..., l], path_2[..., l] = (
+            np.where(swap, path_2[..., l], path_1[..., l]),
+            np.where(swap, path_1[..., l], path_2[..., l]),
+        )
+    return path_1, path_2
 
 
 @jit.numba_njit
-def path_ll_dip(n, m, G, phased_path, s, e, r):
+def path_ll_dip(n, m, H, phased_path, s, e, r, num_copiable_entries=None):
     """
     Evaluate the log-likelihood of a path through a reference panel resulting in a query.
 
     This is exposed via the API.
     """
     emission_prob = core.get_emission_probability_diploid(
-        ref_genotype=G[0, phased_path[0][0], phased_path[1][0]],
+        ref_genotype=core.get_phased_genotype(
+            H[0, phased_path[0][0]], H[0, phased_path[1][0]]
+        ),
         query_genotype=s[0, 0],
         site=0,
         emission_matrix=e,
@@ -471,12 +866,15 @@ def path_ll_dip(n, m, G, phased_path, s, e, r):
     log_prob_path = np.log10(1 / (n**2) * emission_prob)
 
     old_phase = np.array([phased_path[0][0], phased_path[1][0]])
-    num_copiable_entries = core.get_num_copiable_entries(G)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
     r_n = r / num_copiable_entries
 
     for l in range(1, m):
         emission_prob = core.get_emission_probability_diploid(
-            ref_genotype=G[l, phased_path[0][l], phased_path[1][l]],
+            ref_genotype=core.get_phased_genotype(
+                H[l, phased_path[0][l]], H[l, phased_path[1][l]]
+            ),
             query_genotype=s[0, l],
             site=l,
             emission_matrix=e,
@@ -498,3 +896,473 @@ def path_ll_dip(n, m, G, phased_path, s, e, r):
         old_phase = current_phase
 
     return log_prob_path
+
+
+@jit.numba_njit(parallel=True)
+def viterbi_dip_batch(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    num_copiable_entries=None,
+    dtype=np.float64,
+    rescale_threshold=np.inf,
+):
+    """
+    Run the Viterbi algorithm on a batch of queries in parallel.
+
+    The queries are an array of size (k, m), and the emission probability matrices
+    are an array of size (k, m, 8). The reference panel is shared by all
+    the queries, which are distributed across threads.
+
+    The returned paths are unphased, i.e. indices into flattened (n, n) arrays.
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    paths = np.zeros((k, m), dtype=np.int64)
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+
+    for q in jit.prange(k):
+        V, P_packed, V_argmaxes, V_rowcol_argmaxes, ll_q = (
+            forwards_viterbi_dip_low_mem_packed(
+                n,
+                m,
+                H,
+                s[q : q + 1, :],
+                e[q],
+                r,
+                num_copiable_entries,
+                dtype,
+                rescale_threshold,
+            )
+        )
+        paths[q, :] = backwards_viterbi_dip_packed(
+            m, V, P_packed, V_argmaxes, V_rowcol_argmaxes
+        )
+        ll[q] = ll_q
+
+    return paths, ll
+
+
+@jit.numba_njit
+def forwards_loglik_viterbi_dip(
+    n, m, H, s, e, r, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    Run the normalised forwards algorithm and the forwards pass of the Viterbi algorithm
+    in a single sweep over the reference panel.
+
+    The emission probabilities at each site are evaluated once and shared by
+    the sum-product and max-product recursions. The forward probabilities are not kept.
+
+    Return the log-likelihood from the forwards algorithm, and the final Viterbi
+    probabilities, packed pointers, and log-likelihood as in
+    `forwards_viterbi_dip_low_mem_packed`.
+
+    This is exposed via the API.
+    """
+    F = np.zeros((n, n), dtype=dtype)
+    F_prev = np.zeros((n, n), dtype=dtype)
+    F_j_change = np.zeros(n)
+    V = np.zeros((n, n), dtype=dtype)
+    V_prev = np.zeros((n, n), dtype=dtype)
+    P_packed = np.zeros((m, (n * n + 3) // 4), dtype=np.uint8)
+    V_argmaxes = np.zeros(m, dtype=np.int64)
+    V_rowcol_argmaxes = np.zeros((m, n), dtype=np.int32)
+    c_F = np.zeros(m)
+    c_V = np.ones(m)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r / num_copiable_entries
+
+    emission_probs = core.get_emission_probability_diploid_haplotypes(
+        ref_haplotypes=H[0, :],
+        query_genotype=s[0, 0],
+        site=0,
+        emission_matrix=e,
+    )
+    for j1 in range(n):
+        for j2 in range(n):
+            F[j1, j2] = 1 / (n**2) * emission_probs[j1, j2]
+            V_prev[j1, j2] = 1 / (n**2) * emission_probs[j1, j2]
+    c_F[0] = core.sum_float64(F)
+    F *= 1 / c_F[0]
+    V[:, :] = V_prev
+
+    for l in range(1, m):
+        emission_probs = core.get_emission_probability_diploid_haplotypes(
+            ref_haplotypes=H[l, :],
+            query_genotype=s[0, l],
+            site=l,
+            emission_matrix=e,
+        )
+
+        # Sum-product
+        F_prev[:, :] = F
+        F_j_change[:] = 0
+        for j1 in range(n):
+            for j2 in range(n):
+                F_j_change[j1] += (1 - r[l]) * r_n[l] * F_prev[j2, j1]
+
+        # Max-product
+        c_V[l] = np.amax(V_prev)
+        V_argmaxes[l - 1] = np.argmax(V_prev)
+        V_prev *= 1 / c_V[l]
+        V_rowcol_max = core.np_amax(V_prev, 0)
+        V_rowcol_argmaxes[l - 1, :] = core.np_argmax(V_prev, 0)
+
+        no_switch = (1 - r[l]) ** 2 + 2 * (r_n[l] * (1 - r[l])) + r_n[l] ** 2
+        single_switch = r_n[l] * (1 - r[l]) + r_n[l] ** 2
+        double_switch = r_n[l] ** 2
+
+        j1_j2 = 0
+        for j1 in range(n):
+            for j2 in range(n):
+                F[j1, j2] = (
+                    r_n[l] ** 2
+                    + F_j_change[j1]
+                    + F_j_change[j2]
+                    + (1 - r[l]) ** 2 * F_prev[j1, j2]
+                ) * emission_probs[j1, j2]
+
+                if V_rowcol_max[j1] >= V_rowcol_max[j2]:
+                    V_single_switch = V_rowcol_max[j1]
+                    code_single_switch = SWITCH_J2
+                else:
+                    V_single_switch = V_rowcol_max[j2]
+                    code_single_switch = SWITCH_J1
+
+                V[j1, j2] = V_prev[j1, j2] * no_switch
+                code = NO_SWITCH
+                if single_switch * V_single_switch > double_switch:
+                    if V[j1, j2] < single_switch * V_single_switch:
+                        V[j1, j2] = single_switch * V_single_switch
+                        code = code_single_switch
+                else:
+                    if V[j1, j2] < double_switch:
+                        V[j1, j2] = double_switch
+                        code = DOUBLE_SWITCH
+                if code != NO_SWITCH:
+                    set_switch_code(P_packed[l], j1_j2, code)
+
+                V[j1, j2] *= emission_probs[j1, j2]
+                j1_j2 += 1
+
+        c_F[l] = core.sum_float64(F)
+        F *= 1 / c_F[l]
+        V_prev[:, :] = V
+
+    ll = np.sum(np.log10(c_F))
+    ll_viterbi = np.sum(np.log10(c_V)) + np.log10(np.amax(V))
+
+    return ll, V, P_packed, V_argmaxes, V_rowcol_argmaxes, ll_viterbi
+
+
+@jit.numba_njit
+def forwards_viterbi_dip_unordered(
+    n, m, H, s, e, r, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    An implementation with reduced memory over the unordered pairs of reference haplotypes.
+
+    The Viterbi probabilities are symmetric in the two haplotypes of a pair, so they are
+    stored as in `fb_diploid.forward_ls_dip_unordered`, in an array of size n(n + 1) / 2.
+    The pointers are indices of unordered pairs, in an array of size (m, n(n + 1) / 2).
+
+    This is exposed via the API.
+    """
+    num_pairs = core.get_num_unordered_pairs(n)
+    V = np.zeros(num_pairs, dtype=dtype)
+    V_prev = np.zeros(num_pairs, dtype=dtype)
+    P = np.zeros((m, num_pairs), dtype=np.int64)
+    c = np.ones(m)
+    V_rowcol_max = np.zeros(n, dtype=dtype)
+    arg_rowcol_max = np.zeros(n, dtype=np.int64)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r / num_copiable_entries
+
+    j1_j2 = 0
+    for j1 in range(n):
+        for j2 in range(j1, n):
+            emission_prob = core.get_emission_probability_diploid(
+                ref_genotype=core.get_phased_genotype(H[0, j1], H[0, j2]),
+                query_genotype=s[0, 0],
+                site=0,
+                emission_matrix=e,
+            )
+            V_prev[j1_j2] = 1 / (n**2) * emission_prob
+            j1_j2 += 1
+    V[:] = V_prev
+
+    for l in range(1, m):
+        c[l] = np.amax(V_prev)
+        argmax = np.argmax(V_prev)
+        V_prev *= 1 / c[l]
+
+        # The row maxima are equal to the column maxima.
+        V_rowcol_max[:] = -1
+        j1_j2 = 0
+        for j1 in range(n):
+            for j2 in range(j1, n):
+                if V_prev[j1_j2] > V_rowcol_max[j1]:
+                    V_rowcol_max[j1] = V_prev[j1_j2]
+                    arg_rowcol_max[j1] = j2
+                if V_prev[j1_j2] > V_rowcol_max[j2]:
+                    V_rowcol_max[j2] = V_prev[j1_j2]
+                    arg_rowcol_max[j2] = j1
+                j1_j2 += 1
+
+        no_switch = (1 - r[l]) ** 2 + 2 * (r_n[l] * (1 - r[l])) + r_n[l] ** 2
+        single_switch = r_n[l] * (1 - r[l]) + r_n[l] ** 2
+        double_switch = r_n[l] ** 2
+
+        j1_j2 = 0
+        for j1 in range(n):
+            for j2 in range(j1, n):
+                if V_rowcol_max[j1] >= V_rowcol_max[j2]:
+                    V_single_switch = V_rowcol_max[j1]
+                    template_single_switch = core.get_unordered_pair_index(
+                        n, j1, arg_rowcol_max[j1]
+                    )
+                else:
+                    V_single_switch = V_rowcol_max[j2]
+                    template_single_switch = core.get_unordered_pair_index(
+                        n, arg_rowcol_max[j2], j2
+                    )
+
+                V[j1_j2] = V_prev[j1_j2] * no_switch
+                P[l, j1_j2] = j1_j2
+                if single_switch * V_single_switch > double_switch:
+                    if V[j1_j2] < single_switch * V_single_switch:
+                        V[j1_j2] = single_switch * V_single_switch
+                        P[l, j1_j2] = template_single_switch
+                else:
+                    if V[j1_j2] < double_switch:
+                        V[j1_j2] = double_switch
+                        P[l, j1_j2] = argmax
+
+                emission_prob = core.get_emission_probability_diploid(
+                    ref_genotype=core.get_phased_genotype(H[l, j1], H[l, j2]),
+                    query_genotype=s[0, l],
+                    site=l,
+                    emission_matrix=e,
+                )
+                V[j1_j2] *= emission_prob
+                j1_j2 += 1
+        V_prev[:] = V
+
+    ll = np.sum(np.log10(c)) + np.log10(np.amax(V))
+
+    return V, P, ll
+
+
+@jit.numba_njit
+def backwards_viterbi_dip_unordered(m, V_last, P):
+    """
+    Run a backwards pass over the unordered pairs to determine the most likely path,
+    as indices of unordered pairs.
+
+    This is exposed via the API.
+    """
+    assert V_last.ndim == 1
+
+    # Initialise
+    path = np.zeros(m, dtype=np.int64)
+    path[m - 1] = np.argmax(V_last)
+
+    # Backtrace
+    for j in range(m - 2, -1, -1):
+        path[j] = P[j + 1, path[j + 1]]
+
+    return path
+
+
+@jit.numba_njit(parallel=True)
+def viterbi_dip_unordered_batch(
+    n, m, H, s, e, r, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    Run the Viterbi algorithm over the unordered pairs on a batch of queries in parallel.
+
+    The queries and emission probability matrices are as in `viterbi_dip_batch`, and
+    the returned paths are unphased, i.e. indices of unordered pairs.
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    paths = np.zeros((k, m), dtype=np.int64)
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+
+    for q in jit.prange(k):
+        V, P, ll_q = forwards_viterbi_dip_unordered(
+            n, m, H, s[q : q + 1, :], e[q], r, num_copiable_entries, dtype
+        )
+        paths[q, :] = backwards_viterbi_dip_unordered(m, V, P)
+        ll[q] = ll_q
+
+    return paths, ll
+
+
+@jit.numba_njit
+def forwards_viterbi_dip_step(n, l, H, s, e, r, r_n, V, V_rowcol_argmax, P_packed):
+    """
+    Advance the Viterbi probabilities from site l - 1 to site l in place,
+    as in `forwards_viterbi_dip_low_mem_packed`.
+
+    The switch codes at site l are packed into P_packed, an array of size
+    ceil(n^2 / 4), and the argmax of each row (or column) at site l - 1 is
+    written to V_rowcol_argmax. Return the rescaling factor and the argmax
+    of the Viterbi probabilities at site l - 1.
+    """
+    c = np.amax(V)
+    argmax = np.argmax(V)
+    V *= 1 / c
+    V_rowcol_max = core.np_amax(V, 0)
+    V_rowcol_argmax[:] = core.np_argmax(V, 0)
+    P_packed[:] = 0
+
+    no_switch = (1 - r[l]) ** 2 + 2 * (r_n[l] * (1 - r[l])) + r_n[l] ** 2
+    single_switch = r_n[l] * (1 - r[l]) + r_n[l] ** 2
+    double_switch = r_n[l] ** 2
+
+    j1_j2 = 0
+    for j1 in range(n):
+        for j2 in range(n):
+            if V_rowcol_max[j1] >= V_rowcol_max[j2]:
+                V_single_switch = V_rowcol_max[j1]
+                code_single_switch = SWITCH_J2
+            else:
+                V_single_switch = V_rowcol_max[j2]
+                code_single_switch = SWITCH_J1
+
+            V[j1, j2] = V[j1, j2] * no_switch
+            code = NO_SWITCH
+            if single_switch * V_single_switch > double_switch:
+                if V[j1, j2] < single_switch * V_single_switch:
+                    V[j1, j2] = single_switch * V_single_switch
+                    code = code_single_switch
+            else:
+                if V[j1, j2] < double_switch:
+                    V[j1, j2] = double_switch
+                    code = DOUBLE_SWITCH
+            if code != NO_SWITCH:
+                set_switch_code(P_packed, j1_j2, code)
+
+            emission_prob = core.get_emission_probability_diploid(
+                ref_genotype=core.get_phased_genotype(H[l, j1], H[l, j2]),
+                query_genotype=s[0, l],
+                site=l,
+                emission_matrix=e,
+            )
+            V[j1, j2] *= emission_prob
+            j1_j2 += 1
+
+    return c, argmax
+
+
+@jit.numba_njit
+def forwards_viterbi_dip_checkpoint(
+    n, m, H, s, e, r, interval, num_copiable_entries=None, dtype=np.float64
+):
+    """
+    Run the forwards pass of the Viterbi algorithm, keeping the Viterbi probabilities
+    only at every interval sites, starting from the first site.
+
+    Return the checkpoints, the Viterbi probabilities at the last site, and
+    the log-likelihood.
+
+    This is exposed via the API.
+    """
+    num_checkpoints = (m + interval - 1) // interval
+    checkpoints = np.zeros((num_checkpoints, n, n), dtype=dtype)
+    V = np.zeros((n, n), dtype=dtype)
+    V_rowcol_argmax = np.zeros(n, dtype=np.int32)
+    P_packed = np.zeros((n * n + 3) // 4, dtype=np.uint8)
+    c = np.ones(m)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r / num_copiable_entries
+
+    for j1 in range(n):
+        for j2 in range(n):
+            emission_prob = core.get_emission_probability_diploid(
+                ref_genotype=core.get_phased_genotype(H[0, j1], H[0, j2]),
+                query_genotype=s[0, 0],
+                site=0,
+                emission_matrix=e,
+            )
+            V[j1, j2] = 1 / (n**2) * emission_prob
+    checkpoints[0, :, :] = V
+
+    for l in range(1, m):
+        c_l, _ = forwards_viterbi_dip_step(
+            n, l, H, s, e, r, r_n, V, V_rowcol_argmax, P_packed
+        )
+        c[l] = c_l
+        if l % interval == 0:
+            checkpoints[l // interval, :, :] = V
+
+    ll = np.sum(np.log10(c)) + np.log10(np.amax(V))
+
+    return checkpoints, V, ll
+
+
+@jit.numba_njit
+def backwards_viterbi_dip_checkpoint(
+    n, m, H, s, e, r, checkpoints, V_last, interval, num_copiable_entries=None
+):
+    """
+    Run the backwards pass of the Viterbi algorithm from the checkpoints of
+    `forwards_viterbi_dip_checkpoint` to get the most likely path.
+
+    The segments between checkpoints are processed from the last to the first.
+    Each segment is replayed from its checkpoint, keeping the packed pointers of
+    `forwards_viterbi_dip_low_mem_packed`, which are then used to trace the path
+    back through the segment. The path is the same as from
+    `forwards_viterbi_dip_low_mem_packed`.
+
+    This is exposed via the API.
+    """
+    path = np.zeros(m, dtype=np.int64)
+    path[m - 1] = np.argmax(V_last)
+    V = np.zeros((n, n), dtype=checkpoints.dtype)
+    P_packed = np.zeros((interval, (n * n + 3) // 4), dtype=np.uint8)
+    V_argmaxes = np.zeros(interval, dtype=np.int64)
+    V_rowcol_argmaxes = np.zeros((interval, n), dtype=np.int32)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries_diploid(H)
+    r_n = r / num_copiable_entries
+
+    for segment in range(len(checkpoints) - 1, -1, -1):
+        start = segment * interval
+        stop = min(start + interval, m - 1)
+        V[:, :] = checkpoints[segment]
+        for l in range(start + 1, stop + 1):
+            i = l - start - 1
+            _, argmax = forwards_viterbi_dip_step(
+                n, l, H, s, e, r, r_n, V, V_rowcol_argmaxes[i], P_packed[i]
+            )
+            V_argmaxes[i] = argmax
+        for l in range(stop, start, -1):
+            i = l - start - 1
+            current_best_template = path[l]
+            code = get_switch_code(P_packed[i], current_best_template)
+            if code == DOUBLE_SWITCH:
+                current_best_template = V_argmaxes[i]
+            elif code == SWITCH_J2:
+                j1 = current_best_template // n
+                current_best_template = j1 * n + V_rowcol_argmaxes[i, j1]
+            elif code == SWITCH_J1:
+                j2 = current_best_template % n
+                current_best_template = V_rowcol_argmaxes[i, j2] * n + j2
+            path[l - 1] = current_best_template
+
+    return path
@@ -23,7 +23,8 @@ def viterbi_naive_init(
     r_n = r / num_copiable_entries
 
     for i in range(n):
-        emission_prob = emission_func(
+        emission_prob = core.lookup_emission_probability_haploid(
+            emission_func,
             ref_allele=H[0, i],
             query_allele=s[0, 0],
             site=0,
@@ -52,7 +53,8 @@ def viterbi_init(
     r_n = r / num_copiable_entries
 
     for i in range(n):
-        emission_prob = emission_func(
+        emission_prob = core.lookup_emission_probability_haploid(
+            emission_func,
             ref_allele=H[0, i],
             query_allele=s[0, 0],
             site=0,
@@ -80,7 +82,8 @@ def forwards_viterbi_hap_naive(
         for i in range(n):
             v = np.zeros(n)
             for k in range(n):
-                emission_prob = emission_func(
+                emission_prob = core.lookup_emission_probability_haploid(
+                    emission_func,
                     ref_allele=H[j, i],
                     query_allele=s[0, j],
                     site=j,
@@ -117,7 +120,8 @@ def forwards_viterbi_hap_naive_vec(
         for i in range(n):
             v = np.copy(v_tmp)
             v[i] += V[j - 1, i] * (1 - r[j])
-            emission_prob = emission_func(
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
                 ref_allele=H[j, i],
                 query_allele=s[0, j],
                 site=j,
@@ -149,7 +153,8 @@ def forwards_viterbi_hap_naive_low_mem(
         for i in range(n):
             v = np.zeros(n)
             for k in range(n):
-                emission_prob = emission_func(
+                emission_prob = core.lookup_emission_probability_haploid(
+                    emission_func,
                     ref_allele=H[j, i],
                     query_allele=s[0, j],
                     site=j,
@@ -189,7 +194,8 @@ def forwards_viterbi_hap_naive_low_mem_rescaling(
         for i in range(n):
             v = np.zeros(n)
             for k in range(n):
-                emission_prob = emission_func(
+                emission_prob = core.lookup_emission_probability_haploid(
+                    emission_func,
                     ref_allele=H[j, i],
                     query_allele=s[0, j],
                     site=j,
@@ -234,7 +240,8 @@ def forwards_viterbi_hap_low_mem_rescaling(
             if V[i] < r_n[j]:
                 V[i] = r_n[j]
                 P[j, i] = argmax
-            emission_prob = emission_func(
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
                 ref_allele=H[j, i],
                 query_allele=s[0, j],
                 site=j,
@@ -257,16 +264,17 @@ def forwards_viterbi_hap_lower_mem_rescaling(
     e,
     r,
     emission_func,
+    num_copiable_entries=None,
+    dtype=np.float64,
 ):
     """
     An implementation with even smaller memory footprint
     that exploits the Markov structure.
-
-    This is exposed via the API.
     """
-    V = np.zeros(n)
+    V = np.zeros(n, dtype=dtype)
     for i in range(n):
-        emission_prob = emission_func(
+        emission_prob = core.lookup_emission_probability_haploid(
+            emission_func,
             ref_allele=H[0, i],
             query_allele=s[0, 0],
             site=0,
@@ -274,7 +282,8 @@ def forwards_viterbi_hap_lower_mem_rescaling(
         )
         V[i] = 1 / n * emission_prob
     P = np.zeros((m, n), dtype=np.int64)
-    num_copiable_entries = core.get_num_copiable_entries(H)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
     r_n = r / num_copiable_entries
     c = np.ones(m)
 
@@ -288,7 +297,8 @@ def forwards_viterbi_hap_lower_mem_rescaling(
             if V[i] < r_n[j]:
                 V[i] = r_n[j]
                 P[j, i] = argmax
-            emission_prob = emission_func(
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
                 ref_allele=H[j, i],
                 query_allele=s[0, j],
                 site=j,
@@ -317,7 +327,8 @@ def forwards_viterbi_hap_lower_mem_rescaling_no_pointer(
     """
     V = np.zeros(n)
     for i in range(n):
-        emission_prob = emission_func(
+        emission_prob = core.lookup_emission_probability_haploid(
+            emission_func,
             ref_allele=H[0, i],
             query_allele=s[0, 0],
             site=0,
@@ -345,7 +356,8 @@ def forwards_viterbi_hap_lower_mem_rescaling_no_pointer(
                 recombs[j] = np.append(
                     recombs[j], i
                 )  # We add template i as a potential template to recombine to at site j.
-            emission_prob = emission_func(
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
                 ref_allele=H[j, i],
                 query_allele=s[0, j],
                 site=j,
@@ -359,12 +371,246 @@ def forwards_viterbi_hap_lower_mem_rescaling_no_pointer(
     return V, V_argmaxes, recombs, ll
 
 
+@jit.numba_njit
+def forwards_viterbi_hap_lower_mem_rescaling_compact(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    num_copiable_entries=None,
+    dtype=np.float64,
+    rescale_threshold=np.inf,
+):
+    """
+    An implementation with even smaller memory footprint that stores only
+    the recombinations as pointers.
+
+    At each site, the templates that recombine from the best template at the previous
+    site are recorded in increasing order in a compressed sparse row layout, i.e.
+    the templates recombining at site j are in recomb_haps from recomb_offsets[j]
+    to recomb_offsets[j + 1]. The buffer of templates is grown by doubling, so
+    the memory needed is O(n) plus the number of recombinations, rather than
+    the O(mn) of full pointers.
+
+    The Viterbi probabilities are only rescaled if their maximum is below
+    rescale_threshold. By default, they are rescaled at every site.
+
+    This is exposed via the API.
+    """
+    V = np.zeros(n, dtype=dtype)
+    for i in range(n):
+        emission_prob = core.lookup_emission_probability_haploid(
+            emission_func,
+            ref_allele=H[0, i],
+            query_allele=s[0, 0],
+            site=0,
+            emission_matrix=e,
+        )
+        V[i] = 1 / n * emission_prob
+    V_argmaxes = np.zeros(m, dtype=np.int64)
+    recomb_offsets = np.zeros(m + 1, dtype=np.int64)
+    recomb_haps = np.zeros(max(n, 16), dtype=np.int32)
+    num_recombs = 0
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r / num_copiable_entries
+    c = np.ones(m)
+
+    argmax = np.argmax(V)
+    V_max = V[argmax]
+    for j in range(1, m):
+        V_argmaxes[j - 1] = argmax
+        if V_max < rescale_threshold:
+            c[j] = V_max
+            V *= 1 / c[j]
+            V_max = 1.0
+        V_recomb = r_n[j] * V_max
+        recomb_offsets[j] = num_recombs
+        # The argmax is found while updating, rather than in another pass.
+        argmax = 0
+        for i in range(n):
+            V[i] = V[i] * (1 - r[j] + r_n[j])
+            if V[i] < V_recomb:
+                V[i] = V_recomb
+                if num_recombs == len(recomb_haps):
+                    recomb_haps = np.concatenate(
+                        (recomb_haps, np.zeros(len(recomb_haps), dtype=np.int32))
+                    )
+                recomb_haps[num_recombs] = i
+                num_recombs += 1
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
+                ref_allele=H[j, i],
+                query_allele=s[0, j],
+                site=j,
+                emission_matrix=e,
+            )
+            V[i] *= emission_prob
+            if V[i] > V[argmax]:
+                argmax = i
+        V_max = V[argmax]
+
+    V_argmaxes[m - 1] = argmax
+    recomb_offsets[m] = num_recombs
+    ll = np.sum(np.log10(c)) + np.log10(V_max)
+
+    return V, V_argmaxes, recomb_offsets, recomb_haps[:num_recombs].copy(), ll
+
+
+@jit.numba_njit(parallel=True)
+def forwards_viterbi_hap_parallel_step(
+    n,
+    j,
+    H,
+    s,
+    e,
+    r,
+    r_n,
+    emission_func,
+    V,
+    V_recomb,
+    rescale_factor,
+    block_size,
+    block_argmaxes,
+    block_num_recombs,
+    block_recomb_haps,
+):
+    """
+    Move the Viterbi probabilities from site j - 1 to site j (or initialise them
+    at site 0), updating the blocks of templates in parallel.
+
+    The Viterbi probabilities at site j - 1 are first multiplied by rescale_factor.
+    The argmax of each block is written to block_argmaxes, and the templates
+    that recombine in block b are written to block_recomb_haps from b * block_size.
+    """
+    num_blocks = len(block_argmaxes)
+    for b in jit.prange(num_blocks):
+        start = b * block_size
+        stop = min(start + block_size, n)
+        num_block_recombs = 0
+        block_argmax = start
+        for i in range(start, stop):
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
+                ref_allele=H[j, i],
+                query_allele=s[0, j],
+                site=j,
+                emission_matrix=e,
+            )
+            if j == 0:
+                V[i] = 1 / n * emission_prob
+            else:
+                if rescale_factor != 1:
+                    V[i] *= rescale_factor
+                V[i] = V[i] * (1 - r[j] + r_n[j])
+                if V[i] < V_recomb:
+                    V[i] = V_recomb
+                    block_recomb_haps[start + num_block_recombs] = i
+                    num_block_recombs += 1
+                V[i] *= emission_prob
+            if V[i] > V[block_argmax]:
+                block_argmax = i
+        block_argmaxes[b] = block_argmax
+        block_num_recombs[b] = num_block_recombs
+
+
+@jit.starts_threads
+@jit.numba_njit
+def forwards_viterbi_hap_parallel(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    num_copiable_entries=None,
+    dtype=np.float64,
+    rescale_threshold=np.inf,
+    block_size=core.PARALLEL_BLOCK_SIZE,
+):
+    """
+    A parallel implementation of `forwards_viterbi_hap_lower_mem_rescaling_compact`,
+    in which the templates are split into blocks of size block_size, which are
+    updated by different threads at each site.
+
+    Each block finds its own argmax, and records the templates that recombine
+    in its own part of a buffer of size n. The argmaxes of the blocks are then
+    merged in order, and the recombinations are copied in order to recomb_haps,
+    so that the pointers and the ties are the same as in the serial implementation.
+
+    This is exposed via the API.
+    """
+    V = np.zeros(n, dtype=dtype)
+    V_argmaxes = np.zeros(m, dtype=np.int64)
+    recomb_offsets = np.zeros(m + 1, dtype=np.int64)
+    recomb_haps = np.zeros(max(n, 16), dtype=np.int32)
+    num_recombs = 0
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r / num_copiable_entries
+    c = np.ones(m)
+    num_blocks = (n + block_size - 1) // block_size
+    block_argmaxes = np.zeros(num_blocks, dtype=np.int64)
+    block_num_recombs = np.zeros(num_blocks, dtype=np.int64)
+    block_recomb_haps = np.zeros(n, dtype=np.int32)
+
+    V_max = 1.0
+    for j in range(m):
+        rescale_factor = 1.0
+        if j > 0 and V_max < rescale_threshold:
+            c[j] = V_max
+            rescale_factor = 1 / c[j]
+            V_max = 1.0
+        forwards_viterbi_hap_parallel_step(
+            n,
+            j,
+            H,
+            s,
+            e,
+            r,
+            r_n,
+            emission_func,
+            V,
+            r_n[j] * V_max,
+            rescale_factor,
+            block_size,
+            block_argmaxes,
+            block_num_recombs,
+            block_recomb_haps,
+        )
+
+        argmax = block_argmaxes[0]
+        for b in range(1, num_blocks):
+            if V[block_argmaxes[b]] > V[argmax]:
+                argmax = block_argmaxes[b]
+        V_max = V[argmax]
+        V_argmaxes[j] = argmax
+
+        recomb_offsets[j] = num_recombs
+        for b in range(num_blocks):
+            if num_recombs + block_num_recombs[b] > len(recomb_haps):
+                recomb_haps = np.concatenate(
+                    (recomb_haps, np.zeros(len(recomb_haps), dtype=np.int32))
+                )
+            start = b * block_size
+            for k in range(block_num_recombs[b]):
+                recomb_haps[num_recombs] = block_recomb_haps[start + k]
+                num_recombs += 1
+
+    recomb_offsets[m] = num_recombs
+    ll = np.sum(np.log10(c)) + np.log10(V_max)
+
+    return V, V_argmaxes, recomb_offsets, recomb_haps[:num_recombs].copy(), ll
+
+
 @jit.numba_njit
 def backwards_viterbi_hap(m, V_last, P):
     """
     An implementation of the backwards pass to get the most likely path.
-
-    This is exposed via API.
     """
     assert len(V_last.shape) == 1
     path = np.zeros(m, dtype=np.int64)
@@ -391,6 +637,31 @@ def backwards_viterbi_hap_no_pointer(m, V_argmaxes, recombs):
     return path
 
 
+@jit.numba_njit
+def backwards_viterbi_hap_compact(m, V_last, V_argmaxes, recomb_offsets, recomb_haps):
+    """
+    An implementation of the backwards pass to get the most likely path
+    from the recombinations stored by `forwards_viterbi_hap_lower_mem_rescaling_compact`.
+
+    The recombinations at a site are sorted, so they are looked up by binary search.
+
+    This is exposed via the API.
+    """
+    assert len(V_last.shape) == 1
+    path = np.zeros(m, dtype=np.int64)
+    path[m - 1] = np.argmax(V_last)
+
+    for j in range(m - 2, -1, -1):
+        current_best_template = path[j + 1]
+        recombs = recomb_haps[recomb_offsets[j + 1] : recomb_offsets[j + 2]]
+        where = np.searchsorted(recombs, current_best_template)
+        if where < len(recombs) and recombs[where] == current_best_template:
+            current_best_template = V_argmaxes[j]
+        path[j] = current_best_template
+
+    return path
+
+
 @jit.numba_njit
 def path_ll_hap(
     n,
@@ -401,13 +672,15 @@ def path_ll_hap(
     e,
     r,
     emission_func,
+    num_copiable_entries=None,
 ):
     """
     Evaluate the log-likelihood of a path through a reference panel resulting in a query.
 
     This is exposed via the API.
     """
-    emission_prob = emission_func(
+    emission_prob = core.lookup_emission_probability_haploid(
+        emission_func,
         ref_allele=H[0, path[0]],
         query_allele=s[0, 0],
         site=0,
@@ -415,11 +688,13 @@ def path_ll_hap(
     )
     log_prob_path = np.log10((1 / n) * emission_prob)
     old = path[0]
-    num_copiable_entries = core.get_num_copiable_entries(H)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
     r_n = r / num_copiable_entries
 
     for l in range(1, m):
-        emission_prob = emission_func(
+        emission_prob = core.lookup_emission_probability_haploid(
+            emission_func,
             ref_allele=H[l, path[l]],
             query_allele=s[0, l],
             site=l,
@@ -437,3 +712,560 @@ def path_ll_hap(
         old = current
 
     return log_prob_path
+
+
+@jit.numba_njit(parallel=True)
+def viterbi_hap_batch(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    num_copiable_entries=None,
+    dtype=np.float64,
+    rescale_threshold=np.inf,
+):
+    """
+    Run the Viterbi algorithm on a batch of queries in parallel.
+
+    The queries are an array of size (k, m), and the emission probability matrices
+    are an array of size (k, m, 2). The queries are distributed across threads.
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    paths = np.zeros((k, m), dtype=np.int64)
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+
+    for q in jit.prange(k):
+        V, V_argmaxes, recomb_offsets, recomb_haps, ll_q = (
+            forwards_viterbi_hap_lower_mem_rescaling_compact(
+                n,
+                m,
+                H,
+                s[q : q + 1, :],
+                e[q],
+                r,
+                emission_func,
+                num_copiable_entries,
+                dtype,
+                rescale_threshold,
+            )
+        )
+        paths[q, :] = backwards_viterbi_hap_compact(
+            m, V, V_argmaxes, recomb_offsets, recomb_haps
+        )
+        ll[q] = ll_q
+
+    return paths, ll
+
+
+@jit.numba_njit
+def forwards_loglik_viterbi_hap(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Run the normalised forwards algorithm and the forwards pass of the Viterbi algorithm
+    in a single sweep over the reference panel.
+
+    The emission probabilities at each site are evaluated once and shared by
+    the sum-product and max-product recursions. The forward probabilities are not kept.
+
+    Return the log-likelihood from the forwards algorithm, and the final Viterbi
+    probabilities, recombinations, and log-likelihood as in
+    `forwards_viterbi_hap_lower_mem_rescaling_compact`.
+
+    This is exposed via the API.
+    """
+    F = np.zeros(n, dtype=dtype)
+    V = np.zeros(n, dtype=dtype)
+    V_argmaxes = np.zeros(m, dtype=np.int64)
+    recomb_offsets = np.zeros(m + 1, dtype=np.int64)
+    recomb_haps = np.zeros(max(n, 16), dtype=np.int32)
+    num_recombs = 0
+    c_F = np.zeros(m)
+    c_V = np.ones(m)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r / num_copiable_entries
+
+    for i in range(n):
+        emission_prob = core.lookup_emission_probability_haploid(
+            emission_func,
+            ref_allele=H[0, i],
+            query_allele=s[0, 0],
+            site=0,
+            emission_matrix=e,
+        )
+        F[i] = 1 / n * emission_prob
+        V[i] = 1 / n * emission_prob
+        c_F[0] += F[i]
+    F *= 1 / c_F[0]
+
+    for j in range(1, m):
+        argmax = np.argmax(V)
+        V_argmaxes[j - 1] = argmax
+        c_V[j] = V[argmax]
+        V *= 1 / c_V[j]
+        recomb_offsets[j] = num_recombs
+        for i in range(n):
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
+                ref_allele=H[j, i],
+                query_allele=s[0, j],
+                site=j,
+                emission_matrix=e,
+            )
+            # Sum-product
+            F[i] = F[i] * (1 - r[j]) + r_n[j]
+            F[i] *= emission_prob
+            c_F[j] += F[i]
+            # Max-product
+            V[i] = V[i] * (1 - r[j] + r_n[j])
+            if V[i] < r_n[j]:
+                V[i] = r_n[j]
+                if num_recombs == len(recomb_haps):
+                    recomb_haps = np.concatenate(
+                        (recomb_haps, np.zeros(len(recomb_haps), dtype=np.int32))
+                    )
+                recomb_haps[num_recombs] = i
+                num_recombs += 1
+            V[i] *= emission_prob
+        F *= 1 / c_F[j]
+
+    V_argmaxes[m - 1] = np.argmax(V)
+    recomb_offsets[m] = num_recombs
+    ll = np.sum(np.log10(c_F))
+    ll_viterbi = np.sum(np.log10(c_V)) + np.log10(np.max(V))
+
+    return (
+        ll,
+        V,
+        V_argmaxes,
+        recomb_offsets,
+        recomb_haps[:num_recombs].copy(),
+        ll_viterbi,
+    )
+
+
+@jit.numba_njit
+def forwards_viterbi_hap_step(n, j, H, s, e, r, r_n, emission_func, V, recomb_bits):
+    """
+    Advance the Viterbi probabilities from site j - 1 to site j in place,
+    as in `forwards_viterbi_hap_lower_mem_rescaling`.
+
+    The templates that recombine at site j are recorded as set bits in recomb_bits,
+    an array of size ceil(n / 8). Return the rescaling factor and the argmax
+    of the Viterbi probabilities at site j - 1.
+    """
+    argmax = np.argmax(V)
+    c = V[argmax]
+    V *= 1 / c
+    recomb_bits[:] = 0
+    for i in range(n):
+        V[i] = V[i] * (1 - r[j] + r_n[j])
+        if V[i] < r_n[j]:
+            V[i] = r_n[j]
+            recomb_bits[i >> 3] |= np.uint8(1 << (i & 7))
+        emission_prob = core.lookup_emission_probability_haploid(
+            emission_func,
+            ref_allele=H[j, i],
+            query_allele=s[0, j],
+            site=j,
+            emission_matrix=e,
+        )
+        V[i] *= emission_prob
+    return c, argmax
+
+
+@jit.numba_njit
+def forwards_viterbi_hap_checkpoint(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    interval,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Run the forwards pass of the Viterbi algorithm, keeping the Viterbi probabilities
+    only at every interval sites, starting from the first site.
+
+    Return the checkpoints, the Viterbi probabilities at the last site, and
+    the log-likelihood.
+
+    This is exposed via the API.
+    """
+    num_checkpoints = (m + interval - 1) // interval
+    checkpoints = np.zeros((num_checkpoints, n), dtype=dtype)
+    V = np.zeros(n, dtype=dtype)
+    recomb_bits = np.zeros((n + 7) // 8, dtype=np.uint8)
+    c = np.ones(m)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r / num_copiable_entries
+
+    for i in range(n):
+        emission_prob = core.lookup_emission_probability_haploid(
+            emission_func,
+            ref_allele=H[0, i],
+            query_allele=s[0, 0],
+            site=0,
+            emission_matrix=e,
+        )
+        V[i] = 1 / n * emission_prob
+    checkpoints[0, :] = V
+
+    for j in range(1, m):
+        c_j, _ = forwards_viterbi_hap_step(
+            n, j, H, s, e, r, r_n, emission_func, V, recomb_bits
+        )
+        c[j] = c_j
+        if j % interval == 0:
+            checkpoints[j // interval, :] = V
+
+    ll = np.sum(np.log10(c)) + np.log10(np.max(V))
+
+    return checkpoints, V, ll
+
+
+@jit.numba_njit
+def backwards_viterbi_hap_checkpoint(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    checkpoints,
+    V_last,
+    interval,
+    num_copiable_entries=None,
+):
+    """
+    Run the backwards pass of the Viterbi algorithm from the checkpoints of
+    `forwards_viterbi_hap_checkpoint` to get the most likely path.
+
+    The segments between checkpoints are processed from the last to the first.
+    Each segment is replayed from its checkpoint, keeping a bitset of
+    the recombinations and the argmax at each site, which are then used to trace
+    the path back through the segment. The path is the same as from
+    `forwards_viterbi_hap_lower_mem_rescaling`.
+
+    This is exposed via the API.
+    """
+    path = np.zeros(m, dtype=np.int64)
+    path[m - 1] = np.argmax(V_last)
+    V = np.zeros(n, dtype=checkpoints.dtype)
+    recomb_bits = np.zeros((interval, (n + 7) // 8), dtype=np.uint8)
+    V_argmaxes = np.zeros(interval, dtype=np.int64)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r / num_copiable_entries
+
+    for segment in range(len(checkpoints) - 1, -1, -1):
+        start = segment * interval
+        stop = min(start + interval, m - 1)
+        V[:] = checkpoints[segment]
+        for j in range(start + 1, stop + 1):
+            _, argmax = forwards_viterbi_hap_step(
+                n, j, H, s, e, r, r_n, emission_func, V, recomb_bits[j - start - 1]
+            )
+            V_argmaxes[j - start - 1] = argmax
+        for j in range(stop, start, -1):
+            current_best_template = path[j]
+            is_recomb = (
+                recomb_bits[j - start - 1, current_best_template >> 3]
+                >> (current_best_template & 7)
+            ) & 1
+            if is_recomb:
+                current_best_template = V_argmaxes[j - start - 1]
+            path[j - 1] = current_best_template
+
+    return path
+
+
+@jit.numba_njit
+def forwards_viterbi_hap_sparse(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    An implementation of the forwards pass that only updates the templates whose
+    Viterbi probabilities differ from those of the templates at the recombination floor.
+
+    The templates not carrying the major allele at a site are given by
+    `core.get_minor_allele_index`. After recombining, all the templates carrying
+    the major allele have the same Viterbi probability, which is held once in
+    V_exc[n]. Only the other templates are held explicitly, in V_exc, and they are
+    listed in exc_haps. A template rejoins the floor as soon as its Viterbi probability
+    is equal to it, so the cost per site is proportional to the number of minor allele
+    carriers and templates that have not recombined recently, rather than to n.
+    The Viterbi probabilities are the same as from
+    `forwards_viterbi_hap_lower_mem_rescaling`.
+
+    The templates at the floor either all recombine or all do not at a site, which is
+    recorded in floor_recombs. The templates held explicitly that do otherwise are
+    recorded in increasing order in switch_haps from switch_offsets[j] to
+    switch_offsets[j + 1]. Use `get_pointers_hap_sparse` to expand these into
+    the pointers used by `backwards_viterbi_hap`.
+
+    This is exposed via the API.
+    """
+    V_exc = np.zeros(n + 1, dtype=dtype)
+    is_exc = np.zeros(n, dtype=np.bool_)
+    is_minor = np.zeros(n, dtype=np.bool_)
+    exc_haps = np.zeros(n, dtype=np.int64)
+    num_exc = 0
+    V_argmaxes = np.zeros(m, dtype=np.int64)
+    floor_recombs = np.zeros(m, dtype=np.bool_)
+    switch_offsets = np.zeros(m + 1, dtype=np.int64)
+    switch_haps = np.zeros(16, dtype=np.int32)
+    num_switches = 0
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+    r_n = r / num_copiable_entries
+    c = np.ones(m)
+
+    emission_prob_major = core.lookup_emission_probability_haploid(
+        emission_func,
+        ref_allele=major_alleles[0],
+        query_allele=s[0, 0],
+        site=0,
+        emission_matrix=e,
+    )
+    V_exc[n] = 1 / n * emission_prob_major
+    for k in range(minor_offsets[0], minor_offsets[1]):
+        i = minor_haps[k]
+        emission_prob = core.lookup_emission_probability_haploid(
+            emission_func,
+            ref_allele=H[0, i],
+            query_allele=s[0, 0],
+            site=0,
+            emission_matrix=e,
+        )
+        V_exc[i] = 1 / n * emission_prob
+        if V_exc[i] != V_exc[n]:
+            is_exc[i] = True
+            exc_haps[num_exc] = i
+            num_exc += 1
+
+    for j in range(1, m):
+        # The first template at the floor has the lowest index among those at the floor.
+        argmax = -1
+        if num_exc < n:
+            argmax = 0
+            while is_exc[argmax]:
+                argmax += 1
+        for k in range(num_exc):
+            i = exc_haps[k]
+            if argmax == -1:
+                argmax = i
+            else:
+                max_value = V_exc[n] if not is_exc[argmax] else V_exc[argmax]
+                if V_exc[i] > max_value or (V_exc[i] == max_value and i < argmax):
+                    argmax = i
+        V_argmaxes[j - 1] = argmax
+        c[j] = V_exc[argmax] if is_exc[argmax] else V_exc[n]
+
+        # Transition
+        V_exc[n] *= 1 / c[j]
+        V_exc[n] = V_exc[n] * (1 - r[j] + r_n[j])
+        floor_recombs[j] = V_exc[n] < r_n[j]
+        if floor_recombs[j]:
+            V_exc[n] = r_n[j]
+        switch_offsets[j] = num_switches
+        for k in range(num_exc):
+            i = exc_haps[k]
+            V_exc[i] *= 1 / c[j]
+            V_exc[i] = V_exc[i] * (1 - r[j] + r_n[j])
+            is_recomb = V_exc[i] < r_n[j]
+            if is_recomb:
+                V_exc[i] = r_n[j]
+            if is_recomb != floor_recombs[j]:
+                if num_switches == len(switch_haps):
+                    switch_haps = np.concatenate(
+                        (switch_haps, np.zeros(len(switch_haps), dtype=np.int32))
+                    )
+                switch_haps[num_switches] = i
+                num_switches += 1
+        switch_haps[switch_offsets[j] : num_switches] = np.sort(
+            switch_haps[switch_offsets[j] : num_switches]
+        )
+
+        # Emission
+        for k in range(minor_offsets[j], minor_offsets[j + 1]):
+            i = minor_haps[k]
+            if not is_exc[i]:
+                V_exc[i] = V_exc[n]
+                is_exc[i] = True
+                exc_haps[num_exc] = i
+                num_exc += 1
+            emission_prob = core.lookup_emission_probability_haploid(
+                emission_func,
+                ref_allele=H[j, i],
+                query_allele=s[0, j],
+                site=j,
+                emission_matrix=e,
+            )
+            V_exc[i] *= emission_prob
+            is_minor[i] = True
+        emission_prob_major = core.lookup_emission_probability_haploid(
+            emission_func,
+            ref_allele=major_alleles[j],
+            query_allele=s[0, j],
+            site=j,
+            emission_matrix=e,
+        )
+        V_exc[n] *= emission_prob_major
+        for k in range(num_exc - 1, -1, -1):
+            i = exc_haps[k]
+            if is_minor[i]:
+                is_minor[i] = False
+            else:
+                V_exc[i] *= emission_prob_major
+            if V_exc[i] == V_exc[n]:
+                # The template rejoins the floor.
+                is_exc[i] = False
+                num_exc -= 1
+                exc_haps[k] = exc_haps[num_exc]
+
+    V = np.zeros(n, dtype=dtype)
+    V[:] = V_exc[n]
+    for k in range(num_exc):
+        V[exc_haps[k]] = V_exc[exc_haps[k]]
+    V_argmaxes[m - 1] = np.argmax(V)
+    switch_offsets[m] = num_switches
+    ll = np.sum(np.log10(c)) + np.log10(np.max(V))
+
+    return (
+        V,
+        V_argmaxes,
+        floor_recombs,
+        switch_offsets,
+        switch_haps[:num_switches].copy(),
+        ll,
+    )
+
+
+@jit.numba_njit
+def backwards_viterbi_hap_sparse(
+    m, V_last, V_argmaxes, floor_recombs, switch_offsets, switch_haps
+):
+    """
+    An implementation of the backwards pass to get the most likely path
+    from the recombinations stored by `forwards_viterbi_hap_sparse`.
+
+    This is exposed via the API.
+    """
+    assert len(V_last.shape) == 1
+    path = np.zeros(m, dtype=np.int64)
+    path[m - 1] = np.argmax(V_last)
+
+    for j in range(m - 2, -1, -1):
+        current_best_template = path[j + 1]
+        switches = switch_haps[switch_offsets[j + 1] : switch_offsets[j + 2]]
+        where = np.searchsorted(switches, current_best_template)
+        is_switch = where < len(switches) and switches[where] == current_best_template
+        if floor_recombs[j + 1] != is_switch:
+            current_best_template = V_argmaxes[j]
+        path[j] = current_best_template
+
+    return path
+
+
+@jit.numba_njit
+def get_pointers_hap_sparse(
+    n, m, V_argmaxes, floor_recombs, switch_offsets, switch_haps
+):
+    """
+    Expand the recombinations stored by `forwards_viterbi_hap_sparse` into
+    the pointers of size (m, n) used by `backwards_viterbi_hap`.
+    """
+    P = np.zeros((m, n), dtype=np.int64)
+    for j in range(1, m):
+        for i in range(n):
+            P[j, i] = V_argmaxes[j - 1] if floor_recombs[j] else i
+        for k in range(switch_offsets[j], switch_offsets[j + 1]):
+            i = switch_haps[k]
+            P[j, i] = i if floor_recombs[j] else V_argmaxes[j - 1]
+    return P
+
+
+@jit.numba_njit(parallel=True)
+def viterbi_hap_sparse_batch(
+    n,
+    m,
+    H,
+    s,
+    e,
+    r,
+    emission_func,
+    major_alleles,
+    minor_offsets,
+    minor_haps,
+    num_copiable_entries=None,
+    dtype=np.float64,
+):
+    """
+    Run the sparse Viterbi algorithm on a batch of queries in parallel,
+    as in `viterbi_hap_batch`.
+
+    This is exposed via the API.
+    """
+    k = s.shape[0]
+    paths = np.zeros((k, m), dtype=np.int64)
+    ll = np.zeros(k)
+    if num_copiable_entries is None:
+        num_copiable_entries = core.get_num_copiable_entries(H)
+
+    for q in jit.prange(k):
+        V, V_argmaxes, floor_recombs, switch_offsets, switch_haps, ll_q = (
+            forwards_viterbi_hap_sparse(
+                n,
+                m,
+                H,
+                s[q : q + 1, :],
+                e[q],
+                r,
+                emission_func,
+                major_alleles,
+                minor_offsets,
+                minor_haps,
+                num_copiable_entries,
+                dtype,
+            )
+        )
+        paths[q, :] = backwards_viterbi_hap_sparse(
+            m, V, V_argmaxes, floor_recombs, switch_offsets, switch_haps
+        )
+        ll[q] = ll_q
+
+    return paths, ll
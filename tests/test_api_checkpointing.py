@@ -0,0 +1,203 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+import lshmm.fb_diploid as fbd
+import lshmm.fb_haploid as fbh
+
+
+class TestCheckpointing(lsbase.ForwardBackwardAlgorithmBase):
+    def verify(self, ts, ploidy, scale_mutation_rate, include_ancestors):
+        if ploidy == 1:
+            H_vs, queries = self.get_examples_haploid(ts, include_ancestors)
+        else:
+            H_vs, queries = self.get_examples_diploid(ts, include_ancestors)
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        mu = np.zeros(m) + 0.01
+        for query in queries:
+            if ploidy == 2:
+                query = core.convert_haplotypes_to_unphased_genotypes(query)
+            kwargs = {
+                "reference_panel": H_vs,
+                "query": query,
+                "ploidy": ploidy,
+                "prob_recombination": r,
+                "prob_mutation": mu,
+                "scale_mutation_rate": scale_mutation_rate,
+            }
+            F, c, ll = ls.forwards(**kwargs)
+            B = ls.backwards(normalisation_factor_from_forward=c, **kwargs)
+            P, _, path = ls.posteriors(return_path=True, **kwargs)
+            for interval in [None, 1, 3, m + 5]:
+                F_cp, c_cp, ll_cp = ls.forwards(
+                    checkpoint=True, checkpoint_interval=interval, **kwargs
+                )
+                B_cp = ls.backwards(
+                    normalisation_factor_from_forward=c,
+                    checkpoint=True,
+                    checkpoint_interval=interval,
+                    **kwargs,
+                )
+                P_cp, ll_p_cp, path_cp = ls.posteriors(
+                    return_path=True,
+                    checkpoint=True,
+                    checkpoint_interval=interval,
+                    **kwargs,
+                )
+                assert F_cp.shape == F.shape
+                assert B_cp.shape == B.shape
+                assert P_cp.shape == P.shape
+                self.assertAllClose(c_cp, c)
+                self.assertAllClose(ll_cp, ll)
+                self.assertAllClose(ll_p_cp, ll)
+                self.assertAllClose(np.asarray(F_cp), F)
+                self.assertAllClose(np.asarray(B_cp), B)
+                self.assertAllClose(np.asarray(P_cp), P)
+                # Access the rows in reverse order and at random.
+                for l in range(m - 1, -1, -1):
+                    self.assertAllClose(B_cp[l], B[l])
+                    self.assertAllClose(F_cp[l], F[l])
+                self.assertAllClose(F_cp[-1], F[-1])
+                self.assertAllClose(F_cp[1::2], F[1::2])
+                # Ties may be broken differently, so compare the posteriors on the paths.
+                for l in range(m):
+                    if ploidy == 1:
+                        self.assertAllClose(P[l, path_cp[l]], P[l, path[l]])
+                    else:
+                        self.assertAllClose(
+                            P[l, path_cp[0][l], path_cp[1][l]],
+                            P[l, path[0][l], path[1][l]],
+                        )
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(
+        self, ploidy, scale_mutation_rate, include_ancestors
+    ):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, ploidy, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n8_high_recomb(
+        self, ploidy, scale_mutation_rate, include_ancestors
+    ):
+        ts = self.get_ts_simple_n8_high_recomb()
+        self.verify(ts, ploidy, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    def test_segment_reads_only_its_sites(self, ploidy):
+        # The cost of recomputing a segment must not grow with the number of sites,
+        # so the segment kernels must not read the sites outside the segment.
+        ts = self.get_ts_simple_n8_high_recomb()
+        if ploidy == 1:
+            H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+            query = queries[0]
+        else:
+            H_vs, queries = self.get_examples_diploid(ts, include_ancestors=False)
+            query = core.convert_haplotypes_to_unphased_genotypes(queries[0])
+        n = H_vs.shape[1]
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        _, _, _, query, e = ls.check_inputs(H_vs, query, ploidy, r, 0.01, True)
+        if ploidy == 1:
+            num_copiable_entries = core.get_num_copiable_entries(H_vs)
+        else:
+            num_copiable_entries = core.get_num_copiable_entries_diploid(H_vs)
+        F, c, _ = ls.forwards(H_vs, query, ploidy, r, prob_mutation=0.01)
+        B = ls.backwards(H_vs, query, ploidy, c, r, prob_mutation=0.01)
+        start, stop = 2, min(5, m - 1)
+
+        def poison(first, last):
+            r_poisoned = np.full(m, np.nan)
+            r_poisoned[first:last] = r[first:last]
+            return r_poisoned
+
+        c_segment = np.zeros(stop - start)
+        if ploidy == 1:
+            emission_func = core.get_emission_probability_haploid
+            F_segment = fbh.forwards_ls_hap_segment(
+                n,
+                H_vs,
+                query,
+                e,
+                c_segment,
+                poison(start, stop),
+                emission_func,
+                F[start - 1],
+                start,
+                stop,
+                num_copiable_entries,
+            )
+            B_segment = fbh.backwards_ls_hap_segment(
+                n,
+                m,
+                H_vs,
+                query,
+                e,
+                c,
+                poison(start + 1, stop + 1),
+                emission_func,
+                B[stop],
+                start,
+                stop,
+                num_copiable_entries,
+            )
+        else:
+            F_segment = fbd.forward_ls_dip_segment(
+                n,
+                H_vs,
+                query,
+                e,
+                c_segment,
+                poison(start, stop),
+                F[start - 1],
+                start,
+                stop,
+                num_copiable_entries,
+            )
+            B_segment = fbd.backward_ls_dip_segment(
+                n,
+                m,
+                H_vs,
+                query,
+                e,
+                c,
+                poison(start + 1, stop + 1),
+                B[stop],
+                start,
+                stop,
+                num_copiable_entries,
+            )
+        self.assertAllClose(F_segment, F[start:stop])
+        self.assertAllClose(c_segment, c[start:stop])
+        self.assertAllClose(B_segment, B[start:stop])
+
+    def test_errors(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        kwargs = {
+            "reference_panel": H_vs,
+            "ploidy": 1,
+            "prob_recombination": r,
+            "checkpoint": True,
+        }
+        with pytest.raises(ValueError, match="normalised"):
+            ls.forwards(query=queries[0], normalise=False, **kwargs)
+        with pytest.raises(ValueError, match="checkpointing"):
+            ls.forwards(query=np.concatenate(queries, axis=0), **kwargs)
+        with pytest.raises(ValueError, match="positive"):
+            ls.forwards(query=queries[0], checkpoint_interval=0, **kwargs)
+        with pytest.raises(TypeError, match="integer"):
+            ls.forwards(query=queries[0], checkpoint_interval=2.5, **kwargs)
+        F_cp, _, _ = ls.forwards(query=queries[0], **kwargs)
+        with pytest.raises(IndexError):
+            F_cp[m]
@@ -0,0 +1,89 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+
+
+class TestSinglePrecision(lsbase.LSBase):
+    def assertAllCloseSingle(self, A, B):
+        np.testing.assert_allclose(A, B, rtol=1e-4, atol=1e-6)
+
+    def verify(self, ts, ploidy, include_ancestors):
+        if ploidy == 1:
+            H_vs, queries = self.get_examples_haploid(ts, include_ancestors)
+        else:
+            H_vs, queries = self.get_examples_diploid(ts, include_ancestors)
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        mu = np.zeros(m) + 0.01
+        for query in queries:
+            if ploidy == 2:
+                query = core.convert_haplotypes_to_unphased_genotypes(query)
+            kwargs = {
+                "reference_panel": H_vs,
+                "query": query,
+                "ploidy": ploidy,
+                "prob_recombination": r,
+                "prob_mutation": mu,
+            }
+            F, c, ll = ls.forwards(**kwargs)
+            F32, c32, ll32 = ls.forwards(dtype=np.float32, **kwargs)
+            assert F32.dtype == np.float32
+            assert c32.dtype == np.float64
+            self.assertAllCloseSingle(F32, F)
+            self.assertAllCloseSingle(c32, c)
+            self.assertAllCloseSingle(ll32, ll)
+
+            B = ls.backwards(normalisation_factor_from_forward=c, **kwargs)
+            B32 = ls.backwards(
+                normalisation_factor_from_forward=c32, dtype=np.float32, **kwargs
+            )
+            assert B32.dtype == np.float32
+            self.assertAllCloseSingle(B32, B)
+
+            P, _ = ls.posteriors(**kwargs)
+            P32, ll32 = ls.posteriors(dtype="float32", **kwargs)
+            assert P32.dtype == np.float32
+            self.assertAllCloseSingle(P32, P)
+            self.assertAllCloseSingle(ll32, ll)
+
+            ll32 = ls.log_likelihood(dtype=np.float32, **kwargs)
+            self.assertAllCloseSingle(ll32, ll)
+
+            path, ll_path = ls.viterbi(**kwargs)
+            path32, ll_path32 = ls.viterbi(dtype=np.float32, **kwargs)
+            self.assertAllCloseSingle(ll_path32, ll_path)
+            # Ties may be broken differently, so compare the likelihood of the path.
+            self.assertAllCloseSingle(ls.path_loglik(path=path32, **kwargs), ll_path)
+
+            ll32, _, ll_path32 = ls.forwards_viterbi(dtype=np.float32, **kwargs)
+            self.assertAllCloseSingle(ll32, ll)
+            self.assertAllCloseSingle(ll_path32, ll_path)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(self, ploidy, include_ancestors):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, ploidy, include_ancestors)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n8_high_recomb(self, ploidy, include_ancestors):
+        ts = self.get_ts_simple_n8_high_recomb()
+        self.verify(ts, ploidy, include_ancestors)
+
+    def test_unsupported_dtype(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        r = np.zeros(ts.num_sites) + 0.01
+        with pytest.raises(ValueError, match="float32 and float64"):
+            ls.forwards(
+                reference_panel=H_vs,
+                query=queries[0],
+                ploidy=1,
+                prob_recombination=r,
+                dtype=np.float16,
+            )
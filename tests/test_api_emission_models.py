@@ -0,0 +1,135 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+import lshmm.fb_haploid as fbh
+import lshmm.jit as jit
+import lshmm.vit_haploid as vh
+
+
+@jit.numba_njit
+def get_emission_probability_flat(ref_allele, query_allele, site, emission_matrix):
+    # Ignore the query allele at every other site.
+    if ref_allele == core.NONCOPY:
+        return 0.0
+    if query_allele == core.MISSING or site % 2 == 1:
+        return 1.0
+    if ref_allele != query_allele:
+        return emission_matrix[site, 0]
+    return emission_matrix[site, 1]
+
+
+ls.register_emission_model("checked", core.get_emission_probability_haploid)
+ls.register_emission_model("flat", get_emission_probability_flat)
+
+
+class TestEmissionModels(lsbase.ForwardBackwardAlgorithmBase):
+    def verify(self, ts, scale_mutation_rate, include_ancestors):
+        ploidy = 1
+        for n, m, H_vs, s, e_vs, r, mu in self.get_examples_pars(
+            ts,
+            ploidy=ploidy,
+            scale_mutation_rate=scale_mutation_rate,
+            include_ancestors=include_ancestors,
+            include_extreme_rates=True,
+        ):
+            kwargs = {
+                "reference_panel": H_vs,
+                "query": s,
+                "ploidy": ploidy,
+                "prob_recombination": r,
+                "prob_mutation": mu,
+                "scale_mutation_rate": scale_mutation_rate,
+            }
+            # The lookup table gives the same results as the checked emission function.
+            F, c, ll = ls.forwards(**kwargs)
+            F_tmp, c_tmp, ll_tmp = ls.forwards(emission_model="checked", **kwargs)
+            B = ls.backwards(normalisation_factor_from_forward=c, **kwargs)
+            B_tmp = ls.backwards(
+                normalisation_factor_from_forward=c, emission_model="checked", **kwargs
+            )
+            path, ll_path = ls.viterbi(**kwargs)
+            path_tmp, ll_path_tmp = ls.viterbi(emission_model="checked", **kwargs)
+            np.testing.assert_array_equal(F_tmp, F)
+            np.testing.assert_array_equal(c_tmp, c)
+            np.testing.assert_array_equal(ll_tmp, ll)
+            np.testing.assert_array_equal(B_tmp, B)
+            np.testing.assert_array_equal(path_tmp, path)
+            np.testing.assert_array_equal(ll_path_tmp, ll_path)
+
+            # A registered emission function is used by the kernels.
+            emission_func = get_emission_probability_flat
+            F_vs, c_vs, ll_vs = fbh.forwards_ls_hap(
+                n, m, H_vs, s, e_vs, r, emission_func, norm=True
+            )
+            B_vs = fbh.backwards_ls_hap(n, m, H_vs, s, e_vs, c_vs, r, emission_func)
+            V_vs, P_vs, ll_path_vs = vh.forwards_viterbi_hap_lower_mem_rescaling(
+                n, m, H_vs, s, e_vs, r, emission_func
+            )
+            path_vs = vh.backwards_viterbi_hap(m, V_vs, P_vs)
+            F, c, ll = ls.forwards(emission_model="flat", **kwargs)
+            B = ls.backwards(
+                normalisation_factor_from_forward=c, emission_model="flat", **kwargs
+            )
+            path, ll_path = ls.viterbi(emission_model="flat", **kwargs)
+            self.assertAllClose(F, F_vs)
+            self.assertAllClose(c, c_vs)
+            self.assertAllClose(ll, ll_vs)
+            self.assertAllClose(B, B_vs)
+            self.assertAllClose(ll_path, ll_path_vs)
+            self.assertAllClose(
+                ls.path_loglik(path=path, emission_model="flat", **kwargs),
+                ls.path_loglik(path=path_vs, emission_model="flat", **kwargs),
+            )
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_multiallelic_n10_no_recomb(
+        self, scale_mutation_rate, include_ancestors
+    ):
+        ts = self.get_ts_multiallelic_n10_no_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    def test_emission_lookup(self):
+        emission_matrix = np.array([[0.1, 0.7], [0.2, 0.6]])
+        emission_lookup = core.get_emission_lookup_haploid(emission_matrix)
+        for site in range(len(emission_matrix)):
+            for ref_allele in [core.NONCOPY, 0, 1, 2]:
+                for query_allele in [core.MISSING, 0, 1, 2]:
+                    expected = core.get_emission_probability_haploid(
+                        ref_allele, query_allele, site, emission_matrix
+                    )
+                    actual = core.lookup_emission_probability_haploid(
+                        None, ref_allele, query_allele, site, emission_lookup
+                    )
+                    assert actual == expected
+
+    def test_unsupported(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        r = np.zeros(ts.num_sites) + 0.01
+        kwargs = {
+            "reference_panel": H_vs,
+            "query": queries[0],
+            "prob_recombination": r,
+        }
+        with pytest.raises(ValueError, match="not registered"):
+            ls.forwards(ploidy=1, emission_model="unknown", **kwargs)
+        with pytest.raises(ValueError, match="ploidy 1"):
+            ls.viterbi(ploidy=2, emission_model="checked", **kwargs)
+        with pytest.raises(ValueError, match="string"):
+            ls.register_emission_model(None, get_emission_probability_flat)
+        if jit.ENABLE_NUMBA:
+            with pytest.raises(ValueError, match="compiled with Numba"):
+                ls.register_emission_model(
+                    "uncompiled", get_emission_probability_flat.py_func
+                )
@@ -0,0 +1,151 @@
+import asyncio
+import concurrent.futures
+import os
+import subprocess
+import sys
+
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+import lshmm.jit as jit
+
+
+class TestExecutor(lsbase.LSBase):
+    def verify(self, H_vs, queries, ploidy, r, mu):
+        panel = ls.prepare_panel(H_vs, ploidy)
+        kwargs = {
+            "ploidy": ploidy,
+            "prob_recombination": r,
+            "prob_mutation": mu,
+        }
+        expected_forwards = [
+            ls.forwards(reference_panel=H_vs, query=query, **kwargs)
+            for query in queries
+        ]
+        expected_viterbi = [
+            ls.viterbi(reference_panel=H_vs, query=query, **kwargs) for query in queries
+        ]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            forwards_futures = [
+                ls.submit_forwards(executor, panel, query, **kwargs)
+                for query in queries
+            ]
+            viterbi_futures = [
+                ls.submit_viterbi(executor, panel, query, **kwargs) for query in queries
+            ]
+            for future, expected in zip(forwards_futures, expected_forwards):
+                for x, x_expected in zip(future.result(), expected):
+                    self.assertAllClose(x, x_expected)
+            for future, expected in zip(viterbi_futures, expected_viterbi):
+                path, ll = future.result()
+                np.testing.assert_array_equal(path, expected[0])
+                self.assertAllClose(ll, expected[1])
+
+            async def run_all():
+                return await asyncio.gather(
+                    *[
+                        ls.forwards_async(panel, query, executor=executor, **kwargs)
+                        for query in queries
+                    ],
+                    *[ls.viterbi_async(panel, query, **kwargs) for query in queries],
+                )
+
+            results = asyncio.run(run_all())
+            for result, expected in zip(results, expected_forwards + expected_viterbi):
+                for x, x_expected in zip(result, expected):
+                    self.assertAllClose(x, x_expected)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(self, ploidy, include_ancestors):
+        ts = self.get_ts_simple_n10_no_recomb()
+        if ploidy == 1:
+            H_vs, queries = self.get_examples_haploid(ts, include_ancestors)
+        else:
+            H_vs, queries = self.get_examples_diploid(ts, include_ancestors)
+            queries = [
+                core.convert_haplotypes_to_unphased_genotypes(q) for q in queries
+            ]
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        mu = np.zeros(m) + 0.01
+        self.verify(H_vs, queries, ploidy, r, mu)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    def test_concurrent_batches(self, ploidy):
+        ts = self.get_ts_simple(8)
+        if ploidy == 1:
+            H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+            batch = np.concatenate(queries)
+        else:
+            H_vs, queries = self.get_examples_diploid(ts, include_ancestors=False)
+            batch = np.concatenate(
+                [core.convert_haplotypes_to_unphased_genotypes(q) for q in queries]
+            )
+        batch = np.concatenate([batch] * 4)
+        m = ts.num_sites
+        kwargs = {
+            "ploidy": ploidy,
+            "prob_recombination": np.append([0], np.zeros(m - 1) + 0.01),
+            "prob_mutation": np.zeros(m) + 0.01,
+        }
+        try:
+            path_vs, ll_vs = ls.viterbi(reference_panel=H_vs, query=batch, **kwargs)
+            jit.check_concurrent_parallel_kernels()
+        except RuntimeError:
+            pytest.skip("Parallel kernels cannot be run concurrently.")
+        panel = ls.prepare_panel(H_vs, ploidy)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                ls.submit_viterbi(executor, panel, batch, num_threads=2, **kwargs)
+                for _ in range(8)
+            ]
+            for future in futures:
+                path, ll = future.result()
+                if ploidy == 1:
+                    np.testing.assert_array_equal(path, path_vs)
+                else:
+                    for x, x_vs in zip(path, path_vs):
+                        np.testing.assert_array_equal(x, x_vs)
+                self.assertAllClose(ll, ll_vs)
+
+    def test_workqueue_threading_layer(self):
+        code = """
+import concurrent.futures
+import numpy as np
+import lshmm as ls
+H = np.zeros((4, 3), dtype=np.int8)
+query = np.zeros((2, 4), dtype=np.int8)
+with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+    try:
+        ls.submit_viterbi(executor, H, query, 1, np.zeros(4) + 0.01)
+    except RuntimeError as e:
+        assert "workqueue" in str(e)
+    else:
+        assert ls.jit.ENABLE_NUMBA is False
+"""
+        env = {**os.environ, "NUMBA_THREADING_LAYER": "workqueue"}
+        subprocess.run([sys.executable, "-c", code], check=True, env=env)
+
+    def test_invalid_query(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        query = queries[0].copy()
+        query[0, 0] = core.NONCOPY
+        r = np.zeros(ts.num_sites) + 0.01
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            future = ls.submit_viterbi(executor, H_vs, query, 1, r, prob_mutation=0.01)
+            with pytest.raises(ValueError, match="NONCOPY"):
+                future.result()
+
+    def test_check_alleles(self):
+        array = np.array([[0, 1, 2], [1, core.MISSING, 0]], dtype=np.int8)
+        assert core.has_allele(array, core.MISSING)
+        assert not core.has_allele(array, core.NONCOPY)
+        assert core.has_only_alleles(array, np.array([0, 1, 2, core.MISSING]))
+        assert not core.has_only_alleles(array, np.array([0, 1, 2]))
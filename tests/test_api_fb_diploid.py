@@ -2,7 +2,6 @@ import pytest
 
 from . import lsbase
 import lshmm as ls
-import lshmm.core as core
 import lshmm.fb_diploid as fbd
 
 
@@ -16,12 +15,10 @@ class TestForwardBackwardDiploid(lsbase.ForwardBackwardAlgorithmBase):
             include_ancestors=include_ancestors,
             include_extreme_rates=True,
         ):
-            G_vs = core.convert_haplotypes_to_phased_genotypes(H_vs)
-
             F_vs, c_vs, ll_vs = fbd.forward_ls_dip_loop(
                 n=n,
                 m=m,
-                G=G_vs,
+                H=H_vs,
                 s=query,
                 e=e_vs,
                 r=r,
@@ -30,7 +27,7 @@ class TestForwardBackwardDiploid(lsbase.ForwardBackwardAlgorithmBase):
             B_vs = fbd.backward_ls_dip_loop(
                 n=n,
                 m=m,
-                G=G_vs,
+                H=H_vs,
                 s=query,
                 e=e_vs,
                 c=c_vs,
@@ -0,0 +1,128 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+import lshmm.fb_diploid as fbd
+
+
+class TestForwardBackwardDiploidSparse(lsbase.ForwardBackwardAlgorithmBase):
+    def assertProbsClose(self, A, B):
+        # As in the haploid case, small probabilities are only accurate
+        # relative to the largest ones at the same site. The backward probabilities
+        # of the pairs of haplotypes that are unlikely to be copied from can be
+        # very large, so the tolerance is looser here.
+        scale = np.max(np.abs(B), axis=(-2, -1), keepdims=True)
+        np.testing.assert_array_less(np.abs(A - B), 1e-9 * np.abs(B) + 1e-8 * scale)
+
+    def verify(self, ts, scale_mutation_rate, include_ancestors):
+        ploidy = 2
+        for n, m, H_vs, query, e_vs, r, mu in self.get_examples_pars(
+            ts,
+            ploidy=ploidy,
+            scale_mutation_rate=scale_mutation_rate,
+            include_ancestors=include_ancestors,
+            include_extreme_rates=True,
+        ):
+            F_vs, c_vs, ll_vs = fbd.forward_ls_dip_loop(
+                n=n, m=m, H=H_vs, s=query, e=e_vs, r=r, norm=True
+            )
+            B_vs = fbd.backward_ls_dip_loop(
+                n=n, m=m, H=H_vs, s=query, e=e_vs, c=c_vs, r=r
+            )
+            kwargs = {
+                "reference_panel": ls.prepare_panel(H_vs, ploidy),
+                "query": query,
+                "ploidy": ploidy,
+                "prob_recombination": r,
+                "prob_mutation": mu,
+                "scale_mutation_rate": scale_mutation_rate,
+            }
+            F, c, ll = ls.forwards(sparse=True, **kwargs)
+            B = ls.backwards(normalisation_factor_from_forward=c, sparse=True, **kwargs)
+            ll_tmp, c_tmp = ls.log_likelihood(
+                return_normalisation_factor=True, sparse=True, **kwargs
+            )
+            self.assertAllClose(c, c_vs)
+            self.assertAllClose(ll, ll_vs)
+            self.assertAllClose(c_tmp, c_vs)
+            self.assertAllClose(ll_tmp, ll_vs)
+            self.assertProbsClose(F, F_vs)
+            self.assertProbsClose(B, B_vs)
+            # Non-copiable entries are set exactly.
+            np.testing.assert_array_equal(F == 0, F_vs == 0)
+
+    def verify_batch(self, ts, include_ancestors):
+        ploidy = 2
+        H_vs, queries = self.get_examples_diploid(ts, include_ancestors)
+        query_batch = core.convert_haplotypes_to_unphased_genotypes(
+            np.concatenate(queries, axis=0)
+        )
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        kwargs = {
+            "reference_panel": H_vs,
+            "ploidy": ploidy,
+            "prob_recombination": r,
+            "prob_mutation": np.zeros(m) + 0.01,
+        }
+        F, c, ll = ls.forwards(query=query_batch, sparse=True, **kwargs)
+        B = ls.backwards(
+            query=query_batch,
+            normalisation_factor_from_forward=c,
+            sparse=True,
+            **kwargs,
+        )
+        ll_batch = ls.log_likelihood(query=query_batch, sparse=True, **kwargs)
+        for i in range(len(queries)):
+            query = query_batch[[i]]
+            F_vs, c_vs, ll_vs = ls.forwards(query=query, **kwargs)
+            B_vs = ls.backwards(
+                query=query, normalisation_factor_from_forward=c_vs, **kwargs
+            )
+            self.assertAllClose(c[i], c_vs)
+            self.assertAllClose(ll[i], ll_vs)
+            self.assertAllClose(ll_batch[i], ll_vs)
+            self.assertProbsClose(F[i], F_vs)
+            self.assertProbsClose(B[i], B_vs)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("num_samples", [8, 16])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple(self, num_samples, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple(num_samples)
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n8_high_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n8_high_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_batch(self, include_ancestors):
+        ts = self.get_ts_simple(8)
+        self.verify_batch(ts, include_ancestors)
+
+    def test_unordered_pairs(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H_vs, queries = self.get_examples_diploid(ts, include_ancestors=False)
+        query = core.convert_haplotypes_to_unphased_genotypes(queries[0])
+        r = np.zeros(ts.num_sites) + 0.01
+        with pytest.raises(ValueError, match="unordered pairs"):
+            ls.forwards(
+                reference_panel=H_vs,
+                query=query,
+                ploidy=2,
+                prob_recombination=r,
+                unordered_pairs=True,
+                sparse=True,
+            )
@@ -0,0 +1,71 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+
+
+class TestForwardBackwardHaploidBatch(lsbase.ForwardBackwardAlgorithmBase):
+    def verify(self, ts, scale_mutation_rate, include_ancestors):
+        ploidy = 1
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors)
+        query_batch = np.concatenate(queries, axis=0)
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        for mu in [np.zeros(m) + 0.01, None]:
+            F, c, ll = ls.forwards(
+                reference_panel=H_vs,
+                query=query_batch,
+                ploidy=ploidy,
+                prob_recombination=r,
+                prob_mutation=mu,
+                scale_mutation_rate=scale_mutation_rate,
+                normalise=True,
+            )
+            B = ls.backwards(
+                reference_panel=H_vs,
+                query=query_batch,
+                ploidy=ploidy,
+                normalisation_factor_from_forward=c,
+                prob_recombination=r,
+                prob_mutation=mu,
+                scale_mutation_rate=scale_mutation_rate,
+            )
+            assert F.shape == (len(queries), m, H_vs.shape[1])
+            assert B.shape == F.shape
+            for i, query in enumerate(queries):
+                F_vs, c_vs, ll_vs = ls.forwards(
+                    reference_panel=H_vs,
+                    query=query,
+                    ploidy=ploidy,
+                    prob_recombination=r,
+                    prob_mutation=mu,
+                    scale_mutation_rate=scale_mutation_rate,
+                    normalise=True,
+                )
+                B_vs = ls.backwards(
+                    reference_panel=H_vs,
+                    query=query,
+                    ploidy=ploidy,
+                    normalisation_factor_from_forward=c_vs,
+                    prob_recombination=r,
+                    prob_mutation=mu,
+                    scale_mutation_rate=scale_mutation_rate,
+                )
+                self.assertAllClose(F[i], F_vs)
+                self.assertAllClose(c[i], c_vs)
+                self.assertAllClose(B[i], B_vs)
+                self.assertAllClose(ll[i], ll_vs)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_multiallelic_n16(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_multiallelic(16)
+        self.verify(ts, scale_mutation_rate, include_ancestors)
@@ -0,0 +1,128 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+import lshmm.fb_haploid as fbh
+
+
+class TestForwardBackwardHaploidSparse(lsbase.ForwardBackwardAlgorithmBase):
+    def assertProbsClose(self, A, B):
+        # The sparse kernels recover the probabilities from a shared affine transform,
+        # so small probabilities are only accurate relative to the largest ones.
+        scale = np.max(np.abs(B), axis=-1, keepdims=True)
+        np.testing.assert_array_less(np.abs(A - B), 1e-9 * np.abs(B) + 1e-11 * scale)
+
+    def verify(self, ts, scale_mutation_rate, include_ancestors):
+        ploidy = 1
+        emission_func = core.get_emission_probability_haploid
+        for n, m, H_vs, s, e_vs, r, mu in self.get_examples_pars(
+            ts,
+            ploidy=ploidy,
+            scale_mutation_rate=scale_mutation_rate,
+            include_ancestors=include_ancestors,
+            include_extreme_rates=True,
+        ):
+            F_vs, c_vs, ll_vs = fbh.forwards_ls_hap(
+                n, m, H_vs, s, e_vs, r, emission_func, norm=True
+            )
+            B_vs = fbh.backwards_ls_hap(n, m, H_vs, s, e_vs, c_vs, r, emission_func)
+            kwargs = {
+                "reference_panel": ls.prepare_panel(H_vs, ploidy),
+                "query": s,
+                "ploidy": ploidy,
+                "prob_recombination": r,
+                "prob_mutation": mu,
+                "scale_mutation_rate": scale_mutation_rate,
+            }
+            F, c, ll = ls.forwards(sparse=True, **kwargs)
+            B = ls.backwards(normalisation_factor_from_forward=c, sparse=True, **kwargs)
+            ll_tmp, c_tmp = ls.log_likelihood(
+                return_normalisation_factor=True, sparse=True, **kwargs
+            )
+            self.assertAllClose(c, c_vs)
+            self.assertAllClose(ll, ll_vs)
+            self.assertAllClose(c_tmp, c_vs)
+            self.assertAllClose(ll_tmp, ll_vs)
+            self.assertProbsClose(F, F_vs)
+            self.assertProbsClose(B, B_vs)
+            # Non-copiable entries are set exactly.
+            np.testing.assert_array_equal(F == 0, F_vs == 0)
+
+    def verify_batch(self, ts, include_ancestors):
+        ploidy = 1
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors)
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        kwargs = {
+            "reference_panel": H_vs,
+            "ploidy": ploidy,
+            "prob_recombination": r,
+            "prob_mutation": np.zeros(m) + 0.01,
+        }
+        query_batch = np.concatenate(queries, axis=0)
+        F, c, ll = ls.forwards(query=query_batch, sparse=True, **kwargs)
+        B = ls.backwards(
+            query=query_batch,
+            normalisation_factor_from_forward=c,
+            sparse=True,
+            **kwargs,
+        )
+        ll_batch = ls.log_likelihood(query=query_batch, sparse=True, **kwargs)
+        for i, query in enumerate(queries):
+            F_vs, c_vs, ll_vs = ls.forwards(query=query, **kwargs)
+            B_vs = ls.backwards(
+                query=query, normalisation_factor_from_forward=c_vs, **kwargs
+            )
+            self.assertAllClose(c[i], c_vs)
+            self.assertAllClose(ll[i], ll_vs)
+            self.assertAllClose(ll_batch[i], ll_vs)
+            self.assertProbsClose(F[i], F_vs)
+            self.assertProbsClose(B[i], B_vs)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("num_samples", [8, 16])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple(self, num_samples, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple(num_samples)
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n8_high_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n8_high_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("num_samples", [4, 8])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_multiallelic(self, num_samples, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_multiallelic(num_samples)
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_batch(self, include_ancestors):
+        ts = self.get_ts_simple(8)
+        self.verify_batch(ts, include_ancestors)
+
+    def test_get_minor_allele_index(self):
+        H = np.array(
+            [
+                [0, 0, 1, 0],
+                [1, 1, 0, 1],
+                [core.NONCOPY, core.NONCOPY, core.NONCOPY, 2],
+            ],
+            dtype=np.int8,
+        )
+        major_alleles, minor_offsets, minor_haps = core.get_minor_allele_index(H)
+        np.testing.assert_array_equal(major_alleles, [0, 1, core.NONCOPY])
+        np.testing.assert_array_equal(minor_offsets, [0, 1, 2, 3])
+        np.testing.assert_array_equal(minor_haps, [2, 2, 3])
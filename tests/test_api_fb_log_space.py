@@ -0,0 +1,94 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+
+
+class TestForwardLogSpace(lsbase.ForwardBackwardAlgorithmBase):
+    def verify(self, ts, ploidy, scale_mutation_rate, include_ancestors):
+        if ploidy == 1:
+            H_vs, queries = self.get_examples_haploid(ts, include_ancestors)
+        else:
+            H_vs, queries = self.get_examples_diploid(ts, include_ancestors)
+            queries = [
+                core.convert_haplotypes_to_unphased_genotypes(query)
+                for query in queries
+            ]
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        for mu in [np.zeros(m) + 0.01, None]:
+            kwargs = {
+                "reference_panel": H_vs,
+                "ploidy": ploidy,
+                "prob_recombination": r,
+                "prob_mutation": mu,
+                "scale_mutation_rate": scale_mutation_rate,
+            }
+            for query in queries:
+                F, c, ll = ls.forwards(query=query, normalise=True, **kwargs)
+                F_tilde, c_tilde, ll_tilde = ls.forwards(
+                    query=query, normalise=False, **kwargs
+                )
+                log_F, c_log, ll_log = ls.forwards(
+                    query=query, log_space=True, **kwargs
+                )
+                self.assertAllClose(ll_tilde, ll)
+                self.assertAllClose(ll_log, ll)
+                self.assertAllClose(c_log, c_tilde)
+                self.assertAllClose(10**log_F, F_tilde)
+                # Unnormalised and normalised forward probabilities are related by c.
+                # Forward probabilities of NONCOPY states are zero.
+                log_scale = np.cumsum(np.log10(c))
+                log_scale = log_scale.reshape((m,) + (1,) * ploidy)
+                with np.errstate(divide="ignore"):
+                    self.assertAllClose(log_F, np.log10(F) + log_scale)
+            query_batch = np.concatenate(queries, axis=0)
+            log_F, c_log, ll_log = ls.forwards(
+                query=query_batch, log_space=True, **kwargs
+            )
+            assert c_log.shape == (len(queries), m)
+            for i, query in enumerate(queries):
+                log_F_vs, _, ll_vs = ls.forwards(query=query, log_space=True, **kwargs)
+                self.assertAllClose(log_F[i], log_F_vs)
+                self.assertAllClose(ll_log[i], ll_vs)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(
+        self, ploidy, scale_mutation_rate, include_ancestors
+    ):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, ploidy, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n8_high_recomb(
+        self, ploidy, scale_mutation_rate, include_ancestors
+    ):
+        ts = self.get_ts_simple_n8_high_recomb()
+        self.verify(ts, ploidy, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_multiallelic_n16(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_multiallelic(16)
+        self.verify(ts, 1, scale_mutation_rate, include_ancestors)
+
+    def test_normalise_in_log_space(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        r = np.zeros(ts.num_sites) + 0.01
+        with pytest.raises(ValueError, match="log space"):
+            ls.forwards(
+                reference_panel=H_vs,
+                query=queries[0],
+                ploidy=1,
+                prob_recombination=r,
+                normalise=True,
+                log_space=True,
+            )
@@ -0,0 +1,63 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+
+
+class TestForwardsViterbi(lsbase.ViterbiAlgorithmBase):
+    def verify(self, ts, ploidy, scale_mutation_rate, include_ancestors):
+        if ploidy == 1:
+            H_vs, queries = self.get_examples_haploid(ts, include_ancestors)
+        else:
+            H_vs, queries = self.get_examples_diploid(ts, include_ancestors)
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        for mu in [np.zeros(m) + 0.01, None]:
+            for query in queries:
+                if ploidy == 2:
+                    query = core.convert_haplotypes_to_unphased_genotypes(query)
+                kwargs = {
+                    "reference_panel": H_vs,
+                    "query": query,
+                    "ploidy": ploidy,
+                    "prob_recombination": r,
+                    "prob_mutation": mu,
+                    "scale_mutation_rate": scale_mutation_rate,
+                }
+                _, _, ll_vs = ls.forwards(**kwargs)
+                path_vs, ll_path_vs = ls.viterbi(**kwargs)
+                ll, path, ll_path = ls.forwards_viterbi(**kwargs)
+                self.assertAllClose(ll, ll_vs)
+                self.assertAllClose(ll_path, ll_path_vs)
+                if ploidy == 1:
+                    assert np.array_equal(path, path_vs)
+                else:
+                    assert np.array_equal(path[0], path_vs[0])
+                    assert np.array_equal(path[1], path_vs[1])
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(
+        self, ploidy, scale_mutation_rate, include_ancestors
+    ):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, ploidy, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n8_high_recomb(
+        self, ploidy, scale_mutation_rate, include_ancestors
+    ):
+        ts = self.get_ts_simple_n8_high_recomb()
+        self.verify(ts, ploidy, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_multiallelic_n16(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_multiallelic(16)
+        self.verify(ts, 1, scale_mutation_rate, include_ancestors)
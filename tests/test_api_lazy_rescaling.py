@@ -0,0 +1,98 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+
+
+class TestLazyRescaling(lsbase.LSBase):
+    def verify(self, H_vs, query, ploidy, r, mu, dtype=np.float64):
+        kwargs = {
+            "reference_panel": H_vs,
+            "query": query,
+            "ploidy": ploidy,
+            "prob_recombination": r,
+            "prob_mutation": mu,
+            "dtype": dtype,
+        }
+        F, c, ll = ls.forwards(**kwargs)
+        F_tmp, c_tmp, ll_tmp = ls.forwards(lazy_rescaling=True, **kwargs)
+        B = ls.backwards(normalisation_factor_from_forward=c, **kwargs)
+        B_tmp = ls.backwards(normalisation_factor_from_forward=c_tmp, **kwargs)
+        F_sums = np.sum(F_tmp, axis=tuple(range(F.ndim - ploidy, F.ndim)))
+        if dtype == np.float64:
+            self.assertAllClose(ll_tmp, ll)
+            self.assertAllClose(F_tmp / F_sums.reshape(F_sums.shape + (1,) * ploidy), F)
+            self.assertAllClose(F_tmp * B_tmp, F * B)
+        else:
+            np.testing.assert_allclose(ll_tmp, ll, rtol=1e-5)
+            np.testing.assert_allclose(F_tmp * B_tmp, F * B, rtol=1e-4, atol=1e-6)
+        # The forward probabilities at the last site are always normalised.
+        np.testing.assert_allclose(F_sums[..., -1], 1, rtol=1e-5)
+
+        path, ll_path = ls.viterbi(**kwargs)
+        path_tmp, ll_path_tmp = ls.viterbi(lazy_rescaling=True, **kwargs)
+        np.testing.assert_allclose(ll_path_tmp, ll_path, rtol=1e-5)
+        if query.shape[0] == 1:
+            # Ties may be broken differently, so compare the likelihood of the path.
+            del kwargs["dtype"]
+            self.assertAllClose(
+                ls.path_loglik(path=path_tmp, **kwargs),
+                ls.path_loglik(path=path, **kwargs),
+            )
+        return c_tmp
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(self, ploidy, include_ancestors):
+        ts = self.get_ts_simple_n10_no_recomb()
+        if ploidy == 1:
+            H_vs, queries = self.get_examples_haploid(ts, include_ancestors)
+        else:
+            H_vs, queries = self.get_examples_diploid(ts, include_ancestors)
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        mu = np.zeros(m) + 0.01
+        for query in queries:
+            if ploidy == 2:
+                query = core.convert_haplotypes_to_unphased_genotypes(query)
+            c_tmp = self.verify(H_vs, query, ploidy, r, mu)
+            # The probabilities are too large to need rescaling before the last site.
+            np.testing.assert_array_equal(c_tmp[:-1], 1)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("dtype", [np.float64, np.float32])
+    def test_long_query(self, ploidy, dtype):
+        # A random query on a random panel underflows without rescaling.
+        rng = np.random.default_rng(42)
+        n = 12 if ploidy == 1 else 6
+        m = 1000
+        H_vs = rng.integers(0, 2, size=(m, n)).astype(np.int8)
+        r = np.append([0], np.zeros(m - 1) + 0.05)
+        mu = np.zeros(m) + 0.05
+        query = rng.integers(0, ploidy + 1, size=(2, m)).astype(np.int8)
+        for q in [query[:1], query]:
+            c_tmp = self.verify(H_vs, q, ploidy, r, mu, dtype=dtype)
+            num_rescaled = np.sum(c_tmp != 1, axis=-1)
+            assert np.all(num_rescaled > 1)
+            assert np.all(num_rescaled < m // 10)
+
+    def test_unsupported(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        r = np.zeros(ts.num_sites) + 0.01
+        kwargs = {
+            "reference_panel": H_vs,
+            "query": queries[0],
+            "ploidy": 1,
+            "prob_recombination": r,
+            "lazy_rescaling": True,
+        }
+        with pytest.raises(ValueError, match="Lazy rescaling"):
+            ls.forwards(normalise=False, **kwargs)
+        with pytest.raises(ValueError, match="Lazy rescaling"):
+            ls.forwards(checkpoint=True, **kwargs)
+        with pytest.raises(ValueError, match="Lazy rescaling"):
+            ls.viterbi(sparse=True, **kwargs)
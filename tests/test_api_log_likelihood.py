@@ -0,0 +1,71 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+
+
+class TestLogLikelihood(lsbase.ForwardBackwardAlgorithmBase):
+    def verify(self, ts, ploidy, scale_mutation_rate, include_ancestors):
+        if ploidy == 1:
+            H_vs, queries = self.get_examples_haploid(ts, include_ancestors)
+        else:
+            H_vs, queries = self.get_examples_diploid(ts, include_ancestors)
+            queries = [
+                core.convert_haplotypes_to_unphased_genotypes(query)
+                for query in queries
+            ]
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        for mu in [np.zeros(m) + 0.01, None]:
+            kwargs = {
+                "reference_panel": H_vs,
+                "ploidy": ploidy,
+                "prob_recombination": r,
+                "prob_mutation": mu,
+                "scale_mutation_rate": scale_mutation_rate,
+            }
+            for query in queries:
+                _, c_vs, ll_vs = ls.forwards(query=query, **kwargs)
+                ll = ls.log_likelihood(query=query, **kwargs)
+                self.assertAllClose(ll, ll_vs)
+                ll, c = ls.log_likelihood(
+                    query=query, return_normalisation_factor=True, **kwargs
+                )
+                self.assertAllClose(ll, ll_vs)
+                self.assertAllClose(c, c_vs)
+            query_batch = np.concatenate(queries, axis=0)
+            _, c_vs, ll_vs = ls.forwards(query=query_batch, **kwargs)
+            ll, c = ls.log_likelihood(
+                query=query_batch, return_normalisation_factor=True, **kwargs
+            )
+            assert ll.shape == (len(queries),)
+            assert c.shape == (len(queries), m)
+            self.assertAllClose(ll, ll_vs)
+            self.assertAllClose(c, c_vs)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(
+        self, ploidy, scale_mutation_rate, include_ancestors
+    ):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, ploidy, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n8_high_recomb(
+        self, ploidy, scale_mutation_rate, include_ancestors
+    ):
+        ts = self.get_ts_simple_n8_high_recomb()
+        self.verify(ts, ploidy, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_multiallelic_n16(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_multiallelic(16)
+        self.verify(ts, 1, scale_mutation_rate, include_ancestors)
@@ -0,0 +1,286 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+import lshmm.fb_diploid as fbd
+import lshmm.fb_haploid as fbh
+import lshmm.vit_diploid as vd
+import lshmm.vit_haploid as vh
+
+
+class TestParallelHaploid(lsbase.ForwardBackwardAlgorithmBase):
+    def verify(self, ts, scale_mutation_rate, include_ancestors):
+        ploidy = 1
+        for n, m, H_vs, s, e_vs, r, mu in self.get_examples_pars(
+            ts,
+            ploidy=ploidy,
+            scale_mutation_rate=scale_mutation_rate,
+            include_ancestors=include_ancestors,
+            include_extreme_rates=True,
+        ):
+            emission_func = core.get_emission_probability_haploid
+            F_vs, c_vs, ll_vs = fbh.forwards_ls_hap(
+                n, m, H_vs, s, e_vs, r, emission_func, norm=True
+            )
+            B_vs = fbh.backwards_ls_hap(n, m, H_vs, s, e_vs, c_vs, r, emission_func)
+            V_vs, V_argmaxes_vs, recomb_offsets_vs, recomb_haps_vs, ll_path_vs = (
+                vh.forwards_viterbi_hap_lower_mem_rescaling_compact(
+                    n, m, H_vs, s, e_vs, r, emission_func
+                )
+            )
+            # Use small blocks, so that the haplotypes are split across several blocks.
+            for block_size in [1, 3, n]:
+                F, c, ll = fbh.forwards_ls_hap_parallel(
+                    n, m, H_vs, s, e_vs, r, emission_func, block_size=block_size
+                )
+                B = fbh.backwards_ls_hap_parallel(
+                    n, m, H_vs, s, e_vs, c, r, emission_func, block_size=block_size
+                )
+                V, V_argmaxes, recomb_offsets, recomb_haps, ll_path = (
+                    vh.forwards_viterbi_hap_parallel(
+                        n, m, H_vs, s, e_vs, r, emission_func, block_size=block_size
+                    )
+                )
+                self.assertAllClose(F, F_vs)
+                self.assertAllClose(c, c_vs)
+                self.assertAllClose(ll, ll_vs)
+                self.assertAllClose(B, B_vs)
+                self.assertAllClose(V, V_vs)
+                self.assertAllClose(ll_path, ll_path_vs)
+                np.testing.assert_array_equal(V_argmaxes, V_argmaxes_vs)
+                np.testing.assert_array_equal(recomb_offsets, recomb_offsets_vs)
+                np.testing.assert_array_equal(recomb_haps, recomb_haps_vs)
+
+            kwargs = {
+                "reference_panel": H_vs,
+                "query": s,
+                "ploidy": ploidy,
+                "prob_recombination": r,
+                "prob_mutation": mu,
+                "scale_mutation_rate": scale_mutation_rate,
+            }
+            for num_threads in [1, 2]:
+                F, c, ll = ls.forwards(num_threads=num_threads, **kwargs)
+                B = ls.backwards(
+                    normalisation_factor_from_forward=c,
+                    num_threads=num_threads,
+                    **kwargs,
+                )
+                path, ll_path = ls.viterbi(num_threads=num_threads, **kwargs)
+                self.assertAllClose(F, F_vs)
+                self.assertAllClose(c, c_vs)
+                self.assertAllClose(ll, ll_vs)
+                self.assertAllClose(B, B_vs)
+                self.assertAllClose(ll_path, ll_path_vs)
+                np.testing.assert_array_equal(
+                    path,
+                    vh.backwards_viterbi_hap_compact(
+                        m, V_vs, V_argmaxes_vs, recomb_offsets_vs, recomb_haps_vs
+                    ),
+                )
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("num_samples", [8, 16])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple(self, num_samples, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple(num_samples)
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_multiallelic_n10_no_recomb(
+        self, scale_mutation_rate, include_ancestors
+    ):
+        ts = self.get_ts_multiallelic_n10_no_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    def test_num_threads(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        r = np.zeros(ts.num_sites) + 0.01
+        kwargs = {
+            "reference_panel": H_vs,
+            "query": queries[0],
+            "ploidy": 1,
+            "prob_recombination": r,
+        }
+        for num_threads in [0, -1, 1.5]:
+            with pytest.raises(ValueError, match="Number of threads"):
+                ls.forwards(num_threads=num_threads, **kwargs)
+
+    def test_unsupported_num_threads(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        r = np.zeros(ts.num_sites) + 0.01
+        kwargs = {
+            "reference_panel": H_vs,
+            "ploidy": 1,
+            "prob_recombination": r,
+            "num_threads": 2,
+        }
+        _, c, _ = ls.forwards(query=queries[0], **kwargs)
+        batch = np.concatenate(queries)
+        for func_kwargs in [
+            {"checkpoint": True},
+            {"log_space": True},
+            {"sparse": True},
+        ]:
+            with pytest.raises(ValueError, match="threads"):
+                ls.forwards(query=queries[0], **kwargs, **func_kwargs)
+        with pytest.raises(ValueError, match="threads"):
+            ls.forwards(query=batch, **kwargs)
+        for func_kwargs in [{"checkpoint": True}, {"sparse": True}]:
+            with pytest.raises(ValueError, match="threads"):
+                ls.backwards(
+                    query=queries[0],
+                    normalisation_factor_from_forward=c,
+                    **kwargs,
+                    **func_kwargs,
+                )
+            with pytest.raises(ValueError, match="threads"):
+                ls.viterbi(query=queries[0], **kwargs, **func_kwargs)
+        # Batches of queries are run in parallel by viterbi.
+        ls.viterbi(query=batch, sparse=True, **kwargs)
+
+    def test_import_starts_no_threads(self):
+        # Starting the threads on import would make it unsafe to fork the process.
+        code = "import lshmm; import numba.np.ufunc.parallel as p; "
+        code += "assert not p._is_initialized"
+        subprocess.run([sys.executable, "-c", code], check=True)
+
+    def test_parallel_kernel_from_cache(self, tmp_path):
+        # A kernel calling parallel kernels can be called directly, both when it
+        # is compiled and when it is loaded from the cache.
+        code = """
+import numpy as np
+import lshmm.fb_haploid as fbh
+H = np.zeros((5, 4), dtype=np.int8)
+s = np.zeros((1, 5), dtype=np.int8)
+e = np.zeros((5, 4)) + 0.5
+r = np.zeros(5) + 0.01
+_, _, ll = fbh.forwards_ls_hap_parallel(4, 5, H, s, e, r, None)
+assert np.isclose(ll, 5 * np.log10(0.5))
+"""
+        env = {**os.environ, "NUMBA_CACHE_DIR": str(tmp_path)}
+        for _ in range(2):
+            subprocess.run([sys.executable, "-c", code], check=True, env=env)
+        assert len(os.listdir(tmp_path)) > 0
+
+
+class TestParallelDiploid(lsbase.ForwardBackwardAlgorithmBase):
+    def verify(self, ts, scale_mutation_rate, include_ancestors):
+        ploidy = 2
+        for n, m, H_vs, query, e_vs, r, mu in self.get_examples_pars(
+            ts,
+            ploidy=ploidy,
+            scale_mutation_rate=scale_mutation_rate,
+            include_ancestors=include_ancestors,
+            include_extreme_rates=True,
+        ):
+            num_copiable_entries = core.get_num_copiable_entries_diploid(H_vs)
+            F_vs, c_vs, ll_vs = fbd.forward_ls_dip_loop(
+                n, m, H_vs, query, e_vs, r, True, num_copiable_entries
+            )
+            B_vs = fbd.backward_ls_dip_loop(
+                n, m, H_vs, query, e_vs, c_vs, r, num_copiable_entries
+            )
+            viterbi_vs = vd.forwards_viterbi_dip_low_mem_packed(
+                n, m, H_vs, query, e_vs, r, num_copiable_entries
+            )
+            # Use small blocks, so that the rows are split across several blocks.
+            for block_size in [1, 3, 4, 8]:
+                F, c, ll = fbd.forward_ls_dip_loop_parallel(
+                    n,
+                    m,
+                    H_vs,
+                    query,
+                    e_vs,
+                    r,
+                    num_copiable_entries=num_copiable_entries,
+                    block_size=block_size,
+                )
+                B = fbd.backward_ls_dip_loop_parallel(
+                    n,
+                    m,
+                    H_vs,
+                    query,
+                    e_vs,
+                    c,
+                    r,
+                    num_copiable_entries=num_copiable_entries,
+                    block_size=block_size,
+                )
+                self.assertAllClose(F, F_vs)
+                self.assertAllClose(c, c_vs)
+                self.assertAllClose(ll, ll_vs)
+                self.assertAllClose(B, B_vs)
+                if block_size % 4 != 0:
+                    with pytest.raises(ValueError, match="multiple of 4"):
+                        vd.forwards_viterbi_dip_low_mem_packed_parallel(
+                            n, m, H_vs, query, e_vs, r, block_size=block_size
+                        )
+                    continue
+                viterbi = vd.forwards_viterbi_dip_low_mem_packed_parallel(
+                    n,
+                    m,
+                    H_vs,
+                    query,
+                    e_vs,
+                    r,
+                    num_copiable_entries=num_copiable_entries,
+                    block_size=block_size,
+                )
+                self.assertAllClose(viterbi[0], viterbi_vs[0])
+                self.assertAllClose(viterbi[4], viterbi_vs[4])
+                for x, x_vs in zip(viterbi[1:4], viterbi_vs[1:4]):
+                    np.testing.assert_array_equal(x, x_vs)
+
+            kwargs = {
+                "reference_panel": H_vs,
+                "query": query,
+                "ploidy": ploidy,
+                "prob_recombination": r,
+                "prob_mutation": mu,
+                "scale_mutation_rate": scale_mutation_rate,
+            }
+            path_vs, _ = ls.viterbi(**kwargs)
+            for num_threads in [1, 2]:
+                F, c, ll = ls.forwards(num_threads=num_threads, **kwargs)
+                B = ls.backwards(
+                    normalisation_factor_from_forward=c,
+                    num_threads=num_threads,
+                    **kwargs,
+                )
+                path, ll_path = ls.viterbi(num_threads=num_threads, **kwargs)
+                self.assertAllClose(F, F_vs)
+                self.assertAllClose(c, c_vs)
+                self.assertAllClose(ll, ll_vs)
+                self.assertAllClose(B, B_vs)
+                self.assertAllClose(ll_path, viterbi_vs[4])
+                np.testing.assert_array_equal(path, path_vs)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("num_samples", [8, 16])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple(self, num_samples, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple(num_samples)
+        self.verify(ts, scale_mutation_rate, include_ancestors)
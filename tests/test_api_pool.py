@@ -0,0 +1,79 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+
+
+class TestSharedPanelPool(lsbase.LSBase):
+    def verify(self, H_vs, queries, ploidy, r, mu):
+        kwargs = {
+            "reference_panel": H_vs,
+            "query": queries,
+            "ploidy": ploidy,
+            "prob_recombination": r,
+            "prob_mutation": mu,
+        }
+        path_vs, ll_vs = ls.viterbi(**kwargs)
+        log_lik_vs = ls.log_likelihood(**kwargs)
+
+        with ls.SharedPanelPool(
+            H_vs, ploidy, r, prob_mutation=mu, num_workers=2, chunk_size=2
+        ) as pool:
+            path, ll = pool.viterbi(queries)
+            log_lik = pool.log_likelihood(queries)
+            posteriors, log_lik_post = pool.posteriors(queries)
+            # The pool can be reused, and other options are passed on.
+            path_tmp, ll_tmp = pool.viterbi(queries, lazy_rescaling=True)
+
+        if ploidy == 1:
+            np.testing.assert_array_equal(path, path_vs)
+        else:
+            for x, x_vs in zip(path, path_vs):
+                np.testing.assert_array_equal(x, x_vs)
+        self.assertAllClose(ll, ll_vs)
+        self.assertAllClose(log_lik, log_lik_vs)
+        self.assertAllClose(log_lik_post, log_lik_vs)
+        np.testing.assert_allclose(ll_tmp, ll_vs, rtol=1e-5)
+        for i in range(queries.shape[0]):
+            posteriors_vs, _ = ls.posteriors(
+                reference_panel=H_vs,
+                query=queries[i : i + 1],
+                ploidy=ploidy,
+                prob_recombination=r,
+                prob_mutation=mu,
+            )
+            self.assertAllClose(posteriors[i], posteriors_vs)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    def test_ts_simple_n10_no_recomb(self, ploidy):
+        ts = self.get_ts_simple_n10_no_recomb()
+        if ploidy == 1:
+            H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+            queries = np.concatenate(queries)
+        else:
+            H_vs, queries = self.get_examples_diploid(ts, include_ancestors=False)
+            queries = np.concatenate(
+                [core.convert_haplotypes_to_unphased_genotypes(q) for q in queries]
+            )
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        mu = np.zeros(m) + 0.01
+        self.verify(H_vs, queries, ploidy, r, mu)
+
+    def test_invalid_inputs(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        r = np.zeros(ts.num_sites) + 0.01
+        for num_workers in [0, 1.5]:
+            with pytest.raises(ValueError, match="Number of workers"):
+                ls.SharedPanelPool(H_vs, 1, r, num_workers=num_workers)
+        with pytest.raises(ValueError, match="Chunk size"):
+            ls.SharedPanelPool(H_vs, 1, r, chunk_size=0)
+        with ls.SharedPanelPool(H_vs, 1, r, prob_mutation=0.01, num_workers=1) as pool:
+            with pytest.raises(ValueError, match="incorrect dimensions"):
+                pool.viterbi(queries[0][0])
+            with pytest.raises(ValueError, match="not supported"):
+                pool.posteriors(queries[0], return_path=True)
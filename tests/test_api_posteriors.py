@@ -0,0 +1,115 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+
+
+class TestPosteriors(lsbase.ForwardBackwardAlgorithmBase):
+    def verify_single(self, ref_panel, query, ploidy, r, mu, scale_mutation_rate):
+        F, c, ll = ls.forwards(
+            reference_panel=ref_panel,
+            query=query,
+            ploidy=ploidy,
+            prob_recombination=r,
+            prob_mutation=mu,
+            scale_mutation_rate=scale_mutation_rate,
+            normalise=True,
+        )
+        B = ls.backwards(
+            reference_panel=ref_panel,
+            query=query,
+            ploidy=ploidy,
+            normalisation_factor_from_forward=c,
+            prob_recombination=r,
+            prob_mutation=mu,
+            scale_mutation_rate=scale_mutation_rate,
+        )
+        P, ll_p, path = ls.posteriors(
+            reference_panel=ref_panel,
+            query=query,
+            ploidy=ploidy,
+            prob_recombination=r,
+            prob_mutation=mu,
+            scale_mutation_rate=scale_mutation_rate,
+            return_path=True,
+        )
+        self.assertAllClose(P, F * B)
+        self.assertAllClose(ll_p, ll)
+        m = ref_panel.shape[0]
+        sum_axes = tuple(range(1, P.ndim))
+        self.assertAllClose(np.sum(P, axis=sum_axes), np.ones(m))
+        if ploidy == 1:
+            assert np.array_equal(path, np.argmax(F * B, axis=1))
+        else:
+            n = ref_panel.shape[1]
+            assert P.shape == (m, n, n)
+            assert np.array_equal(path[0].shape, (m,))
+            assert np.array_equal(path[1].shape, (m,))
+            for l in range(m):
+                self.assertAllClose(P[l, path[0][l], path[1][l]], np.max(P[l]))
+
+    def verify_batch(self, ref_panel, queries, ploidy, r, mu, scale_mutation_rate):
+        query_batch = np.concatenate(queries, axis=0)
+        if ploidy == 2:
+            query_batch = core.convert_haplotypes_to_unphased_genotypes(query_batch)
+        P, ll = ls.posteriors(
+            reference_panel=ref_panel,
+            query=query_batch,
+            ploidy=ploidy,
+            prob_recombination=r,
+            prob_mutation=mu,
+            scale_mutation_rate=scale_mutation_rate,
+        )
+        assert P.shape[0] == len(queries)
+        for i in range(len(queries)):
+            P_vs, ll_vs = ls.posteriors(
+                reference_panel=ref_panel,
+                query=query_batch[i : i + 1, :],
+                ploidy=ploidy,
+                prob_recombination=r,
+                prob_mutation=mu,
+                scale_mutation_rate=scale_mutation_rate,
+            )
+            self.assertAllClose(P[i], P_vs)
+            self.assertAllClose(ll[i], ll_vs)
+
+    def verify(self, ts, ploidy, scale_mutation_rate, include_ancestors):
+        if ploidy == 1:
+            H_vs, queries = self.get_examples_haploid(ts, include_ancestors)
+        else:
+            H_vs, queries = self.get_examples_diploid(ts, include_ancestors)
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        for mu in [np.zeros(m) + 0.01, None]:
+            for query in queries:
+                if ploidy == 2:
+                    query = core.convert_haplotypes_to_unphased_genotypes(query)
+                self.verify_single(H_vs, query, ploidy, r, mu, scale_mutation_rate)
+            self.verify_batch(H_vs, queries, ploidy, r, mu, scale_mutation_rate)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(
+        self, ploidy, scale_mutation_rate, include_ancestors
+    ):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, ploidy, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n8_high_recomb(
+        self, ploidy, scale_mutation_rate, include_ancestors
+    ):
+        ts = self.get_ts_simple_n8_high_recomb()
+        self.verify(ts, ploidy, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_multiallelic_n16(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_multiallelic(16)
+        self.verify(ts, 1, scale_mutation_rate, include_ancestors)
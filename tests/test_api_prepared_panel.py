@@ -0,0 +1,141 @@
+import concurrent.futures
+
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+
+
+class TestPreparedPanel(lsbase.LSBase):
+    def verify(self, ts, ploidy, include_ancestors):
+        for n, m, H_vs, query, e_vs, r, mu in self.get_examples_pars(
+            ts,
+            ploidy=ploidy,
+            scale_mutation_rate=True,
+            include_ancestors=include_ancestors,
+            include_extreme_rates=False,
+        ):
+            panel = ls.PreparedPanel(H_vs, ploidy)
+            assert panel.num_sites == m
+            assert panel.num_ref_haps == n
+            if ploidy == 1:
+                self.assertAllClose(
+                    panel.get_num_alleles(query), core.get_num_alleles(H_vs, query)
+                )
+            for reference_panel in [H_vs, panel]:
+                F, c, ll = ls.forwards(
+                    reference_panel=reference_panel,
+                    query=query,
+                    ploidy=ploidy,
+                    prob_recombination=r,
+                    prob_mutation=mu,
+                )
+                B = ls.backwards(
+                    reference_panel=reference_panel,
+                    query=query,
+                    ploidy=ploidy,
+                    normalisation_factor_from_forward=c,
+                    prob_recombination=r,
+                    prob_mutation=mu,
+                )
+                path, path_ll = ls.viterbi(
+                    reference_panel=reference_panel,
+                    query=query,
+                    ploidy=ploidy,
+                    prob_recombination=r,
+                    prob_mutation=mu,
+                )
+                path_ll_check = ls.path_loglik(
+                    reference_panel=reference_panel,
+                    query=query,
+                    ploidy=ploidy,
+                    path=path,
+                    prob_recombination=r,
+                    prob_mutation=mu,
+                )
+                if reference_panel is H_vs:
+                    F_vs, B_vs, ll_vs, path_ll_vs = F, B, ll, path_ll
+                else:
+                    self.assertAllClose(F, F_vs)
+                    self.assertAllClose(B, B_vs)
+                    self.assertAllClose(ll, ll_vs)
+                    self.assertAllClose(path_ll, path_ll_vs)
+                self.assertAllClose(path_ll, path_ll_check)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(self, ploidy, include_ancestors):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, ploidy, include_ancestors)
+
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_multiallelic_n16(self, include_ancestors):
+        ts = self.get_ts_multiallelic(16)
+        self.verify(ts, 1, include_ancestors)
+
+    def test_emission_matrix_is_cached(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        panel = ls.PreparedPanel(H, ploidy=1)
+        mu = np.zeros(ts.num_sites) + 0.01
+        num_alleles = panel.get_num_alleles(queries[0])
+        e_1 = panel.get_emission_matrix(mu, True, num_alleles)
+        e_2 = panel.get_emission_matrix(mu.copy(), True, num_alleles.copy())
+        e_3 = panel.get_emission_matrix(mu, False, num_alleles)
+        assert e_1 is e_2
+        assert e_1 is not e_3
+
+    def test_emission_matrix_cache_is_bounded(self):
+        ts = self.get_ts_multiallelic(16)
+        H, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        panel = ls.PreparedPanel(H, ploidy=1)
+        m = ts.num_sites
+        r = np.zeros(m) + 0.01
+        mu = np.zeros(m) + 0.01
+        rng = np.random.default_rng(42)
+        num_keys = set()
+        for _ in range(50):
+            # Queries with new alleles at random sites imply distinct allele counts.
+            query = queries[0].copy()
+            sites = rng.choice(m, size=3, replace=False)
+            query[0, sites] = np.max(H) + 1
+            num_keys.add(panel.get_num_alleles(query).tobytes())
+            ls.forwards(panel, query, ploidy=1, prob_recombination=r, prob_mutation=mu)
+            assert len(panel._emission_matrices) <= panel.max_cached_emission_matrices
+        assert len(num_keys) > panel.max_cached_emission_matrices
+        assert len(panel._emission_matrices) == panel.max_cached_emission_matrices
+
+    def test_emission_matrix_cache_threads(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H, _ = self.get_examples_haploid(ts, include_ancestors=False)
+        panel = ls.PreparedPanel(H, ploidy=1)
+        m = ts.num_sites
+        num_alleles = panel.get_num_alleles(H[:, :1].T)
+        # Distinct mutation probabilities give distinct keys.
+        mus = [
+            np.zeros(m) + 0.001 * (i + 1)
+            for i in range(4 * panel.max_cached_emission_matrices)
+        ]
+        expected = [panel.get_emission_matrix(mu, True, num_alleles) for mu in mus]
+
+        def get_all(offset):
+            for i in range(200):
+                j = (offset + i) % len(mus)
+                e = panel.get_emission_matrix(mus[j], True, num_alleles)
+                np.testing.assert_array_equal(e, expected[j])
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(get_all, offset) for offset in range(16)]
+            for future in futures:
+                future.result()
+        assert len(panel._emission_matrices) == panel.max_cached_emission_matrices
+
+    def test_ploidy_mismatch(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        panel = ls.PreparedPanel(H, ploidy=1)
+        with pytest.raises(ValueError):
+            ls.forwards(panel, queries[0], ploidy=2, prob_recombination=0.01)
@@ -0,0 +1,142 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+import lshmm.vit_diploid as vd
+
+
+class TestForwardBackwardUnorderedPairs(lsbase.ForwardBackwardAlgorithmBase):
+    def verify(self, ts, scale_mutation_rate, include_ancestors):
+        H_vs, queries = self.get_examples_diploid(ts, include_ancestors)
+        queries = [
+            core.convert_haplotypes_to_unphased_genotypes(query) for query in queries
+        ]
+        n = H_vs.shape[1]
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        for mu in [np.zeros(m) + 0.01, None]:
+            kwargs = {
+                "reference_panel": H_vs,
+                "ploidy": 2,
+                "prob_recombination": r,
+                "prob_mutation": mu,
+                "scale_mutation_rate": scale_mutation_rate,
+            }
+            query_batch = np.concatenate(queries, axis=0)
+            for query in queries + [query_batch]:
+                for normalise in [True, False]:
+                    F, c, ll = ls.forwards(query=query, normalise=normalise, **kwargs)
+                    F_u, c_u, ll_u = ls.forwards(
+                        query=query,
+                        normalise=normalise,
+                        unordered_pairs=True,
+                        **kwargs,
+                    )
+                    assert F_u.shape[-1] == n * (n + 1) // 2
+                    self.assertAllClose(core.unpack_unordered_pairs(F_u, n), F)
+                    self.assertAllClose(c_u, c)
+                    self.assertAllClose(ll_u, ll)
+                F, c, ll = ls.forwards(query=query, **kwargs)
+                B = ls.backwards(
+                    query=query, normalisation_factor_from_forward=c, **kwargs
+                )
+                B_u = ls.backwards(
+                    query=query,
+                    normalisation_factor_from_forward=c,
+                    unordered_pairs=True,
+                    **kwargs,
+                )
+                self.assertAllClose(core.unpack_unordered_pairs(B_u, n), B)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n8_high_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n8_high_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    def test_haploid(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        r = np.zeros(ts.num_sites) + 0.01
+        with pytest.raises(ValueError, match="ploidy 2"):
+            ls.forwards(
+                reference_panel=H_vs,
+                query=queries[0],
+                ploidy=1,
+                prob_recombination=r,
+                unordered_pairs=True,
+            )
+
+
+class TestViterbiUnorderedPairs(lsbase.ViterbiAlgorithmBase):
+    def verify(self, ts, scale_mutation_rate, include_ancestors):
+        H_vs, queries = self.get_examples_diploid(ts, include_ancestors)
+        queries = [
+            core.convert_haplotypes_to_unphased_genotypes(query) for query in queries
+        ]
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        for mu in [np.zeros(m) + 0.01, None]:
+            kwargs = {
+                "reference_panel": H_vs,
+                "ploidy": 2,
+                "prob_recombination": r,
+                "prob_mutation": mu,
+                "scale_mutation_rate": scale_mutation_rate,
+            }
+            for query in queries:
+                _, ll = ls.viterbi(query=query, **kwargs)
+                path_u, ll_u = ls.viterbi(query=query, unordered_pairs=True, **kwargs)
+                self.assertAllClose(ll_u, ll)
+                # Ties between paths may be broken differently.
+                path_ll_u = ls.path_loglik(query=query, path=path_u, **kwargs)
+                self.assertAllClose(path_ll_u, ll)
+            query_batch = np.concatenate(queries, axis=0)
+            paths_u, ll_u = ls.viterbi(
+                query=query_batch, unordered_pairs=True, **kwargs
+            )
+            for i, query in enumerate(queries):
+                path_vs, ll_vs = ls.viterbi(query=query, unordered_pairs=True, **kwargs)
+                self.assertAllClose(ll_u[i], ll_vs)
+                self.assertAllClose(paths_u[0][i], path_vs[0])
+                self.assertAllClose(paths_u[1][i], path_vs[1])
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n8_high_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n8_high_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    def test_get_phased_path(self):
+        n = 4
+        path = np.array(
+            [
+                core.get_unordered_pair_index(n, 0, 2),
+                core.get_unordered_pair_index(n, 2, 3),
+                core.get_unordered_pair_index(n, 1, 3),
+                core.get_unordered_pair_index(n, 1, 1),
+            ]
+        )
+        path_1, path_2 = vd.get_phased_path(n, path, unordered_pairs=True)
+        np.testing.assert_array_equal(path_1, [0, 3, 3, 1])
+        np.testing.assert_array_equal(path_2, [2, 2, 1, 1])
+        paths_1, paths_2 = vd.get_phased_path(
+            n, np.stack([path, path]), unordered_pairs=True
+        )
+        np.testing.assert_array_equal(paths_1, [path_1, path_1])
+        np.testing.assert_array_equal(paths_2, [path_2, path_2])
@@ -0,0 +1,87 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.checkpointing as checkpointing
+
+
+class TestViterbiCheckpointing(lsbase.ViterbiAlgorithmBase):
+    def verify(self, ts, ploidy, scale_mutation_rate, include_ancestors):
+        for n, m, H_vs, query, _, r, mu in self.get_examples_pars(
+            ts,
+            ploidy=ploidy,
+            scale_mutation_rate=scale_mutation_rate,
+            include_ancestors=include_ancestors,
+            include_extreme_rates=True,
+        ):
+            kwargs = {
+                "reference_panel": H_vs,
+                "query": query,
+                "ploidy": ploidy,
+                "prob_recombination": r,
+                "prob_mutation": mu,
+                "scale_mutation_rate": scale_mutation_rate,
+            }
+            path_vs, ll_vs = ls.viterbi(**kwargs)
+            for checkpoint_interval in [None, 1, 3, m]:
+                path, ll = ls.viterbi(
+                    checkpoint=True, checkpoint_interval=checkpoint_interval, **kwargs
+                )
+                self.assertAllClose(ll_vs, ll)
+                self.assertAllClose(path_vs, path)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(
+        self, ploidy, scale_mutation_rate, include_ancestors
+    ):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, ploidy, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n8_high_recomb(
+        self, ploidy, scale_mutation_rate, include_ancestors
+    ):
+        ts = self.get_ts_simple_n8_high_recomb()
+        self.verify(ts, ploidy, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    def test_checkpoint_interval(self, ploidy):
+        num_sites = 10_000
+        num_ref_haps = 100
+        interval = checkpointing.get_viterbi_checkpoint_interval(
+            num_sites, num_ref_haps, ploidy
+        )
+        memory = checkpointing.get_viterbi_memory(
+            num_sites, num_ref_haps, ploidy, interval
+        )
+        for other_interval in [1, interval - 1, interval + 1, num_sites]:
+            assert memory <= checkpointing.get_viterbi_memory(
+                num_sites, num_ref_haps, ploidy, other_interval
+            )
+        with pytest.raises(ValueError, match="maximum"):
+            checkpointing.get_viterbi_checkpoint_interval(
+                num_sites, num_ref_haps, ploidy, max_memory=memory - 1
+            )
+
+    def test_errors(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        r = np.zeros(ts.num_sites) + 0.01
+        kwargs = {
+            "reference_panel": H_vs,
+            "ploidy": 1,
+            "prob_recombination": r,
+            "checkpoint": True,
+        }
+        with pytest.raises(ValueError, match="Multiple queries"):
+            ls.viterbi(query=np.concatenate(queries, axis=0), **kwargs)
+        with pytest.raises(ValueError, match="maximum"):
+            ls.viterbi(query=queries[0], max_memory=1, **kwargs)
+        with pytest.raises(ValueError, match="positive"):
+            ls.viterbi(query=queries[0], checkpoint_interval=0, **kwargs)
@@ -2,7 +2,6 @@ import pytest
 
 from . import lsbase
 import lshmm as ls
-import lshmm.core as core
 import lshmm.vit_diploid as vd
 
 
@@ -16,12 +15,10 @@ class TestViterbiDiploid(lsbase.ViterbiAlgorithmBase):
             include_ancestors=include_ancestors,
             include_extreme_rates=True,
         ):
-            G_vs = core.convert_haplotypes_to_phased_genotypes(H_vs)
-
             V_vs, P_vs, ll_vs = vd.forwards_viterbi_dip_low_mem(
                 n=n,
                 m=m,
-                G=G_vs,
+                H=H_vs,
                 s=query,
                 e=e_vs,
                 r=r,
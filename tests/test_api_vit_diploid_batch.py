@@ -0,0 +1,54 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+
+
+class TestViterbiDiploidBatch(lsbase.ViterbiAlgorithmBase):
+    def verify(self, ts, scale_mutation_rate, include_ancestors):
+        ploidy = 2
+        H_vs, queries = self.get_examples_diploid(ts, include_ancestors)
+        query_batch = core.convert_haplotypes_to_unphased_genotypes(
+            np.concatenate(queries, axis=0)
+        )
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        for mu in [np.zeros(m) + 0.01, None]:
+            path, ll = ls.viterbi(
+                reference_panel=H_vs,
+                query=query_batch,
+                ploidy=ploidy,
+                prob_recombination=r,
+                prob_mutation=mu,
+                scale_mutation_rate=scale_mutation_rate,
+            )
+            assert path[0].shape == (len(queries), m)
+            assert path[1].shape == (len(queries), m)
+            assert ll.shape == (len(queries),)
+            for i in range(len(queries)):
+                path_vs, ll_vs = ls.viterbi(
+                    reference_panel=H_vs,
+                    query=query_batch[[i]],
+                    ploidy=ploidy,
+                    prob_recombination=r,
+                    prob_mutation=mu,
+                    scale_mutation_rate=scale_mutation_rate,
+                )
+                self.assertAllClose(ll[i], ll_vs)
+                self.assertAllClose(path[0][i], path_vs[0])
+                self.assertAllClose(path[1][i], path_vs[1])
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n8_high_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n8_high_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
@@ -0,0 +1,49 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+
+
+class TestViterbiHaploidBatch(lsbase.ViterbiAlgorithmBase):
+    def verify(self, ts, scale_mutation_rate, include_ancestors):
+        ploidy = 1
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors)
+        query_batch = np.concatenate(queries, axis=0)
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        for mu in [np.zeros(m) + 0.01, None]:
+            path, ll = ls.viterbi(
+                reference_panel=H_vs,
+                query=query_batch,
+                ploidy=ploidy,
+                prob_recombination=r,
+                prob_mutation=mu,
+                scale_mutation_rate=scale_mutation_rate,
+            )
+            assert path.shape == (len(queries), m)
+            assert ll.shape == (len(queries),)
+            for i, query in enumerate(queries):
+                path_vs, ll_vs = ls.viterbi(
+                    reference_panel=H_vs,
+                    query=query,
+                    ploidy=ploidy,
+                    prob_recombination=r,
+                    prob_mutation=mu,
+                    scale_mutation_rate=scale_mutation_rate,
+                )
+                self.assertAllClose(ll[i], ll_vs)
+                self.assertAllClose(path[i], path_vs)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_multiallelic_n16(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_multiallelic(16)
+        self.verify(ts, scale_mutation_rate, include_ancestors)
@@ -0,0 +1,108 @@
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.core as core
+
+
+class TestViterbiHaploidSparse(lsbase.ViterbiAlgorithmBase):
+    def verify(self, ts, scale_mutation_rate, include_ancestors):
+        ploidy = 1
+        for n, m, H_vs, s, e_vs, r, mu in self.get_examples_pars(
+            ts,
+            ploidy=ploidy,
+            scale_mutation_rate=scale_mutation_rate,
+            include_ancestors=include_ancestors,
+            include_extreme_rates=True,
+        ):
+            kwargs = {
+                "reference_panel": ls.prepare_panel(H_vs, ploidy),
+                "query": s,
+                "ploidy": ploidy,
+                "prob_recombination": r,
+                "prob_mutation": mu,
+                "scale_mutation_rate": scale_mutation_rate,
+            }
+            path_vs, ll_vs = ls.viterbi(**kwargs)
+            path, ll = ls.viterbi(sparse=True, **kwargs)
+            self.assertAllClose(ll, ll_vs)
+            self.assertAllClose(path, path_vs)
+
+    def verify_batch(self, ts, include_ancestors):
+        ploidy = 1
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors)
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        kwargs = {
+            "reference_panel": H_vs,
+            "ploidy": ploidy,
+            "prob_recombination": r,
+            "prob_mutation": np.zeros(m) + 0.01,
+        }
+        query_batch = np.concatenate(queries, axis=0)
+        paths, ll = ls.viterbi(query=query_batch, sparse=True, **kwargs)
+        for i, query in enumerate(queries):
+            path_vs, ll_vs = ls.viterbi(query=query, **kwargs)
+            self.assertAllClose(ll[i], ll_vs)
+            self.assertAllClose(paths[i], path_vs)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n10_no_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n10_no_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("num_samples", [8, 16])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple(self, num_samples, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple(num_samples)
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_simple_n8_high_recomb(self, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_simple_n8_high_recomb()
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("num_samples", [4, 8])
+    @pytest.mark.parametrize("scale_mutation_rate", [True, False])
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_ts_multiallelic(self, num_samples, scale_mutation_rate, include_ancestors):
+        ts = self.get_ts_multiallelic(num_samples)
+        self.verify(ts, scale_mutation_rate, include_ancestors)
+
+    @pytest.mark.parametrize("include_ancestors", [True, False])
+    def test_batch(self, include_ancestors):
+        ts = self.get_ts_simple(8)
+        self.verify_batch(ts, include_ancestors)
+
+    def test_checkpoint(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        r = np.zeros(ts.num_sites) + 0.01
+        with pytest.raises(ValueError, match="checkpointing"):
+            ls.viterbi(
+                reference_panel=H_vs,
+                query=queries[0],
+                ploidy=1,
+                prob_recombination=r,
+                checkpoint=True,
+                sparse=True,
+            )
+
+    def test_diploid(self):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H_vs, queries = self.get_examples_diploid(ts, include_ancestors=False)
+        query = core.convert_haplotypes_to_unphased_genotypes(queries[0])
+        r = np.zeros(ts.num_sites) + 0.01
+        with pytest.raises(ValueError, match="ploidy 1"):
+            ls.viterbi(
+                reference_panel=H_vs,
+                query=query,
+                ploidy=2,
+                prob_recombination=r,
+                sparse=True,
+            )
@@ -0,0 +1,121 @@
+import json
+import os
+
+import pytest
+
+import numpy as np
+
+from . import lsbase
+import lshmm as ls
+import lshmm.cli as cli
+import lshmm.core as core
+
+
+class TestCli(lsbase.LSBase):
+    def run_cli(self, tmp_path, H_vs, queries, ploidy, *extra_args):
+        # Write the inputs only once, as a job is not resumed if they are replaced.
+        if not os.path.exists(tmp_path / "panel.npy"):
+            np.save(tmp_path / "panel.npy", H_vs)
+            np.save(tmp_path / "query.npy", queries)
+        cli.main(
+            [
+                str(tmp_path / "panel.npy"),
+                str(tmp_path / "query.npy"),
+                str(tmp_path / "out"),
+                "--ploidy",
+                str(ploidy),
+                "--prob-recombination",
+                "0.01",
+                "--prob-mutation",
+                "0.01",
+                "--shard-size",
+                "3",
+                "--num-workers",
+                "1",
+                "--quiet",
+                *extra_args,
+            ]
+        )
+        with open(tmp_path / "out" / cli.MANIFEST_FILE) as f:
+            return json.load(f)
+
+    def load_results(self, tmp_path, num_shards):
+        results = {}
+        for shard in range(num_shards):
+            with np.load(tmp_path / "out" / cli.get_shard_file(shard)) as data:
+                for key in data.files:
+                    results.setdefault(key, []).append(data[key])
+        return {key: np.concatenate(x) for key, x in results.items()}
+
+    @pytest.mark.parametrize("ploidy", [1, 2])
+    def test_ts_simple_n10_no_recomb(self, tmp_path, ploidy):
+        ts = self.get_ts_simple_n10_no_recomb()
+        if ploidy == 1:
+            H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+            queries = np.concatenate(queries)
+        else:
+            H_vs, queries = self.get_examples_diploid(ts, include_ancestors=False)
+            queries = np.concatenate(
+                [core.convert_haplotypes_to_unphased_genotypes(q) for q in queries]
+            )
+        m = ts.num_sites
+        r = np.append([0], np.zeros(m - 1) + 0.01)
+        manifest = self.run_cli(tmp_path, H_vs, queries, ploidy, "--posteriors")
+        num_shards = -(-queries.shape[0] // 3)
+        assert manifest["num_shards"] == num_shards
+        assert manifest["completed_shards"] == list(range(num_shards))
+
+        results = self.load_results(tmp_path, num_shards)
+        kwargs = {
+            "reference_panel": H_vs,
+            "query": queries,
+            "ploidy": ploidy,
+            "prob_recombination": r,
+            "prob_mutation": 0.01,
+        }
+        path, ll = ls.viterbi(**kwargs)
+        if ploidy == 2:
+            path = np.stack(path, axis=1)
+        np.testing.assert_array_equal(results["query_index"], np.arange(len(queries)))
+        np.testing.assert_array_equal(results["path"], path)
+        self.assertAllClose(results["path_log_lik"], ll)
+        self.assertAllClose(results["log_lik"], ls.log_likelihood(**kwargs))
+        for i in range(queries.shape[0]):
+            posteriors, _ = ls.posteriors(
+                reference_panel=H_vs,
+                query=queries[i : i + 1],
+                ploidy=ploidy,
+                prob_recombination=r,
+                prob_mutation=0.01,
+            )
+            self.assertAllClose(results["posteriors"][i], posteriors)
+
+    def test_resume(self, tmp_path):
+        ts = self.get_ts_simple_n10_no_recomb()
+        H_vs, queries = self.get_examples_haploid(ts, include_ancestors=False)
+        queries = np.concatenate(queries)
+        self.run_cli(tmp_path, H_vs, queries, 1)
+        results = self.load_results(tmp_path, 2)
+        shard_files = [tmp_path / "out" / cli.get_shard_file(i) for i in range(2)]
+        mtime = os.path.getmtime(shard_files[0])
+
+        # Only the shard whose results are missing is run again.
+        os.remove(shard_files[1])
+        manifest = self.run_cli(tmp_path, H_vs, queries, 1)
+        assert manifest["completed_shards"] == [0, 1]
+        assert os.path.getmtime(shard_files[0]) == mtime
+        results_tmp = self.load_results(tmp_path, 2)
+        for key, x in results.items():
+            np.testing.assert_array_equal(results_tmp[key], x)
+
+        # The results of a different job are not overwritten.
+        with pytest.raises(SystemExit):
+            self.run_cli(tmp_path, H_vs, queries, 1, "--log-likelihood")
+
+        # A job whose query file has been replaced is not resumed.
+        query_file = tmp_path / "query.npy"
+        stat = os.stat(query_file)
+        np.save(query_file, queries[::-1])
+        os.utime(query_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        with pytest.raises(SystemExit):
+            self.run_cli(tmp_path, H_vs, queries, 1)
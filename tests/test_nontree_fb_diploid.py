@@ -33,9 +33,9 @@ class TestNonTreeForwardBackwardDiploid(lsbase.ForwardBackwardAlgorithmBase):
             self.assertAllClose(np.sum(F_vs * B_vs, (1, 2)), np.ones(m))
 
             F_tmp, c_tmp, ll_tmp = fbd.forward_ls_dip_loop(
-                n, m, G_vs, query, e_vs, r, norm=True
+                n, m, H_vs, query, e_vs, r, norm=True
             )
-            B_tmp = fbd.backward_ls_dip_loop(n, m, G_vs, query, e_vs, c_tmp, r)
+            B_tmp = fbd.backward_ls_dip_loop(n, m, H_vs, query, e_vs, c_tmp, r)
             self.assertAllClose(np.sum(F_tmp * B_tmp, (1, 2)), np.ones(m))
             self.assertAllClose(ll_vs, ll_tmp)
 
@@ -51,10 +51,10 @@ class TestNonTreeForwardBackwardDiploid(lsbase.ForwardBackwardAlgorithmBase):
                     self.assertAllClose(ll_vs, ll_tmp)
 
                 F_tmp, c_tmp, ll_tmp = fbd.forward_ls_dip_loop(
-                    n, m, G_vs, query, e_vs, r, norm=False
+                    n, m, H_vs, query, e_vs, r, norm=False
                 )
                 if ll_tmp != -np.inf:
-                    B_tmp = fbd.backward_ls_dip_loop(n, m, G_vs, query, e_vs, c_tmp, r)
+                    B_tmp = fbd.backward_ls_dip_loop(n, m, H_vs, query, e_vs, c_tmp, r)
                     self.assertAllClose(
                         np.log10(np.sum(F_tmp * B_tmp, (1, 2))), ll_tmp * np.ones(m)
                     )
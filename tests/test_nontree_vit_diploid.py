@@ -20,11 +20,11 @@ class TestNonTreeViterbiDiploid(lsbase.ViterbiAlgorithmBase):
             G_vs = core.convert_haplotypes_to_phased_genotypes(H_vs)
 
             V_vs, P_vs, ll_vs = vd.forwards_viterbi_dip_low_mem(
-                n, m, G_vs, query, e_vs, r
+                n, m, H_vs, query, e_vs, r
             )
             path_vs = vd.backwards_viterbi_dip(m, V_vs, P_vs)
             phased_path_vs = vd.get_phased_path(n, path_vs)
-            path_ll_vs = vd.path_ll_dip(n, m, G_vs, phased_path_vs, query, e_vs, r)
+            path_ll_vs = vd.path_ll_dip(n, m, H_vs, phased_path_vs, query, e_vs, r)
             self.assertAllClose(ll_vs, path_ll_vs)
 
             (
@@ -46,10 +46,24 @@ class TestNonTreeViterbiDiploid(lsbase.ViterbiAlgorithmBase):
                 V_tmp,
             )
             phased_path_tmp = vd.get_phased_path(n, path_tmp)
-            path_ll_tmp = vd.path_ll_dip(n, m, G_vs, phased_path_tmp, query, e_vs, r)
+            path_ll_tmp = vd.path_ll_dip(n, m, H_vs, phased_path_tmp, query, e_vs, r)
             self.assertAllClose(ll_tmp, path_ll_tmp)
             self.assertAllClose(ll_vs, ll_tmp)
 
+            (
+                V_tmp,
+                P_packed_tmp,
+                V_argmaxes_tmp,
+                V_rowcol_argmaxes_tmp,
+                ll_tmp,
+            ) = vd.forwards_viterbi_dip_low_mem_packed(n, m, H_vs, query, e_vs, r)
+            path_tmp = vd.backwards_viterbi_dip_packed(
+                m, V_tmp, P_packed_tmp, V_argmaxes_tmp, V_rowcol_argmaxes_tmp
+            )
+            assert P_packed_tmp.nbytes * 32 <= P_vs.nbytes + 32 * m
+            self.assertAllClose(ll_vs, ll_tmp)
+            self.assertAllClose(path_vs, path_tmp)
+
             MAX_NUM_REF_HAPS = 50
             num_ref_haps = H_vs.shape[1]
             if num_ref_haps <= MAX_NUM_REF_HAPS:
@@ -60,7 +74,7 @@ class TestNonTreeViterbiDiploid(lsbase.ViterbiAlgorithmBase):
                 path_tmp = vd.backwards_viterbi_dip(m, V_tmp[m - 1, :, :], P_tmp)
                 phased_path_tmp = vd.get_phased_path(n, path_tmp)
                 path_ll_tmp = vd.path_ll_dip(
-                    n, m, G_vs, phased_path_tmp, query, e_vs, r
+                    n, m, H_vs, phased_path_tmp, query, e_vs, r
                 )
                 self.assertAllClose(ll_tmp, path_ll_tmp)
                 self.assertAllClose(ll_vs, ll_tmp)
@@ -71,7 +85,7 @@ class TestNonTreeViterbiDiploid(lsbase.ViterbiAlgorithmBase):
                 path_tmp = vd.backwards_viterbi_dip(m, V_tmp, P_tmp)
                 phased_path_tmp = vd.get_phased_path(n, path_tmp)
                 path_ll_tmp = vd.path_ll_dip(
-                    n, m, G_vs, phased_path_tmp, query, e_vs, r
+                    n, m, H_vs, phased_path_tmp, query, e_vs, r
                 )
                 self.assertAllClose(ll_tmp, path_ll_tmp)
                 self.assertAllClose(ll_vs, ll_tmp)
@@ -82,7 +96,7 @@ class TestNonTreeViterbiDiploid(lsbase.ViterbiAlgorithmBase):
                 path_tmp = vd.backwards_viterbi_dip(m, V_tmp[m - 1, :, :], P_tmp)
                 phased_path_tmp = vd.get_phased_path(n, path_tmp)
                 path_ll_tmp = vd.path_ll_dip(
-                    n, m, G_vs, phased_path_tmp, query, e_vs, r
+                    n, m, H_vs, phased_path_tmp, query, e_vs, r
                 )
                 self.assertAllClose(ll_tmp, path_ll_tmp)
                 self.assertAllClose(ll_vs, ll_tmp)
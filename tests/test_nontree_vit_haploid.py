@@ -165,6 +165,71 @@ class TestNonTreeViterbiHaploid(lsbase.ViterbiAlgorithmBase):
             self.assertAllClose(ll_tmp, ll_check)
             self.assertAllClose(ll_vs, ll_tmp)
 
+            (
+                V_compact,
+                V_argmaxes_tmp,
+                recomb_offsets,
+                recomb_haps,
+                ll_compact,
+            ) = vh.forwards_viterbi_hap_lower_mem_rescaling_compact(
+                n=n,
+                m=m,
+                H=H_vs,
+                s=s,
+                e=e_vs,
+                r=r,
+                emission_func=emission_func,
+            )
+            path_compact = vh.backwards_viterbi_hap_compact(
+                m=m,
+                V_last=V_compact,
+                V_argmaxes=V_argmaxes_tmp,
+                recomb_offsets=recomb_offsets,
+                recomb_haps=recomb_haps,
+            )
+            assert recomb_offsets[m] == len(recomb_haps)
+            self.assertAllClose(ll_tmp, ll_compact)
+            self.assertAllClose(path_tmp, path_compact)
+
+            major_alleles, minor_offsets, minor_haps = core.get_minor_allele_index(H_vs)
+            (
+                V_sparse,
+                V_argmaxes_tmp,
+                floor_recombs,
+                switch_offsets,
+                switch_haps,
+                ll_sparse,
+            ) = vh.forwards_viterbi_hap_sparse(
+                n=n,
+                m=m,
+                H=H_vs,
+                s=s,
+                e=e_vs,
+                r=r,
+                emission_func=emission_func,
+                major_alleles=major_alleles,
+                minor_offsets=minor_offsets,
+                minor_haps=minor_haps,
+            )
+            path_sparse = vh.backwards_viterbi_hap_sparse(
+                m=m,
+                V_last=V_sparse,
+                V_argmaxes=V_argmaxes_tmp,
+                floor_recombs=floor_recombs,
+                switch_offsets=switch_offsets,
+                switch_haps=switch_haps,
+            )
+            P_sparse = vh.get_pointers_hap_sparse(
+                n, m, V_argmaxes_tmp, floor_recombs, switch_offsets, switch_haps
+            )
+            self.assertAllClose(V_sparse, V_tmp)
+            self.assertAllClose(P_sparse[1:], P_tmp[1:])
+            self.assertAllClose(ll_tmp, ll_sparse)
+            self.assertAllClose(path_tmp, path_sparse)
+            self.assertAllClose(
+                path_tmp, vh.backwards_viterbi_hap(m, V_sparse, P_sparse)
+            )
+
             (
                 V_tmp,
                 V_argmaxes_tmp,